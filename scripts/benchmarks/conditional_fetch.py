@@ -0,0 +1,156 @@
+import argparse
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from google.transit import gtfs_realtime_pb2
+
+from src.fetch.transit_feed import NOT_MODIFIED, ConditionalFeedFetcher, peek_feed_header
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Check ConditionalFeedFetcher against a local HTTP server answering with ETags and 304s"
+    )
+    parser.add_argument(
+        "--feeds-dir", type=Path,
+        help="Directory of recorded .pb snapshots of one feed, served in name order, synthetic ones if not given"
+    )
+    return parser.parse_args()
+
+
+def synthetic_snapshots(count: int = 3, num_vehicles: int = 200) -> list[bytes]:
+    snapshots = []
+    for i in range(count):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = "2.0"
+        feed.header.timestamp = 1_760_000_000 + 30 * i
+        for v in range(num_vehicles):
+            entity = feed.entity.add()
+            entity.id = f"vehicle_{v}"
+            entity.vehicle.vehicle.id = f"V{v:04d}"
+            entity.vehicle.trip.trip_id = f"T{v:05d}"
+            entity.vehicle.position.latitude = 47.5 + v * 1e-4
+            entity.vehicle.position.longitude = 19.0 + i * 1e-4
+            entity.vehicle.timestamp = feed.header.timestamp
+        snapshots.append(feed.SerializeToString())
+    return snapshots
+
+
+class FeedServer(ThreadingHTTPServer):
+    """Serves `content` with the `etag` set, and 304 to requests that already have it."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FeedHandler)
+        self.content = b""
+        self.etag = None
+        self.requests = []
+
+    def serve(self, content: bytes, etag: str | None):
+        self.content, self.etag = content, etag
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/VehiclePositions.pb"
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("If-None-Match")))
+        if self.server.etag is not None and self.headers.get("If-None-Match") == self.server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        if self.server.etag is not None:
+            self.send_header("ETag", self.server.etag)
+        self.send_header("Content-Length", str(len(self.server.content)))
+        self.end_headers()
+        self.wfile.write(self.server.content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def expect(fetcher: ConditionalFeedFetcher, expected, **counters):
+    result = fetcher.fetch()
+    if expected is NOT_MODIFIED or expected is None:
+        ok = result is expected
+    else:
+        ok = isinstance(result, gtfs_realtime_pb2.FeedMessage) and result.SerializeToString() == expected
+    if not ok:
+        raise AssertionError(f"Unexpected fetch result {type(result).__name__}, stats: {fetcher.stats}")
+    for name, value in counters.items():
+        if getattr(fetcher.stats, name) != value:
+            raise AssertionError(f"Expected {value} {name}, stats: {fetcher.stats}")
+
+
+def main():
+    args = parse_args()
+    if args.feeds_dir is not None:
+        snapshots = [path.read_bytes() for path in sorted(args.feeds_dir.glob("*.pb"))]
+    else:
+        snapshots = synthetic_snapshots()
+    headers = [peek_feed_header(content) for content in snapshots]
+    timestamps = [header.timestamp for header in headers]
+    if len(snapshots) < 2 or len(set(timestamps[:2])) < 2:
+        raise AssertionError("The check needs two snapshots with different header timestamps")
+    for content, header in zip(snapshots, headers):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(content)
+        if header != feed.header:
+            raise AssertionError(f"The peeked header differs from the parsed one: {header} != {feed.header}")
+    print(f"peek_feed_header matches the parsed header of {len(snapshots)} snapshots")
+
+    # The failed fetches are intended
+    logging.getLogger("src.fetch.transit_feed").setLevel(logging.CRITICAL)
+    # The local server needs no key, a missing one must not fail the requests
+    os.environ.pop("BKK_API_KEY", None)
+    server = FeedServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        first, second = snapshots[:2]
+        fetcher = ConditionalFeedFetcher("vehicle_pos", url=server.url)
+
+        server.serve(first, etag='"1"')
+        expect(fetcher, first, requests=1, not_modified=0)
+        if "key=" in server.requests[-1][0]:
+            raise AssertionError(f"A key was sent without one being set: {server.requests[-1][0]}")
+        # The server answers the ETag of the parsed snapshot with a 304
+        expect(fetcher, NOT_MODIFIED, requests=2, not_modified=1)
+        # The same snapshot under a new ETag is dropped by its header timestamp
+        server.serve(first, etag='"2"')
+        expect(fetcher, NOT_MODIFIED, requests=3, not_modified=1, unchanged=1)
+        # A snapshot failing to parse is not remembered, neither its ETag nor its header timestamp
+        server.serve(second[:len(second) // 2], etag='"3"')
+        expect(fetcher, None, requests=4, errors=1)
+        if server.requests[-1][1] != '"1"':
+            raise AssertionError(f"Expected the ETag of the last parsed snapshot, sent {server.requests[-1][1]}")
+        server.serve(second, etag='"3"')
+        expect(fetcher, second, requests=5, not_modified=1, unchanged=1, errors=1)
+        expect(fetcher, NOT_MODIFIED, requests=6, not_modified=2)
+        # Without ETags only the header timestamps skip snapshots
+        server.serve(second, etag=None)
+        expect(fetcher, NOT_MODIFIED, requests=7, not_modified=2, unchanged=2)
+    finally:
+        server.shutdown()
+        server.server_close()
+    print(f"conditional requests: {fetcher.stats}")
+
+    # The feed's own URL still requires a key, a missing one is an error and not an exception
+    fetcher = ConditionalFeedFetcher("vehicle_pos")
+    expect(fetcher, None, requests=1, errors=1)
+    print("a missing key fails the requests of the feed's own URL")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
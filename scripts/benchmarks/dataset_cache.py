@@ -0,0 +1,49 @@
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from src.data import load_dataset
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare building DelayPredictionDataset from the processed data with loading it from the cache"
+    )
+    parser.add_argument("--data-dir", type=Path, default=Path("data/processed/"), help="Directory of the processed data")
+    parser.add_argument("--repeat", type=int, default=3, help="Loads from the cache, the fastest is reported")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start_time = time.perf_counter()
+        built = load_dataset(args.data_dir, cache_dir)
+        cold = time.perf_counter() - start_time
+        if len(built) == 0:
+            raise AssertionError("The dataset has no samples, the comparison would be vacuous")
+
+        warm = float("inf")
+        for _ in range(args.repeat):
+            start_time = time.perf_counter()
+            cached = load_dataset(args.data_dir, cache_dir)
+            warm = min(warm, time.perf_counter() - start_time)
+        if not (built.stops_df.equals(cached.stops_df) and built.pos_df.equals(cached.pos_df)):
+            raise AssertionError("The cached dataset differs from the built one")
+
+    print(f"{len(built):,} samples")
+    print(f"{'built':<10}{cold:>8.2f} s")
+    print(f"{'cached':<10}{warm:>8.2f} s  (x{cold / warm:.1f})")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
@@ -0,0 +1,62 @@
+import argparse
+import logging
+from pathlib import Path
+
+from scripts.benchmarks.decode_vehicle_positions import benchmark, load_feeds, record_feeds
+from src.fetch.trip_updates import decode_trip_updates
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Measure the throughput of the columnar TripUpdates decoder on recorded feeds"
+    )
+    parser.add_argument(
+        "--feeds-dir", type=Path, required=True,
+        help="Directory containing recorded TripUpdates '.pb' files"
+    )
+    parser.add_argument(
+        "--record", type=int, default=0,
+        help="Record this many live snapshots into --feeds-dir before benchmarking"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=15.0,
+        help="Poll interval in seconds, used between recordings and as the time budget of one decode"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=10,
+        help="Number of times each feed is decoded"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.record > 0:
+        record_feeds(args.feeds_dir, args.record, args.interval, feed_type="trip_updates")
+
+    feeds = load_feeds(args.feeds_dir)
+    num_entities = sum(len(feed.entity) for feed in feeds)
+    num_rows = sum(decode_trip_updates(feed).num_rows for feed in feeds)
+    logger.info(
+        f"Loaded {len(feeds)} feeds with {num_entities:,} trip updates "
+        f"and {num_rows:,} stop time update rows in total"
+    )
+
+    elapsed = benchmark(decode_trip_updates, feeds, args.repeat)
+    per_feed = elapsed / (args.repeat * len(feeds))
+    print(
+        f"decode_trip_updates: {per_feed * 1000:.2f} ms/feed, "
+        f"{num_rows * args.repeat / elapsed:,.0f} rows/s, "
+        f"{per_feed / args.interval:.1%} of the {args.interval:g}s poll interval"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
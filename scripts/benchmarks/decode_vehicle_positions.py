@@ -0,0 +1,106 @@
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from google.transit import gtfs_realtime_pb2
+
+from src.fetch.transit_feed import fetch_trainsit_feed
+from src.fetch.vehicle_positions import decode_vehicle_positions, parse_vehicle_positions
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the pandas and the columnar VehiclePositions decoders on recorded feeds"
+    )
+    parser.add_argument(
+        "--feeds-dir", type=Path, required=True,
+        help="Directory containing recorded VehiclePositions '.pb' files"
+    )
+    parser.add_argument(
+        "--record", type=int, default=0,
+        help="Record this many live snapshots into --feeds-dir before benchmarking"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=15.0,
+        help="Seconds to wait between recorded snapshots"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=10,
+        help="Number of times each feed is decoded by each implementation"
+    )
+    return parser.parse_args()
+
+
+def record_feeds(feeds_dir: Path, count: int, interval: float, feed_type: str = "vehicle_pos"):
+    feeds_dir.mkdir(parents=True, exist_ok=True)
+    for i in range(count):
+        feed = fetch_trainsit_feed(feed_type=feed_type)
+        if feed is not None:
+            file_path = feeds_dir / f"{feed_type}_{feed.header.timestamp}.pb"
+            file_path.write_bytes(feed.SerializeToString())
+            logger.info(f"Recorded {len(feed.entity)} entities to: {file_path}")
+        if i + 1 < count:
+            time.sleep(interval)
+
+
+def load_feeds(feeds_dir: Path) -> list:
+    feeds = []
+    for file_path in sorted(feeds_dir.glob("*.pb")):
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(file_path.read_bytes())
+        feeds.append(feed)
+    if not feeds:
+        raise FileNotFoundError(f"No '.pb' files found in: {feeds_dir}")
+    return feeds
+
+
+def benchmark(decode, feeds: list, repeat: int) -> float:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for feed in feeds:
+            decode(feed)
+    return time.perf_counter() - start_time
+
+
+def main():
+    args = parse_args()
+    if args.record > 0:
+        record_feeds(args.feeds_dir, args.record, args.interval)
+
+    feeds = load_feeds(args.feeds_dir)
+
+    num_entities = sum(len(feed.entity) for feed in feeds)
+    logger.info(f"Loaded {len(feeds)} feeds with {num_entities:,} entities in total")
+
+    # Both decoders have to agree before their timings mean anything
+    for feed in feeds:
+        expected = parse_vehicle_positions(feed)
+        actual = decode_vehicle_positions(feed).to_pandas()
+        assert len(expected) == len(actual)
+        for column in ["id", "trip_id", "vehicle_id", "stop_id"]:
+            assert expected[column].fillna("").tolist() == actual[column].astype("string").fillna("").tolist()
+
+    results = {
+        "pandas (parse_vehicle_positions)": benchmark(parse_vehicle_positions, feeds, args.repeat),
+        "columnar (decode_vehicle_positions)": benchmark(decode_vehicle_positions, feeds, args.repeat),
+    }
+    baseline = next(iter(results.values()))
+    for name, elapsed in results.items():
+        per_feed_ms = elapsed / (args.repeat * len(feeds)) * 1000
+        rate = num_entities * args.repeat / elapsed
+        print(
+            f"{name:<40} {per_feed_ms:8.2f} ms/feed {rate:12,.0f} entities/s "
+            f"(x{baseline / elapsed:.2f})"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import logging
+import tempfile
+from pathlib import Path
+
+import duckdb
+
+from scripts.preprocess import (
+    DICTIONARY_TABLE, STATIC_TABLES, STEPS, id_dictionary_source, run_steps, source_from_files, update_ids,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the per step timings of the preprocessing steps with and without fusion"
+    )
+    parser.add_argument(
+        "--inputs-dir", type=Path, required=True,
+        help="Directory of the inputs, e.g. written by scripts/benchmarks/synthetic_transit.py"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each mode, the fastest is reported")
+    return parser.parse_args()
+
+
+def run(inputs_dir: Path, id_dictionary: Path, fuse: bool) -> tuple[list[dict], tuple]:
+    sources = {
+        table_name: source_from_files(inputs_dir, table_name)
+        for table_name in ["positions", *STATIC_TABLES]
+    }
+    sources[DICTIONARY_TABLE] = id_dictionary_source(id_dictionary)
+    with duckdb.connect(":memory:") as conn:
+        stats = run_steps(conn, sources, steps=STEPS, fuse=fuse)
+        checksums = tuple(
+            conn.execute(f"SELECT count(1), sum(hash(COLUMNS(*))) FROM {table_name}").fetchone()
+            for table_name in ["positions", "hops"]
+        )
+    for table_name, (count, *_) in zip(["positions", "hops"], checksums):
+        if count == 0:
+            raise AssertionError(f"The run with fuse={fuse} left no {table_name}, the comparison would be vacuous")
+    return stats, checksums
+
+
+def main():
+    args = parse_args()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        positions_files = sorted(args.inputs_dir.glob("**/*positions*.parquet"))
+        id_dictionary = update_ids(args.inputs_dir, Path(tmp_dir), positions_files)
+        for fuse in [False, True]:
+            runs = [run(args.inputs_dir, id_dictionary, fuse) for _ in range(args.repeat)]
+            if len({checksums for _, checksums in runs}) != 1:
+                raise AssertionError(f"Runs with fuse={fuse} are not deterministic")
+            results[fuse] = min(runs, key=lambda result: sum(step["seconds"] for step in result[0]))
+    if results[False][1] != results[True][1]:
+        raise AssertionError(f"Fused outputs differ: {results[True][1]} != {results[False][1]}")
+
+    print(f"{'step':<26}{'materialized':>14}{'fused':>14}  tables materialized when fused")
+    for before, after in zip(results[False][0], results[True][0]):
+        print(
+            f"{before['step']:<26}{before['seconds'] * 1000:>11.1f} ms{after['seconds'] * 1000:>11.1f} ms"
+            f"  {', '.join(after['materialized']) or '-'}"
+        )
+    total_before = sum(step["seconds"] for step in results[False][0])
+    total_after = sum(step["seconds"] for step in results[True][0])
+    print(
+        f"{'total':<26}{total_before * 1000:>11.1f} ms{total_after * 1000:>11.1f} ms"
+        f"  (x{total_before / total_after:.2f})"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
@@ -0,0 +1,121 @@
+import argparse
+import logging
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch_geometric.data import Batch
+
+from src.data import DelayPredictionDataset, load_data
+from src.graph_store import GraphStoreDataset, TripBatchSampler, check_batch_layout, compile_graph_store
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the samples/sec of DelayPredictionDataset with the compiled graph store"
+    )
+    parser.add_argument("--data-dir", type=Path, default=Path("data/processed/"), help="Directory of the processed data")
+    parser.add_argument("--samples", type=int, default=2000, help="Random samples read from each dataset")
+    parser.add_argument("--batch-size", type=int, default=64, help="Samples per batch of the batched comparison")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def assert_same_graph(expected, actual):
+    for key in expected.node_types + expected.edge_types:
+        for name, value in expected[key].items():
+            if not torch.equal(value, actual[key][name]):
+                raise AssertionError(f"{key} {name} differs: {value} != {actual[key][name]}")
+
+
+def reverse_arrivals(dataset: DelayPredictionDataset, every: int = 3) -> np.ndarray:
+    """Reverse the arrivals of every `every`-th trip in place, as if its vehicle reported its stops backwards."""
+    arrivals = dataset.stops["actual_arrival_seconds"].numpy()
+    trips = dataset.stops["global_trip_id"].numpy()
+    starts = np.flatnonzero(np.r_[True, trips[1:] != trips[:-1]])
+    ends = np.r_[starts[1:], len(trips)]
+    for start, end in list(zip(starts, ends))[::every]:
+        arrivals[start:end] = arrivals[start:end][::-1].copy()
+    return np.isin(dataset.positions["global_trip_id"].numpy(), trips[starts[::every]])
+
+
+def samples_per_second(dataset, indices: np.ndarray) -> float:
+    start_time = time.perf_counter()
+    for index in indices:
+        dataset[index]
+    return len(indices) / (time.perf_counter() - start_time)
+
+
+def collate(store: GraphStoreDataset, indices) -> Batch:
+    return Batch.from_data_list([store[index] for index in indices])
+
+
+def batched_samples_per_second(batch_func, batches: list[list[int]]) -> float:
+    start_time = time.perf_counter()
+    for indices in batches:
+        batch_func(indices)
+    return sum(len(indices) for indices in batches) / (time.perf_counter() - start_time)
+
+
+def main():
+    args = parse_args()
+    with load_data(args.data_dir, ":memory:") as conn:
+        dataset = DelayPredictionDataset(conn)
+    indices = np.random.default_rng(args.seed).integers(0, len(dataset), size=args.samples)
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        start_time = time.perf_counter()
+        compile_graph_store(dataset, Path(store_dir))
+        compile_seconds = time.perf_counter() - start_time
+        store = GraphStoreDataset(Path(store_dir))
+        for index in indices[:200]:
+            assert_same_graph(dataset[index], store[index])
+
+        before = samples_per_second(dataset, indices)
+        after = samples_per_second(store, indices)
+
+        # Both collations of the same batches, random ones and ones of trips sharing their stops
+        random_batches = [indices[i:i + args.batch_size] for i in range(0, len(indices), args.batch_size)]
+        batchings = {
+            "random": random_batches,
+            "of trips": list(TripBatchSampler(store, args.batch_size, seed=args.seed))[:len(random_batches)],
+        }
+        batched = {}
+        for name, batches in batchings.items():
+            for batch_indices in batches:
+                check_batch_layout(collate(store, batch_indices), store.get_batch(batch_indices))
+            batched[name] = (
+                batched_samples_per_second(partial(collate, store), batches),
+                batched_samples_per_second(store.get_batch, batches),
+            )
+
+        # Past stops are not a prefix of the trip's stops once arrivals decrease
+        reversed_positions = np.flatnonzero(reverse_arrivals(dataset))
+        compile_graph_store(dataset, Path(store_dir))
+        store = GraphStoreDataset(Path(store_dir))
+        for index in reversed_positions[:200]:
+            assert_same_graph(dataset[index], store[index])
+        check_batch_layout(collate(store, reversed_positions[:64]), store.get_batch(reversed_positions[:64]))
+
+    print(f"compiled {len(dataset):,} samples in {compile_seconds:.2f} s, also with decreasing arrivals")
+    print(f"{'DelayPredictionDataset':<24}{before:>10,.0f} samples/s")
+    print(f"{'GraphStoreDataset':<24}{after:>10,.0f} samples/s  (x{after / before:.1f})")
+    print(f"{f'batches of {args.batch_size}':<24}{'from_data_list':>22}{'get_batch':>20}")
+    for name, (collated, built) in batched.items():
+        print(
+            f"{name:<24}{collated:>12,.0f} samples/s{built:>10,.0f} samples/s  (x{built / collated:.1f})"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
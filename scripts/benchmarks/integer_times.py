@@ -0,0 +1,191 @@
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+import duckdb
+import pandas as pd
+
+from scripts.preprocess import (
+    DICTIONARY_TABLE, STATIC_TABLES, STEPS, SQL_SCRIPTS_DIR, id_dictionary_source, run_steps, source_from_files,
+    update_ids,
+)
+from src.data import run_sql_file
+from src.pipeline.ids import service_date_sql, trip_key_sql, vehicle_key_sql
+
+logger = logging.getLogger(__name__)
+
+# The `TIME` columns and `timediff` macro the pipeline used before the integer
+# seconds, kept as the reference
+TIME_STOP_TIMES_SQL = """
+CREATE OR REPLACE TABLE stop_times_time AS
+    SELECT trip_id, stop_sequence,
+        TIME '00:00:00' + to_seconds(departure_seconds % 86400) AS departure_time,
+        TIME '00:00:00' + to_seconds(arrival_seconds % 86400) AS arrival_time,
+    FROM stop_times;
+
+CREATE OR REPLACE MACRO timediff(part, start_t, end_t) AS
+CASE
+    WHEN 12 < datediff('hour', start_t, end_t)
+        THEN -(datediff(part, end_t, TIME '23:59:59') + datediff(part, TIME '00:00:00', start_t))
+    WHEN datediff('hour', start_t, end_t) < - 12
+        THEN datediff(part, start_t, TIME '23:59:59') + datediff(part, TIME '00:00:00', end_t)
+    ELSE
+        datediff(part, start_t, end_t)
+END;
+"""
+TIME_ATTACH_SQL = """
+CREATE OR REPLACE TEMP TABLE attached AS
+    SELECT p.*,
+        timediff('second', st.departure_time, strftime(p.timestamp, '%H:%M:%S')::TIME) AS diff_from_start,
+        p.timestamp - INTERVAL (diff_from_start) SECOND AS scheduled_start,
+        strftime(scheduled_start , '%Y-%m-%d') || '_' || p.trip_id || '_' || p.vehicle_id AS global_trip_id
+    FROM positions p
+    JOIN stop_times_time st ON st.trip_id = p.trip_id AND st.stop_sequence = 0;
+"""
+TIME_HOPS_SQL = """
+CREATE OR REPLACE TEMP TABLE hops AS
+    WITH
+        arrivals AS (
+            SELECT global_trip_id, route_id, trip_id, vehicle_id, current_stop_sequence,
+                max(timestamp) AS timestamp,
+                argmax(pos, timestamp) AS pos
+            FROM positions
+            WHERE current_stop_sequence IS NOT NULL
+            GROUP BY global_trip_id, route_id, trip_id, vehicle_id, current_stop_sequence
+        )
+    SELECT
+        a.global_trip_id, a.route_id, a.trip_id, a.current_stop_sequence,
+        COALESCE(LAG(st.stop_id) OVER (
+            PARTITION BY a.global_trip_id ORDER BY a.current_stop_sequence
+        ), st.stop_id) AS from_stop_id,
+        st.stop_id AS to_stop_id,
+        COALESCE(LAG(a.timestamp) OVER (
+            PARTITION BY a.global_trip_id ORDER BY a.current_stop_sequence
+        ), a.timestamp) AS actual_departure,
+        a.timestamp AS actual_arrival,
+        datediff('second', actual_departure, actual_arrival)::INT AS actual_duration,
+        ST_Distance(a.pos, s.stop_pos) * 111111 AS distance_from_target,
+    FROM arrivals a
+    JOIN stop_times st ON a.trip_id = st.trip_id AND a.current_stop_sequence = st.stop_sequence
+    JOIN stops s ON st.stop_id = s.stop_id;
+"""
+TIME_DELAY_SQL = """
+SELECT h.actual_arrival, st.arrival_time AS scheduled_arrival
+FROM hops h
+JOIN stop_times_time st ON h.trip_id = st.trip_id AND h.current_stop_sequence = st.stop_sequence
+"""
+DELAY_SQL = """
+SELECT h.actual_arrival_seconds - st.arrival_seconds AS delay
+FROM hops h
+JOIN stop_times st ON h.trip_id = st.trip_id AND h.current_stop_sequence = st.stop_sequence
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the integer seconds of the schedule with the TIME columns and timediff macro"
+    )
+    parser.add_argument(
+        "--inputs-dir", type=Path, required=True,
+        help="Directory of the inputs, e.g. written by scripts/benchmarks/synthetic_transit.py"
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of each query, the fastest is reported")
+    return parser.parse_args()
+
+
+def best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def time_delays(conn: duckdb.DuckDBPyConnection) -> pd.Series:
+    df = conn.execute(TIME_DELAY_SQL).fetchdf()
+    return (
+        pd.to_timedelta(df["actual_arrival"].dt.time.astype("string"))
+        - pd.to_timedelta(df["scheduled_arrival"].astype("string"))
+    ).dt.total_seconds()
+
+
+def main():
+    args = parse_args()
+    sources = {
+        table_name: source_from_files(args.inputs_dir, table_name)
+        for table_name in ["positions", *STATIC_TABLES]
+    }
+    attach_sql = (SQL_SCRIPTS_DIR / "attach_global_trip_id.sql").read_text()
+    # Only the first statement attaches the ids, the rest is the same for both
+    attach_sql = duckdb.extract_statements(attach_sql)[0].query.replace(
+        "CREATE OR REPLACE TABLE positions", "CREATE OR REPLACE TEMP TABLE attached"
+    )
+    hops_sql = (SQL_SCRIPTS_DIR / "create_hops.sql").read_text().replace(
+        "CREATE OR REPLACE TABLE hops", "CREATE OR REPLACE TEMP TABLE hops"
+    )
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as tmp_dir, duckdb.connect(":memory:") as conn:
+        positions_files = sorted(args.inputs_dir.glob("**/*positions*.parquet"))
+        sources[DICTIONARY_TABLE] = id_dictionary_source(update_ids(args.inputs_dir, Path(tmp_dir), positions_files))
+        run_steps(conn, sources, steps=STEPS, until_step="clean_data")
+        conn.execute(TIME_STOP_TIMES_SQL)
+
+        timings["attach"] = (
+            best_of(args.repeat, lambda: conn.execute(TIME_ATTACH_SQL)),
+            best_of(args.repeat, lambda: conn.execute(attach_sql)),
+        )
+        conn.execute(TIME_ATTACH_SQL)
+        conn.execute("ALTER TABLE attached RENAME TO attached_time")
+        conn.execute(attach_sql)
+        # The TIME version concatenates the date and keys the packed id holds
+        different, total = conn.execute(f"""
+            SELECT
+                (SELECT count(1) FROM (
+                    SELECT trip_id, vehicle_id, timestamp,
+                        strftime({service_date_sql()}, '%Y-%m-%d') || '_' || {trip_key_sql()}
+                            || '_' || {vehicle_key_sql()}
+                    FROM attached
+                    EXCEPT ALL
+                    SELECT trip_id, vehicle_id, timestamp, global_trip_id FROM attached_time
+                )),
+                (SELECT count(1) FROM attached)
+        """).fetchone()
+
+        for name in ["attach_global_trip_id", "clean_stop_indicators", "use_geo"]:
+            run_sql_file(conn, SQL_SCRIPTS_DIR / f"{name}.sql")
+        timings["create_hops"] = (
+            best_of(args.repeat, lambda: conn.execute(TIME_HOPS_SQL)),
+            best_of(args.repeat, lambda: conn.execute(hops_sql)),
+        )
+        # Both versions of the delay read the columns of the new hops
+        conn.execute(hops_sql)
+        timings["delay"] = (
+            best_of(args.repeat, lambda: time_delays(conn)),
+            best_of(args.repeat, lambda: conn.execute(DELAY_SQL).fetchnumpy()),
+        )
+        delays = conn.execute(DELAY_SQL).fetchdf()["delay"]
+        wrapped = int((time_delays(conn) != delays).sum())
+
+    if total == 0 or len(delays) == 0:
+        raise AssertionError(f"{total} positions and {len(delays)} hops to compare, the comparison would be vacuous")
+    if different > 0:
+        raise AssertionError(f"global_trip_id differs on {different:,} of {total:,} positions")
+
+    print(f"{'':<14}{'TIME':>12}{'integer':>12}")
+    for name, (before, after) in timings.items():
+        print(f"{name:<14}{before * 1000:>9.1f} ms{after * 1000:>9.1f} ms  (x{before / after:.2f})")
+    print(f"global_trip_id is the same on all {total:,} positions")
+    print(f"delay differs on {wrapped:,} of {len(delays):,} hops, arrivals on the other side of midnight")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import logging
+import time
+from datetime import date
+from pathlib import Path
+
+import duckdb
+import pyarrow as pa
+
+from scripts.benchmarks.synthetic_transit import generate_positions, generate_static
+from src.data import run_sql_file
+
+SQL_SCRIPTS_DIR = Path(__file__).parent.parent / "sql"
+logger = logging.getLogger(__name__)
+
+# The pairwise self-join `remove_clusters.sql` used before the grid, kept as the reference
+SELF_JOIN_SQL = """
+CREATE TEMP TABLE clusters AS
+    SELECT
+        p1.global_trip_id,
+        p1.current_stop_sequence,
+        p1.timestamp,
+        count(1) AS count
+    FROM positions p1
+    JOIN positions p2 ON p1.global_trip_id = p2.global_trip_id
+        AND p1.current_stop_sequence = p2.current_stop_sequence
+        AND p1.timestamp != p2.timestamp
+        AND ST_Distance(p1.pos, p2.pos) * 111111 < 40
+    GROUP BY p1.global_trip_id, p1.current_stop_sequence, p1.timestamp
+    HAVING count > 15;
+
+CREATE OR REPLACE TABLE positions AS
+    SELECT
+        p.* EXCLUDE (current_stop_sequence),
+        IF(c.count IS NOT NULL, NULL, p.current_stop_sequence) AS current_stop_sequence,
+    FROM positions p
+    LEFT JOIN clusters c ON 1=1
+        AND p.global_trip_id = c.global_trip_id
+        AND p.current_stop_sequence = c.current_stop_sequence
+        AND p.timestamp = c.timestamp
+    ORDER BY p.global_trip_id, p.timestamp;
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the grid based remove_clusters.sql with the pairwise self-join on dwell-heavy trips"
+    )
+    parser.add_argument("--routes", type=int, default=10)
+    parser.add_argument("--trips-per-route", type=int, default=40)
+    parser.add_argument(
+        "--dwell-minutes", type=float, default=20,
+        help="Time every vehicle waits at its first stop before departing"
+    )
+    parser.add_argument("--gps-noise", type=float, default=10.0, help="Standard deviation of the positions in meters")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def connect(positions: pa.Table) -> duckdb.DuckDBPyConnection:
+    conn = duckdb.connect(":memory:")
+    run_sql_file(conn, SQL_SCRIPTS_DIR / "setup.sql")
+    conn.register("raw_positions", positions)
+    conn.execute("""
+        CREATE TABLE positions AS
+            SELECT
+                trip_id || '_' || vehicle_id AS global_trip_id,
+                timestamp,
+                current_stop_sequence,
+                ST_Point(latitude, longitude) AS pos,
+            FROM raw_positions
+    """)
+    conn.unregister("raw_positions")
+    return conn
+
+
+def run(positions: pa.Table, sql: str) -> tuple[float, set]:
+    with connect(positions) as conn:
+        start_time = time.perf_counter()
+        conn.execute(sql)
+        elapsed = time.perf_counter() - start_time
+        # The step drops its clusters table, the positions it took the stop of are its result
+        clusters = conn.execute(
+            "SELECT global_trip_id, epoch(timestamp) FROM positions WHERE current_stop_sequence IS NULL"
+        ).fetchall()
+    return elapsed, set(clusters)
+
+
+def main():
+    args = parse_args()
+    stops, trips, stop_times = generate_static(args.routes, 25, args.trips_per_route, seed=args.seed)
+    positions = generate_positions(
+        stops, trips, stop_times, date(2025, 10, 1),
+        dwell_seconds=int(args.dwell_minutes * 60), gps_noise=args.gps_noise, seed=args.seed,
+    )
+    logger.info(f"Generated {positions.num_rows:,} positions of {trips.num_rows} trips")
+
+    grid_time, grid_clusters = run(positions, (SQL_SCRIPTS_DIR / "remove_clusters.sql").read_text())
+    join_time, join_clusters = run(positions, SELF_JOIN_SQL)
+    if not join_clusters:
+        raise AssertionError("No positions are in clusters, increase --dwell-minutes")
+    if grid_clusters != join_clusters:
+        raise AssertionError(
+            f"Cluster detection differs: {len(grid_clusters - join_clusters)} extra, "
+            f"{len(join_clusters - grid_clusters)} missing positions"
+        )
+
+    print(f"{len(join_clusters):,} of {positions.num_rows:,} positions are in clusters")
+    print(f"{'self-join':<12}{join_time * 1000:>10.1f} ms (x1.00)")
+    print(f"{'grid':<12}{grid_time * 1000:>10.1f} ms (x{join_time / grid_time:.2f})")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import contextlib
+import io
+import logging
+import tempfile
+import time
+from functools import partial
+from pathlib import Path
+
+import duckdb
+
+from scripts.preprocess import PARTITIONED_TABLES, STATIC_TABLES, configure_outputs, process_all, process_sharded
+from src.pipeline.shards import worker_config
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Check that sharded and route partitioned runs write the outputs of a single process run"
+    )
+    parser.add_argument(
+        "--inputs-dir", type=Path, required=True,
+        help="Directory of the inputs, e.g. written by scripts/benchmarks/synthetic_transit.py"
+    )
+    parser.add_argument("--workers", type=int, default=2, help="Processes of the sharded run")
+    parser.add_argument("--shards", type=int, nargs="+", default=[2, 4], help="Route shards of the sharded runs")
+    return parser.parse_args()
+
+
+def checksums(output_dir: Path) -> dict[str, tuple]:
+    """Number of rows and an order independent hash of every output table."""
+    with duckdb.connect(":memory:") as conn:
+        return {
+            table_name: conn.execute(
+                f"SELECT count(1), sum(hash(COLUMNS(*))) "
+                f"FROM read_parquet('{output_dir}/**/*{table_name}*.parquet', hive_partitioning = false)"
+            ).fetchone()
+            for table_name in [*PARTITIONED_TABLES, *STATIC_TABLES]
+        }
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        runs = {"single": partial(process_all, config=worker_config(1))}
+        # Files split by route as well hold the same rows
+        runs["by route"] = partial(
+            process_all, config=worker_config(1), outputs=configure_outputs(partition_by_route=True)
+        )
+        for num_shards in args.shards:
+            runs[f"{num_shards} shards"] = partial(
+                process_sharded, num_shards=num_shards, workers=args.workers, config=worker_config(args.workers)
+            )
+
+        results = {}
+        for name, run in runs.items():
+            output_dir = tmp_dir / name.replace(" ", "_")
+            start_time = time.perf_counter()
+            # The single process run prints a summary of every table
+            with contextlib.redirect_stdout(io.StringIO()):
+                run(args.inputs_dir, output_dir)
+            results[name] = (time.perf_counter() - start_time, checksums(output_dir))
+
+    reference = results["single"][1]
+    for table_name in PARTITIONED_TABLES:
+        if reference[table_name][0] == 0:
+            raise AssertionError(f"The single process run wrote no {table_name}, the comparison would be vacuous")
+    for name, (seconds, result) in results.items():
+        if result != reference:
+            raise AssertionError(f"Outputs of the run with {name} differ: {result} != {reference}")
+        counts = ", ".join(f"{count:,} {table_name}" for table_name, (count, *_) in result.items())
+        print(f"{name:<12}{seconds:>8.2f} s  {counts}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
@@ -0,0 +1,105 @@
+import argparse
+import logging
+import multiprocessing
+import resource
+import time
+from pathlib import Path
+
+from src.data import DelayPredictionDataset, StreamingDelayPredictionDataset, load_data
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the startup time and peak memory of DelayPredictionDataset with the streaming dataset, "
+                    "and check that distributed ranks stream the same number of samples"
+    )
+    parser.add_argument("--data-dir", type=Path, default=Path("data/processed/"), help="Directory of the processed data")
+    parser.add_argument("--samples", type=int, default=5000, help="Samples read after the startup")
+    parser.add_argument("--trips-per-chunk", type=int, default=1000)
+    parser.add_argument("--shuffle-buffer", type=int, default=1000)
+    parser.add_argument("--world-sizes", type=int, nargs="*", default=[3], help="Distributed ranks simulated")
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader workers simulated per rank")
+    return parser.parse_args()
+
+
+class ShardedDataset(StreamingDelayPredictionDataset):
+    """The stream of one DataLoader worker of a distributed rank, without torch.distributed."""
+
+    def __init__(self, data_dir, shard: tuple[int, int, int, int], **kwargs):
+        super().__init__(data_dir, **kwargs)
+        self.shard = shard
+
+    def _shard(self) -> tuple[int, int, int, int]:
+        return self.shard
+
+
+def rank_samples(args, world_size: int) -> list[int]:
+    """Samples streamed by every rank, summed over its workers."""
+    dataset = ShardedDataset(
+        args.data_dir, (0, 1, 0, 1), trips_per_chunk=args.trips_per_chunk, shuffle_buffer=args.shuffle_buffer
+    )
+    samples = []
+    for rank in range(world_size):
+        count = 0
+        for worker in range(args.workers):
+            dataset.shard = (rank, world_size, worker, args.workers)
+            count += sum(1 for _ in dataset)
+        samples.append(count)
+    return samples
+
+
+def measure(args, streaming: bool, results):
+    start_time = time.perf_counter()
+    if streaming:
+        samples = iter(StreamingDelayPredictionDataset(
+            args.data_dir, trips_per_chunk=args.trips_per_chunk, shuffle_buffer=args.shuffle_buffer,
+        ))
+    else:
+        with load_data(args.data_dir, ":memory:") as conn:
+            dataset = DelayPredictionDataset(conn)
+        samples = (dataset[index] for index in range(len(dataset)))
+    next(samples)
+    first_sample = time.perf_counter() - start_time
+
+    num_samples = 1
+    for _ in zip(range(args.samples - 1), samples):
+        num_samples += 1
+    seconds = time.perf_counter() - start_time - first_sample
+    # Peak resident memory of this process, in KB on Linux
+    results[streaming] = (first_sample, num_samples / seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def main():
+    args = parse_args()
+    with multiprocessing.Manager() as manager:
+        results = manager.dict()
+        # Every dataset is measured in its own process, so their peak memory is their own
+        for streaming in [False, True]:
+            process = multiprocessing.Process(target=measure, args=(args, streaming, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(f"Measuring streaming={streaming} failed with exit code {process.exitcode}")
+        results = dict(results)
+
+    print(f"{'':<34}{'first sample':>14}{'samples/s':>12}{'peak RSS':>12}")
+    for streaming, name in [(False, "DelayPredictionDataset"), (True, "StreamingDelayPredictionDataset")]:
+        first_sample, samples_per_second, max_rss = results[streaming]
+        print(f"{name:<34}{first_sample:>12.2f} s{samples_per_second:>12,.0f}{max_rss / 1024:>9.1f} MB")
+
+    for world_size in args.world_sizes:
+        samples = rank_samples(args, world_size)
+        if len(set(samples)) != 1 or samples[0] == 0:
+            raise AssertionError(f"Ranks of {world_size} streamed different or no samples: {samples}")
+        print(f"{world_size} ranks of {args.workers} workers stream {samples[0]:,} samples each")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
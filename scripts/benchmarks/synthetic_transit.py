@@ -0,0 +1,214 @@
+import argparse
+import logging
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.fetch.vehicle_positions import VEHICLE_POSITIONS_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+LOCAL_TZ = ZoneInfo("Europe/Budapest")
+# Degrees of latitude per meter, the pipeline's SQL uses the same approximation
+DEGREES_PER_METER = 1 / 111111
+
+
+def format_gtfs_time(seconds: int) -> str:
+    """GTFS times count from noon minus 12h and may exceed 24:00:00."""
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def generate_static(num_routes: int, stops_per_route: int, trips_per_route: int, seed: int = 0):
+    """
+    Generate the `stops`, `trips` and `stop_times` GTFS tables of straight routes.
+
+    Trips of a route start evenly between 04:30 and 25:30, so the last ones
+    cross midnight.
+    """
+    rng = np.random.default_rng(seed)
+    stops, trips, stop_times = [], [], []
+    for r in range(num_routes):
+        route_id = f"R{r:04d}"
+        origin = np.array([47.45, 19.0]) + rng.random(2) * 0.1
+        heading = rng.random() * 2 * np.pi
+        step = 400 * DEGREES_PER_METER * np.array([np.cos(heading), np.sin(heading)])
+        stop_ids = []
+        for s in range(stops_per_route):
+            stop_id = f"F{r:04d}{s:03d}"
+            lat, lon = origin + step * s
+            stops.append({
+                "stop_id": stop_id,
+                "stop_name": f"Route {r} stop {s}",
+                "stop_lat": float(lat),
+                "stop_lon": float(lon),
+            })
+            stop_ids.append(stop_id)
+
+        hop_seconds = rng.integers(60, 120, size=stops_per_route - 1)
+        offsets = np.concatenate([[0], np.cumsum(hop_seconds)])
+        for k, start in enumerate(np.linspace(4.5 * 3600, 25.5 * 3600, trips_per_route).astype(int)):
+            trip_id = f"{route_id}_T{k:03d}"
+            trips.append({"trip_id": trip_id, "route_id": route_id, "direction_id": 0})
+            for s, stop_id in enumerate(stop_ids):
+                time = format_gtfs_time(int(start + offsets[s]))
+                stop_times.append({
+                    "trip_id": trip_id,
+                    "stop_sequence": s,
+                    "stop_id": stop_id,
+                    "arrival_time": time,
+                    "departure_time": time,
+                })
+    return pa.Table.from_pylist(stops), pa.Table.from_pylist(trips), pa.Table.from_pylist(stop_times)
+
+
+def generate_positions(
+    stops: pa.Table,
+    trips: pa.Table,
+    stop_times: pa.Table,
+    day: date,
+    interval: int = 15,
+    dwell_seconds: int = 30,
+    gps_noise: float = 3.0,
+    seed: int = 0,
+) -> pa.Table:
+    """
+    Simulate the vehicle positions of every trip scheduled on `day`.
+
+    Vehicles move linearly between stops with a random delay, report every
+    `interval` seconds with `gps_noise` meters of noise and wait
+    `dwell_seconds` at their first stop. Dwells of more than 15 intervals
+    produce the dense clusters the pipeline removes, which also removes the
+    first stop and with it every trip as partial, so the default is short.
+    """
+    rng = np.random.default_rng([seed, day.toordinal()])
+    stop_coords = {
+        row["stop_id"]: (row["stop_lat"], row["stop_lon"]) for row in stops.to_pylist()
+    }
+    route_of = dict(zip(trips.column("trip_id").to_pylist(), trips.column("route_id").to_pylist()))
+    midnight = datetime.combine(day, datetime.min.time(), tzinfo=LOCAL_TZ)
+
+    by_trip = {}
+    for row in stop_times.to_pylist():
+        by_trip.setdefault(row["trip_id"], []).append(row)
+
+    columns = {name: [] for name in ["trip_id", "route_id", "vehicle_id", "latitude", "longitude",
+                                     "bearing", "speed", "timestamp", "current_stop_sequence"]}
+    for v, (trip_id, rows) in enumerate(by_trip.items()):
+        rows.sort(key=lambda row: row["stop_sequence"])
+        scheduled = np.array([
+            sum(int(part) * unit for part, unit in zip(row["departure_time"].split(":"), [3600, 60, 1]))
+            for row in rows
+        ])
+        coords = np.array([stop_coords[row["stop_id"]] for row in rows])
+        delay = rng.normal(60, 90)
+        actual = scheduled + delay + np.cumsum(rng.normal(0, 10, size=len(rows)))
+        actual = np.maximum.accumulate(actual)
+
+        times = np.arange(actual[0] - dwell_seconds, actual[-1] + interval, interval)
+        next_stop = np.clip(np.searchsorted(actual, times), 0, len(rows) - 1)
+        prev_stop = np.maximum(next_stop - 1, 0)
+        span = np.maximum(actual[next_stop] - actual[prev_stop], 1)
+        frac = np.clip((times - actual[prev_stop]) / span, 0, 1)[:, None]
+        position = coords[prev_stop] + (coords[next_stop] - coords[prev_stop]) * frac
+        position += rng.normal(0, gps_noise * DEGREES_PER_METER, size=position.shape)
+
+        epoch = midnight.timestamp() + times
+        columns["trip_id"].extend([trip_id] * len(times))
+        columns["route_id"].extend([route_of[trip_id]] * len(times))
+        columns["vehicle_id"].extend([f"BKK_V{v:05d}"] * len(times))
+        columns["latitude"].append(position[:, 0])
+        columns["longitude"].append(position[:, 1])
+        columns["bearing"].append(rng.random(len(times)) * 360)
+        columns["speed"].append(rng.random(len(times)) * 15)
+        columns["timestamp"].append(epoch.astype(np.int64))
+        columns["current_stop_sequence"].append(next_stop)
+
+    num_rows = len(columns["trip_id"])
+    arrays = {
+        "id": pa.array([f"pos_{i}" for i in range(num_rows)]),
+        "vehicle_label": pa.nulls(num_rows, pa.string()),
+        "vehicle_license_plate": pa.nulls(num_rows, pa.string()),
+        "current_status": pa.nulls(num_rows, pa.string()),
+        "stop_id": pa.nulls(num_rows, pa.string()),
+    }
+    for name, values in columns.items():
+        arrays[name] = pa.array(values if isinstance(values[0], str) else np.concatenate(values))
+    return pa.Table.from_arrays(
+        [arrays[field.name].cast(field.type) for field in VEHICLE_POSITIONS_SCHEMA],
+        schema=VEHICLE_POSITIONS_SCHEMA,
+    )
+
+
+def write_dataset(
+    output_dir: Path,
+    start_day: date,
+    num_days: int,
+    num_routes: int = 20,
+    stops_per_route: int = 25,
+    trips_per_route: int = 40,
+    seed: int = 0,
+) -> int:
+    """
+    Write a synthetic raw dataset in the layout produced by the scraper.
+
+    Positions are split into hourly `YYYY-MM-DD/vehicle_positions_HH.parquet`
+    files by their UTC timestamp, the static tables go to `static/`.
+
+    Returns:
+        int: Number of position rows written.
+    """
+    stops, trips, stop_times = generate_static(num_routes, stops_per_route, trips_per_route, seed=seed)
+    static_dir = output_dir / "static"
+    static_dir.mkdir(parents=True, exist_ok=True)
+    for name, table in [("stops", stops), ("trips", trips), ("stop_times", stop_times)]:
+        pq.write_table(table, static_dir / f"{name}.parquet")
+
+    positions = pa.concat_tables([
+        generate_positions(stops, trips, stop_times, start_day + timedelta(days=i), seed=seed)
+        for i in range(num_days)
+    ])
+    hours = positions.column("timestamp").cast(pa.int64()).to_numpy() // 3600
+    for hour in np.unique(hours):
+        part = positions.filter(pa.array(hours == hour))
+        moment = datetime.utcfromtimestamp(int(hour) * 3600)
+        file_path = output_dir / f"{moment:%Y-%m-%d}" / f"vehicle_positions_{moment:%H}.parquet"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(part, file_path)
+    logger.info(f"Wrote {positions.num_rows:,} positions of {num_days} days to: {output_dir}")
+    return positions.num_rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic raw transit dataset for benchmarks")
+    parser.add_argument("--output-dir", "-o", type=Path, required=True)
+    parser.add_argument("--start-date", type=date.fromisoformat, default=date(2025, 10, 1))
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--routes", type=int, default=20)
+    parser.add_argument("--stops-per-route", type=int, default=25)
+    parser.add_argument("--trips-per-route", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    write_dataset(
+        args.output_dir, args.start_date, args.days,
+        num_routes=args.routes,
+        stops_per_route=args.stops_per_route,
+        trips_per_route=args.trips_per_route,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
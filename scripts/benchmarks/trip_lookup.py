@@ -0,0 +1,74 @@
+import argparse
+import logging
+import time
+from pathlib import Path
+
+from src.data import load_data
+from src.pipeline.ids import trip_key
+from src.visualization import TripLookup
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Time the uncached and cached trip lookups of the plots"
+    )
+    parser.add_argument("--data-dir", type=Path, default=Path("data/processed/"), help="Directory of the processed data")
+    parser.add_argument("--trips", type=int, default=50, help="Trips looked up")
+    parser.add_argument("--lazy", action="store_true", help="Look up in the views of a lazy load_data")
+    return parser.parse_args()
+
+
+def lookup_trip(lookup: TripLookup, global_trip_id: int) -> tuple[int, int]:
+    """Numbers of positions and stops `plot_trip` shows of a trip."""
+    positions = lookup.trip_positions(global_trip_id)
+    stops = lookup.trip_stops((trip_key(global_trip_id),))
+    return len(positions), len(stops)
+
+
+def timed_lookups(lookup: TripLookup, trips: list[int]) -> tuple[float, list[tuple[int, int]]]:
+    start_time = time.perf_counter()
+    counts = [lookup_trip(lookup, global_trip_id) for global_trip_id in trips]
+    return (time.perf_counter() - start_time) / len(trips), counts
+
+
+def main():
+    args = parse_args()
+    with load_data(args.data_dir, ":memory:", lazy=args.lazy) as conn:
+        trips = [
+            global_trip_id for (global_trip_id,) in conn.execute(
+                "SELECT DISTINCT global_trip_id FROM positions ORDER BY hash(global_trip_id) LIMIT $trips",
+                {"trips": args.trips},
+            ).fetchall()
+        ]
+        if not trips:
+            raise AssertionError("There are no positions to look up")
+
+        start_time = time.perf_counter()
+        lookup = TripLookup(conn, cache_size=len(trips))
+        setup = time.perf_counter() - start_time
+        uncached, counts = timed_lookups(lookup, trips)
+        cached, cached_counts = timed_lookups(lookup, trips)
+
+    empty = [global_trip_id for global_trip_id, (num_positions, num_stops) in zip(trips, counts)
+             if num_positions == 0 or num_stops == 0]
+    if empty:
+        raise AssertionError(f"{len(empty)} of {len(trips)} trips have no positions or stops, e.g. {empty[0]}")
+    if cached_counts != counts:
+        raise AssertionError("The cached lookups differ from the uncached ones")
+
+    print(f"{len(trips)} trips, {sum(n for n, _ in counts) / len(trips):.0f} positions "
+          f"and {sum(n for _, n in counts) / len(trips):.0f} stops on average")
+    print(f"{'labels':<10}{setup * 1000:>10.1f} ms  once per connection")
+    print(f"{'uncached':<10}{uncached * 1000:>10.2f} ms  per trip")
+    print(f"{'cached':<10}{cached * 1000:>10.2f} ms  per trip")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
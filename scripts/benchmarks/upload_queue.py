@@ -0,0 +1,93 @@
+import argparse
+import logging
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from src.storage import LocalBlobStore, UploadQueue
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Check that UploadQueue spills the uploads it cannot make and restores them, after a restart too"
+    )
+    parser.add_argument("--uploads", type=int, default=50, help="Payloads submitted while the store is down")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Seconds to wait for the spilled uploads")
+    return parser.parse_args()
+
+
+class FlakyStore(LocalBlobStore):
+    """Filesystem store whose uploads fail while it is down."""
+
+    def __init__(self, root: Path, name: str):
+        super().__init__(root, name=name)
+        self.up = threading.Event()
+
+    def upload(self, blob_name: str, data: bytes):
+        if not self.up.is_set():
+            raise ConnectionError(f"Store '{self.name}' is down")
+        super().upload(blob_name, data)
+
+
+def wait_until_uploaded(upload_queue: UploadQueue, store: LocalBlobStore, expected: dict, timeout: float):
+    deadline = time.monotonic() + timeout
+    while upload_queue.num_spilled() > 0 or set(store.list_names()) != set(expected):
+        if time.monotonic() > deadline:
+            raise AssertionError(
+                f"{len(store.list_names())} of {len(expected)} uploads arrived in {timeout}s, "
+                f"{upload_queue.num_spilled()} still spilled"
+            )
+        time.sleep(0.1)
+    for blob_name, data in expected.items():
+        if store.download(blob_name) != data:
+            raise AssertionError(f"Upload of '{blob_name}' differs from the submitted payload")
+
+
+def main():
+    args = parse_args()
+    # The failed uploads are intended
+    logging.getLogger("src.storage").setLevel(logging.CRITICAL)
+    payloads = {f"2025-10-01/positions_{i:04d}.parquet": f"payload {i}".encode() * 100 for i in range(args.uploads)}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        spill_dir = tmp_dir / "spill"
+        store = FlakyStore(tmp_dir / "store", name="positions")
+        queue_options = {"max_size": 4, "num_workers": 2, "max_retries": 2, "backoff": 0.01, "put_timeout": 0.01}
+
+        # Failed uploads and the ones not fitting into the queue are spilled
+        upload_queue = UploadQueue(spill_dir, **queue_options)
+        num_queued = sum(upload_queue.submit(store, blob_name, data) for blob_name, data in payloads.items())
+        upload_queue.close()
+        if upload_queue.num_spilled() != len(payloads) or store.list_names():
+            raise AssertionError(f"{upload_queue.num_spilled()} of {len(payloads)} uploads were spilled")
+        print(f"store down: {num_queued} queued and failed, {len(payloads) - num_queued} spilled at once")
+
+        # A new queue finds the spills of the earlier one and uploads them once the store is back
+        store.up.set()
+        restarted_queue = UploadQueue(spill_dir, get_store={store.name: store}.__getitem__, **queue_options)
+        wait_until_uploaded(restarted_queue, store, payloads, args.timeout)
+        restarted_queue.close()
+        print(f"after a restart: all {len(payloads)} spilled uploads restored")
+
+        # Spills of the running queue are restored too
+        store.up.clear()
+        more_payloads = {f"2025-10-02/positions_{i:04d}.parquet": data for i, data in enumerate(payloads.values())}
+        upload_queue = UploadQueue(spill_dir, **queue_options)
+        for blob_name, data in more_payloads.items():
+            upload_queue.submit(store, blob_name, data)
+        store.up.set()
+        wait_until_uploaded(upload_queue, store, payloads | more_payloads, args.timeout)
+        upload_queue.close()
+        print(f"while running: all {len(more_payloads)} spilled uploads restored")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.data import POSITIONS_SQL, STOPS_SQL, get_stop_id_mapping, load_data
+from src.features import add_position_features, add_stop_features
+
+logger = logging.getLogger(__name__)
+
+# The inputs of the row-wise features: times of the day and the arrival timestamps
+STOPS_TIME_SQL = f"""
+SELECT *,
+    TIMESTAMP '2025-01-01' + to_seconds(actual_arrival_seconds) AS actual_arrival,
+    TIME '00:00:00' + to_seconds(scheduled_arrival_seconds % 86400) AS scheduled_arrival,
+FROM ({STOPS_SQL})
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the vectorized stop and position features with the row-wise ones they replaced"
+    )
+    parser.add_argument("--data-dir", type=Path, default=Path("data/processed/"), help="Directory of the processed data")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each version, the fastest is reported")
+    return parser.parse_args()
+
+
+def time_to_sin_cos(time_obj):
+    seconds = time_obj.hour * 3600 + time_obj.minute * 60 + time_obj.second
+    angle = 2 * np.pi * seconds / 86400  # 86400 seconds in a day
+    return np.sin(angle), np.cos(angle)
+
+
+def row_wise_features(stops_df: pd.DataFrame, pos_df: pd.DataFrame, stop_id_mapping: dict):
+    """The features as `DelayPredictionDataset` computed them before, kept as the reference."""
+    stops_df["stop_id_int"] = stops_df["stop_id"].map(lambda x: stop_id_mapping.get(x, 0))
+    stops_df["actual_arrival_sin"], stops_df["actual_arrival_cos"] = zip(
+        *stops_df["actual_arrival"].dt.time.apply(time_to_sin_cos)
+    )
+    stops_df["scheduled_arrival_sin"], stops_df["scheduled_arrival_cos"] = zip(
+        *stops_df["scheduled_arrival"].apply(time_to_sin_cos)
+    )
+    stops_df["delay"] = (
+        pd.to_timedelta(stops_df["actual_arrival"].dt.time.astype("string"))
+        - pd.to_timedelta(stops_df["scheduled_arrival"].astype("string"))
+    ).dt.total_seconds()
+    pos_df["timestamp_sin"], pos_df["timestamp_cos"] = zip(*pos_df["timestamp"].dt.time.apply(time_to_sin_cos))
+
+
+def vectorized_features(stops_df: pd.DataFrame, pos_df: pd.DataFrame, stop_id_mapping: dict):
+    add_stop_features(stops_df, list(stop_id_mapping))
+    add_position_features(pos_df)
+
+
+def best_of(repeat: int, func, *frames) -> tuple[float, list[pd.DataFrame]]:
+    timings = []
+    for _ in range(repeat):
+        copies = [frame.copy() for frame in frames]
+        start_time = time.perf_counter()
+        func(*copies)
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), copies
+
+
+def main():
+    args = parse_args()
+    with load_data(args.data_dir, ":memory:") as conn:
+        stops_df = conn.execute(STOPS_TIME_SQL).fetchdf()
+        pos_df = conn.execute(POSITIONS_SQL).fetchdf()
+        stop_id_mapping = get_stop_id_mapping(conn)
+    if stops_df.empty or pos_df.empty:
+        raise AssertionError("There are no stops or positions, the comparison would be vacuous")
+
+    before, (stops_before, pos_before) = best_of(
+        args.repeat, lambda *frames: row_wise_features(*frames, stop_id_mapping), stops_df, pos_df
+    )
+    after, (stops_after, pos_after) = best_of(
+        args.repeat, lambda *frames: vectorized_features(*frames, stop_id_mapping), stops_df, pos_df
+    )
+
+    columns = ["actual_arrival_sin", "actual_arrival_cos", "scheduled_arrival_sin", "scheduled_arrival_cos"]
+    max_error = max(
+        np.abs(stops_before[columns].to_numpy() - stops_after[columns].to_numpy()).max(initial=0),
+        np.abs(pos_before[["timestamp_sin", "timestamp_cos"]].to_numpy()
+               - pos_after[["timestamp_sin", "timestamp_cos"]].to_numpy()).max(initial=0),
+    )
+    if not np.array_equal(stops_before["stop_id_int"].to_numpy(), stops_after["stop_id_int"].to_numpy()):
+        raise AssertionError("The embedding indices differ")
+    wrapped = int((stops_before["delay"] != stops_after["delay"]).sum())
+
+    print(f"{len(stops_df):,} stops, {len(pos_df):,} positions")
+    print(f"{'row-wise':<12}{before * 1000:>10.1f} ms")
+    print(f"{'vectorized':<12}{after * 1000:>10.1f} ms  (x{before / after:.1f})")
+    print(f"sin/cos differ by at most {max_error:.2g}, the float32 rounding")
+    print(f"delay differs on {wrapped:,} of {len(stops_df):,} stops, arrivals on the other side of midnight")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
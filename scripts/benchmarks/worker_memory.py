@@ -0,0 +1,119 @@
+import argparse
+import logging
+import multiprocessing
+from functools import partial
+from pathlib import Path
+
+from torch.utils.data import DataLoader, Subset
+
+from src.data import DelayPredictionDataset, load_data
+
+logger = logging.getLogger(__name__)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Check that the private memory DataLoader workers of DelayPredictionDataset gain over an epoch "
+                    "does not grow with the samples read nor with the number of workers"
+    )
+    parser.add_argument("--data-dir", type=Path, default=Path("data/processed/"), help="Directory of the processed data")
+    parser.add_argument("--samples", type=int, nargs="+", default=[2_000, 20_000], help="Samples of the epochs")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument(
+        "--max-spread-mb", type=float, default=1.0,
+        help="Largest difference of the per-worker growth between the epochs, pages copied on read exceed it"
+    )
+    parser.add_argument(
+        "--reference", action="store_true",
+        help="Also measure DataFrames with object ids as before the integer keys, which copy pages on every read"
+    )
+    return parser.parse_args()
+
+
+class DataFrameDataset(DelayPredictionDataset):
+    """The dataset reading its samples from pandas DataFrames with string ids, as before the shared columns."""
+
+    def __init__(self, dataset: DelayPredictionDataset):
+        self.stop_id_mapping = dataset.stop_id_mapping
+        stops_df, pos_df = dataset.stops_df, dataset.pos_df
+        # Reading Python objects writes their reference counts, copying the pages holding them
+        stops_df["stop_id"] = stops_df["stop_id"].astype(str).astype(object)
+        pos_df["trip_id"] = pos_df["global_trip_id"].astype(str).astype(object)
+        self.frames = (stops_df, pos_df)
+
+    def __len__(self):
+        return len(self.frames[1])
+
+    def __getitem__(self, index: int):
+        stops_df, pos_df = self.frames
+        position_row = pos_df.iloc[index]
+        return self.build_graph(position_row, stops_df.loc[(position_row["global_trip_id"], slice(None))])
+
+
+def private_mb(pid: int) -> float:
+    """Memory only mapped by the process, shared pages that were copied on write included."""
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        fields = dict(line.split(":", 1) for line in f if line.startswith("Private"))
+    return sum(int(value.split()[0]) for value in fields.values()) / 1024
+
+
+def record_pid(pids, worker_id: int):
+    pids[worker_id] = multiprocessing.current_process().pid
+
+
+def epoch_growth(dataset, num_workers: int, pids) -> float:
+    """Average private memory workers gained between their first and last batch."""
+    loader = DataLoader(
+        dataset, batch_size=None, shuffle=True, num_workers=num_workers, persistent_workers=True,
+        worker_init_fn=partial(record_pid, pids),
+    )
+    samples = iter(loader)
+    next(samples)
+    before = {pid: private_mb(pid) for pid in pids.values()}
+    if len(before) != num_workers:
+        raise AssertionError(f"{len(before)} of {num_workers} workers started before the first sample")
+    for _ in samples:
+        pass
+    growth = sum(private_mb(pid) - private_mb_before for pid, private_mb_before in before.items()) / len(before)
+    del samples, loader
+    pids.clear()
+    return growth
+
+
+def main():
+    args = parse_args()
+    with load_data(args.data_dir, ":memory:") as conn:
+        dataset = DelayPredictionDataset(conn)
+    datasets = {"shared columns": dataset}
+    if args.reference:
+        datasets["DataFrame"] = DataFrameDataset(dataset)
+
+    epochs = [(num_samples, num_workers) for num_samples in args.samples for num_workers in args.workers]
+    print("private memory gained per worker")
+    print(f"{'samples':>10}{'workers':>10}" + "".join(f"{name:>18}" for name in datasets))
+    growth = {name: [] for name in datasets}
+    with multiprocessing.Manager() as manager:
+        pids = manager.dict()
+        for num_samples, num_workers in epochs:
+            indices = range(min(num_samples, len(dataset)))
+            for name, samples in datasets.items():
+                growth[name].append(epoch_growth(Subset(samples, indices), num_workers, pids))
+            print(f"{len(indices):>10,}{num_workers:>10}" + "".join(f"{mb[-1]:>15.1f} MB" for mb in growth.values()))
+
+    spreads = {name: max(mb) - min(mb) for name, mb in growth.items()}
+    print("spread: " + ", ".join(f"{name} {spread:.1f} MB" for name, spread in spreads.items()))
+    # The reference only shows what the check catches
+    if spreads["shared columns"] > args.max_spread_mb:
+        raise AssertionError(
+            f"Workers of the shared columns gained {min(growth['shared columns']):.1f} to "
+            f"{max(growth['shared columns']):.1f} MB, more samples or workers must not copy more pages"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.WARNING,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    main()
@@ -1,16 +1,97 @@
 import pathlib
 import argparse
+import json
 import logging
+import shutil
 import time
+from dataclasses import dataclass, replace
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
+from typing import Callable
 
 import duckdb
 
 from src.data import run_sql_file, create_table_from_files
+from src.pipeline.cache import StepCache, hash_key
+from src.pipeline.fusion import FusedExecutor
+from src.pipeline.ids import DICTIONARY_TABLE, load_id_dictionary, service_date_sql, update_id_dictionary
+from src.pipeline.manifest import PartitionManifest, fingerprint, list_partitions
+from src.pipeline.memory import peak_rss, reset_peak_rss
+from src.pipeline.outputs import TableOutput, copy_to_parquet, write_table
+from src.pipeline.profiling import (
+    StepProfiler, compare_reports, format_report, make_report, read_report, write_report,
+)
+from src.pipeline.shards import balance_routes, run_tasks, worker_config
 
 SQL_SCRIPTS_DIR = pathlib.Path(__file__).parent / "sql"
+# Empty schema marking the database files of the pipeline, which later runs may replace
+DATABASE_MARKER_SCHEMA = "__preprocess"
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True)
+class Step:
+    """
+    A SQL file of `SQL_SCRIPTS_DIR` with the tables it reads and (re)creates.
+
+    The declared tables are what the step cache keys and stores, a step
+    touching a table it does not declare breaks resuming from the cache.
+    With fusion, rewrites of the tables are fused into views with the following
+    steps' until a `checkpoint` step, where they are materialized. Checkpoints go
+    before steps reading a table several times, which would recompute
+    the views for every read.
+    """
+    name: str
+    reads: tuple[str, ...]
+    writes: tuple[str, ...]
+    checkpoint: bool = False
+
+    @property
+    def path(self) -> pathlib.Path:
+        return SQL_SCRIPTS_DIR / f"{self.name}.sql"
+
+
+@dataclass(frozen=True)
+class TableSource:
+    """An input table of the pipeline: a fingerprint of its data and how to load it."""
+    fingerprint: str
+    load: Callable[[duckdb.DuckDBPyConnection], None]
+
+
+SETUP_SQL = SQL_SCRIPTS_DIR / "setup.sql"
+STEPS = [
+    Step(
+        "encode_ids", reads=("positions", "trips", "stop_times", "stops", DICTIONARY_TABLE),
+        writes=("positions", "trips", "stop_times", "stops"),
+    ),
+    Step(
+        "clean_data", reads=("positions", "trips", "stop_times"), writes=("positions", "trips", "stop_times"),
+        checkpoint=True,
+    ),
+    Step("attach_global_trip_id", reads=("positions", "stop_times"), writes=("positions",)),
+    Step("clean_stop_indicators", reads=("positions",), writes=("positions",)),
+    Step("use_geo", reads=("positions", "stops"), writes=("positions", "stops"), checkpoint=True),
+    Step("remove_clusters", reads=("positions",), writes=("positions",)),
+    Step("clean_stop_indicators", reads=("positions",), writes=("positions",)),
+    Step("remove_partial_trips", reads=("positions", "stop_times"), writes=("positions",)),
+    Step("create_hops", reads=("positions", "stop_times", "stops"), writes=("hops",), checkpoint=True),
+    Step("filter_frequency", reads=("positions",), writes=("positions",)),
+]
+STATIC_TABLES = ["stop_times", "stops", "trips"]
+# Tables written per date partition in incremental mode and per shard, both carry `global_trip_id`
+PARTITIONED_TABLES = ["positions", "hops"]
+OUTPUTS = {
+    "positions": TableOutput(partition_by=("service_date",), order_by=("global_trip_id", "timestamp")),
+    "hops": TableOutput(partition_by=("service_date",), order_by=("global_trip_id", "current_stop_sequence")),
+    "stop_times": TableOutput(order_by=("trip_id", "stop_sequence")),
+    "stops": TableOutput(order_by=("stop_id",)),
+    "trips": TableOutput(order_by=("trip_id",)),
+}
+SHARDS_DIR = ".shards"
+# Shards' outputs are only read once by the merge, they favor speed over size
+SHARD_COMPRESSION_LEVEL = 1
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Process transit data and generate outputs")
     parser.add_argument(
@@ -21,6 +102,91 @@ def parse_args():
         "--outputs-dir", "-o", type=str, required=True,
         help="Path to directory where processed outputs should be saved"
     )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="Only process date partitions whose inputs changed since the last run, "
+             "the service dates of the other partitions are kept"
+    )
+    parser.add_argument(
+        "--overlap-hours", type=float, default=6.0,
+        help="Hours of positions loaded from the neighbouring days in incremental mode, "
+             "must cover the longest trip plus the offset of the local time zone"
+    )
+    parser.add_argument(
+        "--partition-by-route", action="store_true",
+        help="Also partition positions and hops by route_id within their service dates"
+    )
+    parser.add_argument(
+        "--compression-level", type=str, action="append", default=[],
+        help="Zstd level of the outputs, either for every table (e.g. '9') or for one "
+             "(e.g. 'positions=9'), can be repeated"
+    )
+    parser.add_argument(
+        "--row-group-size", type=int, default=None,
+        help="Rows per parquet row group of the outputs, smaller groups let filtered reads skip more"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Processes running shards of the data in parallel, each with its own DuckDB connection"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=None,
+        help="Number of route shards, defaults to --workers, or to 1 in incremental mode "
+             "where the date partitions are processed in parallel"
+    )
+    parser.add_argument(
+        "--database", type=str, default=None,
+        help="Keep the tables in this DuckDB database file instead of in memory, so they can "
+             "exceed the memory limit. Shards use their own files next to it, removed when done. "
+             "A file an earlier run created is deleted and recreated, the run fails on any other existing file"
+    )
+    parser.add_argument(
+        "--threads", "--worker-threads", type=int, default=None,
+        help="DuckDB threads per process, defaults to an equal share of the cores"
+    )
+    parser.add_argument(
+        "--memory-limit", "--worker-memory", type=str, default=None,
+        help="DuckDB memory limit per process (e.g. '4GB'), defaults to an equal share of 80%% of the memory"
+    )
+    parser.add_argument(
+        "--temp-directory", type=str, default=None,
+        help="Directory DuckDB spills to beyond the memory limit, defaults to '<database>.tmp' "
+             "or '.tmp' without a database"
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, default=None,
+        help="Directory of the step cache, every step's output is stored there and "
+             "runs resume from the deepest step whose outputs are cached"
+    )
+    parser.add_argument(
+        "--from-step", type=str, default=None,
+        help="Rerun the steps starting with this one (name or 1-based number) even if they are cached"
+    )
+    parser.add_argument(
+        "--until-step", type=str, default=None,
+        help="Stop after this step (name or 1-based number) and save the tables at that point"
+    )
+    parser.add_argument(
+        "--fuse", action="store_true",
+        help="Fuse the steps between checkpoints into views instead of materializing the tables after every "
+             "step, it saves no time on the current steps"
+    )
+    parser.add_argument(
+        "--profile", type=str, default=None,
+        help="Profile the queries of every step and save the report as JSON to this path"
+    )
+    parser.add_argument(
+        "--compare-profile", type=str, default=None,
+        help="Report of an earlier run (see --profile) this run's steps are compared with"
+    )
+    parser.add_argument(
+        "--cache-max-gb", type=float, default=None,
+        help="Evict the least recently used cache entries above this size after the run"
+    )
+    parser.add_argument(
+        "--cache-max-age-days", type=float, default=None,
+        help="Evict cache entries unused for more than this many days after the run"
+    )
     return parser.parse_args()
 
 
@@ -31,56 +197,615 @@ def get_number_of_rows(conn: duckdb.DuckDBPyConnection, table: str) -> int:
     return result[0]
 
 
-def main():
-    args = parse_args()
+def output_query(conn: duckdb.DuckDBPyConnection, table_name: str) -> str:
+    """
+    Query of a table as it is saved: GEOMETRY points become POINT_2D (x, y) structs.
 
-    inputs_dir = pathlib.Path(args.inputs_dir)
-    output_dir = pathlib.Path(args.outputs_dir)
+    Steps keep GEOMETRY, aggregates such as `argmax` and `first` of POINT_2D
+    fail in DuckDB. The structs read back without the spatial extension.
+    """
+    points = [
+        column for column, column_type, *_ in conn.execute(f"DESCRIBE {table_name}").fetchall()
+        if column_type == "GEOMETRY"
+    ]
+    if not points:
+        return f"SELECT * FROM {table_name}"
+    return f"SELECT * REPLACE ({', '.join(f'{column}::POINT_2D AS {column}' for column in points)}) FROM {table_name}"
 
-    with duckdb.connect(":memory:") as conn:
+
+def created_by_pipeline(database: pathlib.Path) -> bool:
+    """Whether a database file holds the schema `connect` marks its files with."""
+    try:
+        with duckdb.connect(str(database), read_only=True) as conn:
+            return conn.execute(
+                "SELECT count(1) FROM duckdb_schemas() WHERE schema_name = $name", {"name": DATABASE_MARKER_SCHEMA}
+            ).fetchone()[0] > 0
+    except duckdb.Error:
+        return False
+
+
+def connect(database: pathlib.Path | None = None, config: dict | None = None) -> duckdb.DuckDBPyConnection:
+    """
+    In-memory connection, or one on a new database file replacing any left by an earlier run.
+
+    Only files created here are replaced, any other existing file, e.g. a
+    database of `load_data`, raises `FileExistsError`.
+    """
+    if database is None:
+        return duckdb.connect(":memory:", config=config or {})
+    if database.exists() and not created_by_pipeline(database):
+        raise FileExistsError(
+            f"Database '{database}' was not created by an earlier run and is not replaced, remove it or choose another"
+        )
+    database.parent.mkdir(parents=True, exist_ok=True)
+    for path in [database, database.with_name(f"{database.name}.wal")]:
+        path.unlink(missing_ok=True)
+    conn = duckdb.connect(str(database), config=config or {})
+    conn.execute(f"CREATE SCHEMA {DATABASE_MARKER_SCHEMA}")
+    return conn
+
+
+def get_temp_tables(conn: duckdb.DuckDBPyConnection) -> list[str]:
+    """Temporary tables, steps only create them as intermediates of their own."""
+    return [row[0] for row in conn.execute("SELECT table_name FROM duckdb_tables() WHERE temporary").fetchall()]
+
+
+def resolve_step(steps: list[Step], step: str) -> int:
+    """Index of a step given by its 1-based number or its name, the first occurrence wins."""
+    if step.isdigit() and 1 <= int(step) <= len(steps):
+        return int(step) - 1
+    for i, candidate in enumerate(steps):
+        if candidate.name == step:
+            return i
+    raise ValueError(f"Unknown step '{step}'. Valid options are: {[s.name for s in steps]}")
+
+
+def run_steps(
+    conn: duckdb.DuckDBPyConnection,
+    sources: dict[str, TableSource],
+    steps: list[Step] = STEPS,
+    cache: StepCache | None = None,
+    from_step: str | None = None,
+    until_step: str | None = None,
+    fuse: bool = False,
+    profile: bool = False,
+) -> list[dict]:
+    """
+    Execute the steps on the connection, loading their inputs only when needed.
+
+    Every step's cache key hashes its SQL, the setup SQL, the DuckDB version
+    and the versions of the tables it reads: the fingerprint of a source, or
+    the key of the step that last wrote the table. Keys are therefore known
+    before anything runs and the pipeline resumes after the deepest step for
+    which the latest version of every table is cached.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection the tables are created in.
+        sources (dict[str, TableSource]): Input tables of the pipeline.
+        steps (list[Step]): Steps to execute in order.
+        cache (StepCache, optional): Cache of the steps' outputs, disabled if None.
+        from_step (str, optional): First step executed even if it is cached.
+        until_step (str, optional): Last step executed.
+        fuse (bool): Fuse the rewrites of tables until the next checkpoint step, otherwise
+            every step is materialized.
+        profile (bool): Also collect the operator timings, peak buffer memory and spilled
+            bytes of every step's queries.
+
+    Returns:
+        list[dict]: Seconds, peak RSS, rows in and out of the touched tables and materialized
+            tables of every executed step, with a "profile" if requested.
+    """
+    run_sql_file(conn, SETUP_SQL)
+    setup_sql = SETUP_SQL.read_text()
+    if until_step is not None:
+        steps = steps[:resolve_step(steps, until_step) + 1]
+    max_resume = len(steps) if from_step is None else resolve_step(steps, from_step)
+
+    # Key of every step and the writer of each table's latest version after it
+    versions = {name: source.fingerprint for name, source in sources.items()}
+    writers = {name: None for name in sources}
+    keys, writers_after = [], [dict(writers)]
+    for step in steps:
+        key = hash_key(
+            duckdb.__version__, setup_sql, step.name, step.path.read_text(),
+            *(f"{table}={versions[table]}" for table in step.reads),
+        )
+        for table in step.writes:
+            versions[table] = key
+            writers[table] = key
+        keys.append(key)
+        writers_after.append(dict(writers))
+
+    resume = 0
+    if cache is not None:
+        for i in range(max_resume, 0, -1):
+            if all(key is None or cache.contains(key, [table]) for table, key in writers_after[i].items()):
+                resume = i
+                break
+        if from_step is not None and resume < max_resume:
+            logger.warning(f"Outputs before step '{from_step}' are not cached, running from step {resume + 1}")
+
+    reset_peak_rss()
+    for table, key in writers_after[resume].items():
+        if key is None:
+            sources[table].load(conn)
+        else:
+            cache.load(conn, key, table)
+    conn.execute("CHECKPOINT")
+    logger.info(f"Loaded the input tables, peak RSS {peak_rss() / 1024 ** 2:.1f} MB")
+    # Rows of the materialized tables, only counted once after they are written
+    row_counts = {table: get_number_of_rows(conn, table) for table in writers_after[resume]}
+    if resume > 0:
+        logger.info(f"Resumed from the cache after step '{steps[resume - 1].name}' ({resume} / {len(steps)})")
+
+    profiler = StepProfiler(conn) if profile else None
+    executor = FusedExecutor(
+        conn,
+        {table for step in steps for table in step.writes} if fuse else [],
+        on_execute=profiler.collect if profiler is not None else None,
+    )
+    stats = []
+    for i in range(resume, len(steps)):
+        step = steps[i]
+        logger.info(f"Executing step with name: '{step.name}'".ljust(70, " ") + f"({i + 1} / {len(steps)})")
+        rows = {table: {"in": row_counts.get(table)} for table in dict.fromkeys(step.reads + step.writes)}
+        if profiler is not None:
+            profiler.start()
+        reset_peak_rss()
+        start_time = time.perf_counter()
+        executor.materialized.clear()
+        executor.execute(step.path.read_text())
+        temp_tables = get_temp_tables(conn)
+        if step.checkpoint or temp_tables or i == len(steps) - 1:
+            executor.materialize()
+        # Views may read the intermediates, they are only dropped once materialized
+        for table_name in temp_tables:
+            conn.execute(f"DROP TABLE {table_name}")
+            logger.info(f"Dropped intermediate table '{table_name}'")
+        # Frees the blocks of replaced tables for reuse, a no-op in memory
+        conn.execute("CHECKPOINT")
+        elapsed_time = time.perf_counter() - start_time
+        step_stats = {
+            "step": step.name,
+            "seconds": elapsed_time,
+            "peak_rss": peak_rss(),
+            "materialized": list(executor.materialized),
+        }
+        if profiler is not None:
+            step_stats["profile"] = profiler.result()
+
+        for table in dict.fromkeys(step.writes + tuple(executor.materialized)):
+            row_counts[table] = None if table in executor.deferred else get_number_of_rows(conn, table)
+        for table in rows:
+            rows[table]["out"] = row_counts.get(table)
+        step_stats["rows"] = rows
+        stats.append(step_stats)
+        logger.info(
+            f"Step '{step.name}' completed in {elapsed_time:.4f} seconds, peak RSS {peak_rss() / 1024 ** 2:.1f} MB, "
+            + ", ".join(
+                f"{table}: {'deferred' if rows[table]['out'] is None else format(rows[table]['out'], ',')} rows"
+                for table in step.writes
+            )
+        )
+        if executor.deferred:
+            continue
+
+        if cache is not None:
+            # Versions written since the last checkpoint, every table under the key of its writer
+            unsaved = {}
+            for table, key in writers_after[i + 1].items():
+                if key is not None and not cache.contains(key, [table]):
+                    unsaved.setdefault(key, []).append(table)
+            for key, tables in unsaved.items():
+                cache.save(conn, key, steps[keys.index(key)].name, tables)
+    if profiler is not None:
+        profiler.close()
+    return stats
+
+
+def source_from_files(inputs_dir: pathlib.Path, table_name: str) -> TableSource:
+    """Source matching the files `create_table_from_files` reads, fingerprinted by their size and mtime."""
+    files = sorted(inputs_dir.glob(f"**/*{table_name}*.parquet"))
+    return TableSource(
+        fingerprint=hash_key(json.dumps(fingerprint(files, inputs_dir), sort_keys=True)),
+        load=partial(create_table_from_files, data_dir=inputs_dir, table_name=table_name),
+    )
+
+
+def update_ids(inputs_dir: pathlib.Path, output_dir: pathlib.Path, positions_files: list[pathlib.Path]) -> pathlib.Path:
+    """Add the ids of the static tables and of the positions files to the id dictionary of the outputs."""
+    path = output_dir / f"{DICTIONARY_TABLE}.parquet"
+    update_id_dictionary(path, {
+        "trips": sorted(inputs_dir.glob("**/*trips*.parquet")),
+        "stops": sorted(inputs_dir.glob("**/*stops*.parquet")),
+        "positions": positions_files,
+    })
+    return path
+
+
+def id_dictionary_source(path: pathlib.Path) -> TableSource:
+    return TableSource(
+        fingerprint=hash_key(json.dumps(fingerprint([path], path.parent), sort_keys=True)),
+        load=partial(load_id_dictionary, path=path),
+    )
+
+
+def configure_outputs(
+    partition_by_route: bool = False,
+    compression_levels: list[str] = (),
+    row_group_size: int | None = None,
+) -> dict[str, TableOutput]:
+    """`OUTPUTS` adjusted by the command line options."""
+    outputs = dict(OUTPUTS)
+    if partition_by_route:
+        for table_name in PARTITIONED_TABLES:
+            outputs[table_name] = replace(
+                outputs[table_name], partition_by=outputs[table_name].partition_by + ("route_id",)
+            )
+    for option in compression_levels:
+        table_name, _, level = option.rpartition("=")
+        if table_name and table_name not in outputs:
+            raise ValueError(f"Unknown table '{table_name}'. Valid options are: {list(outputs)}")
+        for name in [table_name] if table_name else list(outputs):
+            outputs[name] = replace(outputs[name], compression_level=int(level))
+    if row_group_size is not None:
+        outputs = {name: replace(output, row_group_size=row_group_size) for name, output in outputs.items()}
+    return outputs
+
+
+def process_all(
+    inputs_dir: pathlib.Path,
+    output_dir: pathlib.Path,
+    database: pathlib.Path | None = None,
+    config: dict | None = None,
+    profile_path: pathlib.Path | None = None,
+    baseline_profile: pathlib.Path | None = None,
+    outputs: dict[str, TableOutput] = OUTPUTS,
+    **kwargs,
+):
+    def load_positions(conn: duckdb.DuckDBPyConnection):
         logger.info(f"Loading parquet files from: {inputs_dir}")
-        # conn.execute(f"CREATE TABLE positions AS SELECT * FROM read_parquet($pattern)", parameters={"pattern": "data/raw/positions/2025-09-30/*.parquet"})
         create_table_from_files(conn, inputs_dir, "positions")
-        create_table_from_files(conn, inputs_dir, "stop_times")
-        create_table_from_files(conn, inputs_dir, "stops")
-        create_table_from_files(conn, inputs_dir, "trips")
-
         num_rows = get_number_of_rows(conn, "positions")
         logger.info(f"Loaded positions table with {num_rows:,} rows")
 
-        # Perform processing
-        steps = [
-            "clean_data",
-            "attach_global_trip_id",
-            "clean_stop_indicators",
-            "use_geo",
-            "remove_clusters",
-            "clean_stop_indicators",
-            "remove_partial_trips",
-            "create_hops",
-            "filter_frequency",
-        ]
-        for i, step_name in enumerate(steps, 1):
-            logger.info(f"Executing step with name: '{step_name}'".ljust(70, " ") + f"({i} / {len(steps)})")
-            start_time = time.perf_counter()
-            run_sql_file(conn, SQL_SCRIPTS_DIR / f"{step_name}.sql")
-            elapsed_time = time.perf_counter() - start_time
-            logger.info(f"Step '{step_name}' completed in {elapsed_time:.4f} seconds")
-            print(f"Count of position records: {get_number_of_rows(conn, 'positions'):,}")
+    id_dictionary = update_ids(inputs_dir, output_dir, sorted(inputs_dir.glob("**/*positions*.parquet")))
+    sources = {
+        "positions": TableSource(source_from_files(inputs_dir, "positions").fingerprint, load_positions),
+        **{table_name: source_from_files(inputs_dir, table_name) for table_name in STATIC_TABLES},
+        DICTIONARY_TABLE: id_dictionary_source(id_dictionary),
+    }
+    with connect(database, config) as conn:
+        profile = profile_path is not None or baseline_profile is not None
+        stats = run_steps(conn, sources, profile=profile, **kwargs)
+        if profile:
+            report = make_report(stats, inputs_dir=str(inputs_dir.absolute()))
+            if profile_path is not None:
+                write_report(report, profile_path)
+            print(format_report(report))
+            if baseline_profile is not None:
+                print(f"Compared with: {baseline_profile}")
+                print(compare_reports(read_report(baseline_profile), report))
 
         # Save data to disk
         output_dir.mkdir(parents=True, exist_ok=True)
         for table in conn.execute("SHOW TABLES").fetchall():
             table_name = table[0]
-            file_path = output_dir / f"{table_name}.parquet"
-            conn.execute(f"COPY {table_name} TO '{file_path}' (FORMAT PARQUET, COMPRESSION zstd, COMPRESSION_LEVEL 22)")
-            logger.info(f"Saved {table_name} to: {file_path.absolute()}")
+            if table_name == DICTIONARY_TABLE:
+                # Already among the outputs, rewriting it would change its fingerprint
+                continue
+            output = outputs.get(table_name, TableOutput())
+            columns = {row[0] for row in conn.execute(f"DESCRIBE {table_name}").fetchall()}
+            if "global_trip_id" not in columns or not set(output.order_by) <= columns:
+                # Tables saved by --until-step before the columns are created
+                output = replace(output, partition_by=(), order_by=())
+            write_table(conn, output_query(conn, table_name), output_dir, table_name, output)
+            logger.info(f"Saved {table_name} to: {output_dir.absolute()}")
 
             num_rows = get_number_of_rows(conn, table_name)
             print(f"SCHEMA of '{table_name}' ({num_rows:,}):")
             print(conn.sql(f"SUMMARIZE {table_name}"))
 
 
+def process_shard(
+    inputs_dir: pathlib.Path,
+    output_dir: pathlib.Path,
+    files: list[pathlib.Path],
+    inputs: dict[str, list[int]],
+    id_dictionary: pathlib.Path,
+    day: date | None = None,
+    overlap: timedelta = timedelta(0),
+    routes: list[str] | None = None,
+    save_static: bool = False,
+    database: pathlib.Path | None = None,
+    config: dict | None = None,
+    **kwargs,
+) -> dict[str, int]:
+    """
+    Run the pipeline on a subset of the positions and save its `positions` and `hops`.
+
+    Steps only relate positions of the same `global_trip_id`, so a subset
+    holding every position of its trips gives the same rows as a full run.
+    With `day` the positions of the neighbouring days are only loaded within
+    `overlap` of the day's boundaries, so trips crossing midnight are
+    complete, and only the trips whose `global_trip_id` packs `day` are
+    saved. With `routes` only the trips of those routes are loaded.
+
+    Args:
+        inputs_dir (pathlib.Path): Directory of the inputs, static tables are read from here.
+        output_dir (pathlib.Path): Directory the tables are saved to as `<table>.parquet`.
+        files (list[pathlib.Path]): Positions files to read.
+        inputs (dict[str, list[int]]): Fingerprint of the positions files.
+        id_dictionary (pathlib.Path): Id dictionary holding the ids of the files, see `update_ids`.
+        day (date, optional): Only save the trips of this day.
+        overlap (timedelta): Positions loaded around `day`.
+        routes (list[str], optional): Only process the trips of these routes.
+        save_static (bool): Also save the static tables.
+        database (pathlib.Path, optional): Database file of the shard, removed once saved.
+        config (dict, optional): DuckDB settings of the connection, e.g. its memory limit.
+
+    Returns:
+        dict[str, int]: Number of rows saved per partitioned table.
+    """
+    conditions = []
+    parameters = {"files": [str(path.absolute()) for path in files]}
+    if day is not None:
+        start = datetime.combine(day, datetime.min.time(), tzinfo=timezone.utc) - overlap
+        end = datetime.combine(day + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc) + overlap
+        conditions.append("epoch(timestamp) >= $start AND epoch(timestamp) < $end")
+        parameters.update(start=start.timestamp(), end=end.timestamp())
+    if routes is not None:
+        conditions.append("trip_id IN (SELECT trip_id FROM read_parquet($trips) WHERE list_contains($routes, route_id))")
+        parameters.update(
+            trips=[str(path.absolute()) for path in sorted(inputs_dir.glob("**/*trips*.parquet"))],
+            routes=list(routes),
+        )
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    def load_positions(conn: duckdb.DuckDBPyConnection):
+        conn.execute(f"CREATE TABLE positions AS SELECT * FROM read_parquet($files){where}", parameters=parameters)
+        logger.info(
+            f"Loaded {get_number_of_rows(conn, 'positions'):,} positions from {len(files)} files"
+            + (f" for {day}" if day is not None else "")
+            + (f" of {len(routes)} routes" if routes is not None else "")
+        )
+
+    sources = {
+        "positions": TableSource(
+            hash_key(
+                json.dumps(inputs, sort_keys=True),
+                json.dumps({name: value for name, value in parameters.items() if name != "files"}, sort_keys=True),
+            ),
+            load_positions,
+        ),
+        **{table_name: source_from_files(inputs_dir, table_name) for table_name in STATIC_TABLES},
+        DICTIONARY_TABLE: id_dictionary_source(id_dictionary),
+    }
+    config = dict(config or {})
+    if "temp_directory" in config:
+        # Concurrent shards must not share their spill files
+        config["temp_directory"] = str(pathlib.Path(config["temp_directory"]) / output_dir.name)
+    with connect(database, config) as conn:
+        # Progress bars of concurrent shards would garble each other
+        conn.execute("SET enable_progress_bar = false")
+        run_steps(conn, sources, **kwargs)
+
+        num_rows = {}
+        for table_name in PARTITIONED_TABLES:
+            query = output_query(conn, table_name)
+            if day is not None:
+                query += f" WHERE {service_date_sql()} = DATE '{day.isoformat()}'"
+            file_path = output_dir / f"{table_name}.parquet"
+            copy_to_parquet(conn, query, file_path, compression_level=SHARD_COMPRESSION_LEVEL)
+            num_rows[table_name] = conn.execute(f"SELECT count(1) FROM ({query})").fetchone()[0]
+            logger.info(f"Saved {num_rows[table_name]:,} rows of '{table_name}' to: {file_path.absolute()}")
+
+        if save_static:
+            for table_name in STATIC_TABLES:
+                copy_to_parquet(
+                    conn, output_query(conn, table_name), output_dir / f"{table_name}.parquet",
+                    compression_level=SHARD_COMPRESSION_LEVEL,
+                )
+
+    if database is not None:
+        database.unlink(missing_ok=True)
+    return num_rows
+
+
+def merge_shards(
+    shard_dirs: list[pathlib.Path],
+    output_dir: pathlib.Path,
+    outputs: dict[str, TableOutput] = OUTPUTS,
+    day: date | None = None,
+    save_static: bool = False,
+) -> dict[str, int]:
+    """
+    Merge the tables saved by `process_shard` into the outputs.
+
+    Rows are sorted by their `outputs` order, so the result does not depend
+    on how the positions were sharded. Static tables are the same in every
+    shard, they are written from the first one.
+
+    Args:
+        shard_dirs (list[pathlib.Path]): Output directories of the shards, removed afterwards.
+        output_dir (pathlib.Path): Directory of the outputs.
+        outputs (dict[str, TableOutput]): How the tables are written.
+        day (date, optional): Service date of the shards, only its partitions are replaced.
+        save_static (bool): Also write the static tables.
+
+    Returns:
+        dict[str, int]: Number of rows written per partitioned table.
+    """
+    num_rows = {}
+    with duckdb.connect(":memory:") as conn:
+        for table_name in PARTITIONED_TABLES:
+            files = [str(shard_dir / f"{table_name}.parquet") for shard_dir in shard_dirs]
+            num_rows[table_name] = write_table(
+                conn, f"SELECT * FROM read_parquet({files!r})", output_dir, table_name, outputs[table_name],
+                replace=day is None,
+            )
+            if day is not None and num_rows[table_name] == 0:
+                # Nothing replaced the partition of an earlier run
+                shutil.rmtree(output_dir / table_name / f"service_date={day.isoformat()}", ignore_errors=True)
+        if save_static:
+            for table_name in STATIC_TABLES:
+                file_path = shard_dirs[0] / f"{table_name}.parquet"
+                write_table(conn, f"SELECT * FROM read_parquet('{file_path}')", output_dir, table_name, outputs[table_name])
+    for shard_dir in shard_dirs:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    if not any(shard_dirs[0].parent.iterdir()):
+        shard_dirs[0].parent.rmdir()
+    return num_rows
+
+
+def shard_database(database: pathlib.Path | None, shard_dir: pathlib.Path) -> pathlib.Path | None:
+    """Database file of a shard next to `database`, None when running in memory."""
+    if database is None:
+        return None
+    return database.with_name(f"{database.stem}-{shard_dir.name}{database.suffix}")
+
+
+def process_sharded(
+    inputs_dir: pathlib.Path,
+    output_dir: pathlib.Path,
+    num_shards: int,
+    workers: int,
+    database: pathlib.Path | None = None,
+    outputs: dict[str, TableOutput] = OUTPUTS,
+    **kwargs,
+):
+    """Run the pipeline on route shards in `workers` processes and merge their outputs."""
+    files = sorted(inputs_dir.glob("**/*positions*.parquet"))
+    trips_files = sorted(inputs_dir.glob("**/*trips*.parquet"))
+    inputs = fingerprint(files, inputs_dir)
+    shard_routes = balance_routes(files, trips_files, num_shards)
+    id_dictionary = update_ids(inputs_dir, output_dir, files)
+
+    shard_dirs = [output_dir / SHARDS_DIR / f"shard-{i}" for i in range(len(shard_routes))]
+    tasks = [
+        partial(
+            process_shard, inputs_dir, shard_dir, files, inputs, id_dictionary,
+            routes=routes, save_static=i == 0, database=shard_database(database, shard_dir), **kwargs,
+        )
+        for i, (shard_dir, routes) in enumerate(zip(shard_dirs, shard_routes))
+    ]
+    start_time = time.perf_counter()
+    for shard_dir, num_rows in zip(shard_dirs, run_tasks(tasks, workers)):
+        logger.info(f"Shard '{shard_dir.name}' completed with {num_rows} rows")
+    merge_shards(shard_dirs, output_dir, outputs, save_static=True)
+    logger.info(
+        f"Processed {len(shard_dirs)} shards with {workers} workers in {time.perf_counter() - start_time:.2f} seconds"
+    )
+
+
+def process_incremental(
+    inputs_dir: pathlib.Path,
+    output_dir: pathlib.Path,
+    overlap: timedelta,
+    num_shards: int = 1,
+    workers: int = 1,
+    database: pathlib.Path | None = None,
+    outputs: dict[str, TableOutput] = OUTPUTS,
+    **kwargs,
+):
+    partitions = list_partitions(inputs_dir, "positions")
+    trips_files = sorted(inputs_dir.glob("**/*trips*.parquet"))
+    manifest = PartitionManifest(output_dir / "manifest.json")
+
+    pending = []
+    for day in sorted(partitions):
+        # The neighbouring days contribute the overlap, their changes affect this day too
+        files = [
+            path
+            for neighbour in [day - timedelta(days=1), day, day + timedelta(days=1)]
+            for path in partitions.get(neighbour, [])
+        ]
+        inputs = fingerprint(files, inputs_dir)
+        if manifest.is_current(day, inputs):
+            logger.info(f"Skipping {day}: its inputs did not change since the last run")
+            continue
+        pending.append((day, files, inputs))
+    logger.info(f"Processing {len(pending)} of {len(partitions)} date partitions")
+    # Keys are only appended, the partitions of earlier runs keep theirs
+    id_dictionary = update_ids(
+        inputs_dir, output_dir, sorted({path for _, files, _ in pending for path in files})
+    )
+
+    # Every partition is split into route shards, all shards of all partitions share the pool
+    tasks, shards = [], []
+    for i, (day, files, inputs) in enumerate(pending):
+        shard_routes = [None] if num_shards <= 1 else balance_routes(files, trips_files, num_shards)
+        shard_dirs = [output_dir / SHARDS_DIR / f"{day.isoformat()}-{j}" for j in range(len(shard_routes))]
+        for j, (shard_dir, routes) in enumerate(zip(shard_dirs, shard_routes)):
+            tasks.append(partial(
+                process_shard, inputs_dir, shard_dir, files, inputs, id_dictionary,
+                day=day, overlap=overlap, routes=routes,
+                save_static=i == len(pending) - 1 and j == 0,
+                database=shard_database(database, shard_dir), **kwargs,
+            ))
+        shards.extend((i, j == len(shard_dirs) - 1, shard_dirs) for j in range(len(shard_dirs)))
+
+    start_time = time.perf_counter()
+    num_rows = {}
+    for (i, is_last, shard_dirs), shard_rows in zip(shards, run_tasks(tasks, workers)):
+        for table_name, count in shard_rows.items():
+            num_rows[table_name] = num_rows.get(table_name, 0) + count
+        if not is_last:
+            continue
+
+        day, _, inputs = pending[i]
+        merge_shards(shard_dirs, output_dir, outputs, day=day, save_static=i == len(pending) - 1)
+        manifest.record(day, inputs, num_rows)
+        manifest.save()
+        logger.info(f"Partition {day} completed with {num_rows} rows")
+        num_rows = {}
+    logger.info(f"Processed {len(pending)} partitions in {time.perf_counter() - start_time:.2f} seconds")
+
+
+def main():
+    args = parse_args()
+
+    inputs_dir = pathlib.Path(args.inputs_dir)
+    output_dir = pathlib.Path(args.outputs_dir)
+
+    cache = StepCache(args.cache_dir) if args.cache_dir is not None else None
+    kwargs = {
+        "cache": cache,
+        "from_step": args.from_step,
+        "fuse": args.fuse,
+        "database": pathlib.Path(args.database) if args.database is not None else None,
+        "config": worker_config(args.workers, args.threads, args.memory_limit, args.temp_directory),
+        "outputs": configure_outputs(args.partition_by_route, args.compression_level, args.row_group_size),
+    }
+    num_shards = args.shards if args.shards is not None else (1 if args.incremental else args.workers)
+    sharded = args.incremental or num_shards > 1 or args.workers > 1
+    if sharded and args.until_step is not None:
+        raise ValueError("--until-step is only supported by a single process run, shards need every step")
+    if sharded and (args.profile is not None or args.compare_profile is not None):
+        raise ValueError("--profile and --compare-profile are only supported by a single process run")
+
+    if args.incremental:
+        process_incremental(
+            inputs_dir, output_dir, timedelta(hours=args.overlap_hours),
+            num_shards=num_shards, workers=args.workers, **kwargs,
+        )
+    elif sharded:
+        process_sharded(inputs_dir, output_dir, num_shards=num_shards, workers=args.workers, **kwargs)
+    else:
+        process_all(
+            inputs_dir, output_dir, until_step=args.until_step,
+            profile_path=pathlib.Path(args.profile) if args.profile is not None else None,
+            baseline_profile=pathlib.Path(args.compare_profile) if args.compare_profile is not None else None,
+            **kwargs,
+        )
+
+    if cache is not None and (args.cache_max_gb is not None or args.cache_max_age_days is not None):
+        cache.evict(
+            max_bytes=None if args.cache_max_gb is None else int(args.cache_max_gb * 1024 ** 3),
+            max_age=None if args.cache_max_age_days is None else args.cache_max_age_days * 24 * 3600,
+        )
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         level=logging.INFO,
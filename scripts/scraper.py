@@ -1,21 +1,28 @@
-import io
+import asyncio
 import logging
 import os
 import re
-import threading
-import time
-import gc
+import signal
+import tempfile
 from datetime import datetime
+from functools import partial
 from itertools import groupby
 from pathlib import Path
 
 import pandas as pd
-import schedule
-from azure.storage.blob import BlobServiceClient
+import pyarrow as pa
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
+from google.transit import gtfs_realtime_pb2
 
-from src.fetch.alerts import fetch_alerts
-from src.fetch.vehicle_positions import fetch_vehicle_positions
+from src.compaction import DEFAULT_SORT_BY, compact_parquet_files
+from src.fetch.alerts import parse_alerts
+from src.fetch.delta import VehicleDeltaFilter
+from src.fetch.poller import FeedJob, FeedPoller
+from src.fetch.transit_feed import ConditionalFeedFetcher
+from src.fetch.trip_updates import decode_trip_updates
+from src.fetch.vehicle_positions import decode_vehicle_positions
+from src.storage import AzureBlobStore, LocalBlobStore, UploadQueue
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -23,29 +30,62 @@ logger = logging.getLogger(__name__)
 CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 POSITIONS_CONTAINER = os.getenv("POSITIONS_CONTAINER", "positions")
 ALERTS_CONTAINER = os.getenv("ALERTS_CONTAINER", "alerts")
-
-
-def upload_df_to_azure(df: pd.DataFrame, connection: str, container_name: str, filename: str):
-    blob_service_client = BlobServiceClient.from_connection_string(connection)
-    container_client = blob_service_client.get_container_client(container_name)
-    if not container_client.exists():
-        container_client.create_container()
-        logger.info(f"Created container: '{container_name}'")
-
-    blob_client = container_client.get_blob_client(blob=filename)
-    data = df.convert_dtypes(dtype_backend='pyarrow').to_parquet(index=False)
-    blob_client.upload_blob(data, overwrite=True)
-    logger.info(f"Uploaded to '{container_name}': '{filename}' ({len(df)} rows)")
-
-
-def merge_parquets(connection: str, container_name: str):
-    logger.info(f"Starting merge for container: '{container_name}'")
-    blob_service_client = BlobServiceClient.from_connection_string(connection)
-    container_client = blob_service_client.get_container_client(container_name)
-
+TRIP_UPDATES_CONTAINER = os.getenv("TRIP_UPDATES_CONTAINER", "trip_updates")
+
+# Poll intervals in seconds, every poll is delayed by a random jitter of at most POLL_JITTER
+POSITIONS_INTERVAL = float(os.getenv("POSITIONS_INTERVAL", "15"))
+ALERTS_INTERVAL = float(os.getenv("ALERTS_INTERVAL", str(24 * 3600)))
+TRIP_UPDATES_INTERVAL = float(os.getenv("TRIP_UPDATES_INTERVAL", "15"))
+POLL_JITTER = float(os.getenv("POLL_JITTER", "1"))
+
+DATA_DIR = Path(__file__).parent.parent / "data"
+UPLOAD_SPILL_DIR = Path(os.getenv("UPLOAD_SPILL_DIR", DATA_DIR / "spill"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "32"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+MERGE_ROW_GROUP_SIZE = int(os.getenv("MERGE_ROW_GROUP_SIZE", str(128 * 1024)))
+# Seconds between full fleet snapshots, positions in between only carry changed vehicles
+POSITIONS_KEYFRAME_INTERVAL = float(os.getenv("POSITIONS_KEYFRAME_INTERVAL", "3600"))
+
+_blob_stores = {}
+_upload_queue = None
+_positions_delta = VehicleDeltaFilter(keyframe_interval=POSITIONS_KEYFRAME_INTERVAL)
+
+
+def get_blob_store(container_name: str = None):
+    """Long-lived store per container, falls back to the local data directory without Azure."""
+    if container_name not in _blob_stores:
+        if CONNECTION_STRING is not None and container_name is not None:
+            _blob_stores[container_name] = AzureBlobStore(CONNECTION_STRING, container_name)
+        else:
+            _blob_stores[container_name] = LocalBlobStore(DATA_DIR, name=container_name or "local")
+    return _blob_stores[container_name]
+
+
+def get_upload_queue():
+    global _upload_queue
+    if _upload_queue is None:
+        _upload_queue = UploadQueue(
+            spill_dir=UPLOAD_SPILL_DIR,
+            get_store=get_blob_store,
+            max_size=UPLOAD_QUEUE_SIZE,
+            num_workers=UPLOAD_WORKERS,
+        )
+    return _upload_queue
+
+
+def to_parquet_bytes(df: pd.DataFrame | pa.Table) -> bytes:
+    if isinstance(df, pa.Table):
+        sink = pa.BufferOutputStream()
+        pq.write_table(df, sink)
+        return sink.getvalue().to_pybytes()
+    return df.convert_dtypes(dtype_backend='pyarrow').to_parquet(index=False)
+
+
+def merge_parquets(store, sort_by=DEFAULT_SORT_BY):
+    logger.info(f"Starting merge for container: '{store.name}'")
     parquet_files = sorted(
         name
-        for name in container_client.list_blob_names()
+        for name in store.list_names()
         if re.match(r".*[0-9]{2}([0-9]{4})?\.parquet$", name)
     )
     for key, group in groupby(
@@ -56,127 +96,140 @@ def merge_parquets(connection: str, container_name: str):
             logger.info(f"Skipping group '{key}': less than 2 files to merge.")
             continue
 
+        merged_file = f"{key}.parquet"
         try:
-            grouped_dfs = []
-            for file_name in group:
-                blob_client = container_client.get_blob_client(file_name)
-                with io.BytesIO() as b:
-                    blob_client.download_blob().readinto(b)
-                    grouped_dfs.append(pd.read_parquet(b, engine='pyarrow'))
-
-            merged_file = f"{key}.parquet"
-            merged_df = pd.concat(grouped_dfs)
-            upload_df_to_azure(merged_df, connection, container_name, merged_file)
-            del grouped_dfs
-            del merged_df
+            with tempfile.TemporaryDirectory() as temp_dir:
+                temp_dir = Path(temp_dir)
+                source_paths = []
+                expected_rows = 0
+                for i, file_name in enumerate(group):
+                    source_path = temp_dir / f"source_{i}.parquet"
+                    store.download_to_file(file_name, source_path)
+                    expected_rows += pq.ParquetFile(source_path).metadata.num_rows
+                    source_paths.append(source_path)
+
+                merged_path = temp_dir / "merged.parquet"
+                num_rows = compact_parquet_files(
+                    source_paths, merged_path, row_group_size=MERGE_ROW_GROUP_SIZE, sort_by=sort_by
+                )
+                store.upload_file(merged_file, merged_path)
+                logger.info(f"Uploaded to '{store.name}': '{merged_file}' ({num_rows} rows)")
+
+                # Only delete the sources once the uploaded blob reads back complete
+                verify_path = temp_dir / "verify.parquet"
+                store.download_to_file(merged_file, verify_path)
+                uploaded_rows = pq.ParquetFile(verify_path).metadata.num_rows
+                if uploaded_rows != expected_rows:
+                    raise ValueError(
+                        f"Merged blob '{merged_file}' has {uploaded_rows} rows, expected {expected_rows}"
+                    )
 
             for file_name in group:
                 if file_name == merged_file:
                     continue
-                blob_client = container_client.get_blob_client(file_name)
-                blob_client.delete_blob()
+                store.delete(file_name)
             logger.info(f"Successfully merged {len(group)} files into: '{merged_file}'")
         except Exception:
             logger.error(f"Error during merging and uploading parquet files for key '{key}':", exc_info=True)
 
-    # Trigger garbage collection
-    before = gc.get_count()
-    gc.collect()
-    after = gc.get_count()
-    logger.info(f"Garbage collection triggered. Counts before: {before}, after: {after}")
-
 
-def save_positions(container_name: str = None):
+def save_positions(feed: gtfs_realtime_pb2.FeedMessage, container_name: str = None):
     date_str = datetime.now().strftime("%Y-%m-%d")
     time_str = datetime.now().strftime("%H:%M:%S")
 
-    logger.info(f"Fetching vehicle positions at {date_str} {time_str} ...")
-    df = fetch_vehicle_positions()
-    if df.empty:
+    logger.info(f"Processing vehicle positions at {date_str} {time_str} ...")
+    table = decode_vehicle_positions(feed)
+    if table.num_rows == 0:
         logger.info("No vehicle positions fetched.")
         return
 
+    num_fetched = table.num_rows
+    table, keyframe = _positions_delta.filter(table)
+    if table.num_rows == 0:
+        logger.info(f"None of the {num_fetched} vehicle positions changed since the last fetch.")
+        return
+
     filename = f"{date_str}/vehicle_positions_{time_str.replace(':', '')}.parquet"
-    if CONNECTION_STRING is not None and container_name is not None:
-        try:
-            upload_df_to_azure(df, CONNECTION_STRING, container_name, filename)
-        except Exception as e:
-            logger.error(f"Failed to upload {filename} to Azure Blob Storage: {e}")
-    else:
-        file_path = Path(__file__).parent.parent / "data" / filename
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        df.to_parquet(file_path, index=False)
-        logger.info(f"Saved vehicle positions to {file_path} ({len(df)} rows)")
+    store = get_blob_store(container_name)
+    get_upload_queue().submit(store, filename, to_parquet_bytes(table))
+    logger.info(
+        f"Queued vehicle positions for '{store.name}': '{filename}' "
+        f"({table.num_rows} / {num_fetched} rows{', keyframe' if keyframe else ''})"
+    )
 
 
-def save_alerts(container_name: str = None):
+def save_trip_updates(feed: gtfs_realtime_pb2.FeedMessage, container_name: str = None):
     date_str = datetime.now().strftime("%Y-%m-%d")
     time_str = datetime.now().strftime("%H:%M:%S")
 
-    logger.info(f"Fetching alerts at {date_str} {time_str} ...")
-    df = fetch_alerts()
+    logger.info(f"Processing trip updates at {date_str} {time_str} ...")
+    table = decode_trip_updates(feed)
+    if table.num_rows == 0:
+        logger.info("No trip updates fetched.")
+        return
+
+    filename = f"{date_str}/trip_updates_{time_str.replace(':', '')}.parquet"
+    store = get_blob_store(container_name)
+    get_upload_queue().submit(store, filename, to_parquet_bytes(table))
+    logger.info(f"Queued trip updates for '{store.name}': '{filename}' ({table.num_rows} rows)")
+
+
+def save_alerts(feed: gtfs_realtime_pb2.FeedMessage, container_name: str = None):
+    date_str = datetime.now().strftime("%Y-%m-%d")
+    time_str = datetime.now().strftime("%H:%M:%S")
+
+    logger.info(f"Processing alerts at {date_str} {time_str} ...")
+    df = parse_alerts(feed)
     if df.empty:
         logger.info("No alerts fetched.")
         return
 
     filename = f"{date_str}/alerts_{time_str.replace(':', '')}.parquet"
-    if CONNECTION_STRING is not None and container_name is not None:
-        try:
-            upload_df_to_azure(df, CONNECTION_STRING, container_name, filename)
-        except Exception as e:
-            logger.error(f"Failed to upload {filename} to Azure Blob Storage: {e}")
-    else:
-        file_path = Path(__file__).parent.parent / "data" / filename
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        df.to_parquet(file_path, index=False)
-        logger.info(f"Saved alerts to {file_path} ({len(df)} rows)")
+    store = get_blob_store(container_name)
+    get_upload_queue().submit(store, filename, to_parquet_bytes(df))
+    logger.info(f"Queued alerts for '{store.name}': '{filename}' ({len(df)} rows)")
 
 
 def main():
-    # Track running jobs
-    running_jobs = set()
-    job_lock = threading.Lock()
-
-    def run_threaded(job_func, *args, **kwargs):
-        job_id = f"{job_func.__name__}_{'_'.join(map(str, args))}"
-        with job_lock:
-            if job_id in running_jobs:
-                logger.debug(f"Job {job_id} is already running, skipping")
-                return None
-            running_jobs.add(job_id)
-        
-        def job_wrapper():
-            try:
-                job_func(*args, **kwargs)
-            finally:
-                with job_lock:
-                    running_jobs.discard(job_id)
-        
-        job_thread = threading.Thread(target=job_wrapper)
-        job_thread.start()
-        return job_thread
-
-    # Run initial jobs
-    threads = [
-        run_threaded(save_positions, POSITIONS_CONTAINER),
-        run_threaded(save_alerts, ALERTS_CONTAINER)
-    ]
-    for thread in threads:
-        if thread:  # Only join if thread was created
-            thread.join()
-
-    # Schedule recurring jobs
+    poller = FeedPoller([
+        FeedJob(
+            fetcher=ConditionalFeedFetcher(feed_type="vehicle_pos"),
+            handle=partial(save_positions, container_name=POSITIONS_CONTAINER),
+            interval=POSITIONS_INTERVAL,
+            jitter=POLL_JITTER,
+        ),
+        FeedJob(
+            fetcher=ConditionalFeedFetcher(feed_type="trip_updates"),
+            handle=partial(save_trip_updates, container_name=TRIP_UPDATES_CONTAINER),
+            interval=TRIP_UPDATES_INTERVAL,
+            jitter=POLL_JITTER,
+        ),
+        FeedJob(
+            fetcher=ConditionalFeedFetcher(feed_type="alerts"),
+            handle=partial(save_alerts, container_name=ALERTS_CONTAINER),
+            interval=ALERTS_INTERVAL,
+            jitter=POLL_JITTER,
+        ),
+    ])
     if CONNECTION_STRING is not None:
-        # merge_parquets(CONNECTION_STRING, POSITIONS_CONTAINER)
-        schedule.every().hour.do(run_threaded, merge_parquets, CONNECTION_STRING, POSITIONS_CONTAINER)
-    
-    schedule.every(15).seconds.do(run_threaded, save_positions, POSITIONS_CONTAINER)
-    schedule.every().day.do(run_threaded, save_alerts, ALERTS_CONTAINER)
-
-    logger.info("Scheduler loop starting ...")
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+        poller.every(3600, partial(merge_parquets, get_blob_store(POSITIONS_CONTAINER)))
+        poller.every(3600, partial(
+            merge_parquets,
+            get_blob_store(TRIP_UPDATES_CONTAINER),
+            sort_by=("trip_id", "stop_sequence"),
+        ))
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, poller.stop)
+        await poller.run()
+
+    try:
+        asyncio.run(run())
+    finally:
+        logger.info("Waiting for pending uploads ...")
+        get_upload_queue().close()
 
 
 if __name__ == "__main__":
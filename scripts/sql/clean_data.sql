@@ -1,8 +1,3 @@
--- Remove duplicates and invalid rows
-CREATE OR REPLACE TABLE positions AS
-    SELECT DISTINCT * FROM positions p WHERE p.trip_id IS NOT NULL;
-
-
 -- Filter to the top 100 routes
 CREATE OR REPLACE TABLE trips AS
     WITH 
@@ -20,11 +15,21 @@ CREATE OR REPLACE TABLE trips AS
     SELECT t.* FROM trips t
     JOIN routes_of_interest roi ON t.route_id = roi.route_id;
 
+-- Times are stored as integer seconds since the start of the service day, times
+-- of trips running past midnight stay above 24:00 as in the GTFS
 CREATE OR REPLACE TABLE stop_times AS
-    SELECT st.*
+    SELECT st.* EXCLUDE (departure_time, arrival_time),
+        (split_part(departure_time, ':', 1)::INT * 3600
+            + split_part(departure_time, ':', 2)::INT * 60
+            + split_part(departure_time, ':', 3)::INT) AS departure_seconds,
+        (split_part(arrival_time, ':', 1)::INT * 3600
+            + split_part(arrival_time, ':', 2)::INT * 60
+            + split_part(arrival_time, ':', 3)::INT) AS arrival_seconds,
     FROM stop_times st
     WHERE st.trip_id IN (SELECT trip_id FROM trips);
 
+-- Remove duplicates and invalid rows, drop unused columns and localize timestamps
+-- in one statement, every copy of positions would take its full size
 CREATE OR REPLACE TABLE positions AS
     SELECT 
         p.* EXCLUDE(
@@ -33,34 +38,10 @@ CREATE OR REPLACE TABLE positions AS
             vehicle_license_plate,
             current_status,
             stop_id,
-        ) 
-    FROM positions p
+            timestamp,
+        ),
+        -- Wall clock time in Budapest, the raw timestamps are UTC instants
+        timestamp AT TIME ZONE 'Europe/Budapest' AS timestamp
+    FROM (SELECT DISTINCT * FROM positions WHERE trip_id IS NOT NULL) p
     WHERE p.trip_id IN (SELECT trip_id FROM trips);
 
-
--- Localize timestamps
-CREATE OR REPLACE TABLE positions AS
-    SELECT p.* EXCLUDE (timestamp),
-        timestamp AT TIME ZONE 'UTC' AT TIME ZONE 'Europe/Budapest' AS timestamp
-    FROM positions p;
-
-
--- Clean stop_times
-CREATE OR REPLACE TABLE stop_times AS
-    SELECT * EXCLUDE (departure_time, arrival_time),
-        CAST(lpad((left(departure_time, 2)::INT % 24)::VARCHAR, 2, '0') || substring(departure_time, 3) AS TIME) AS departure_time,
-        CAST(lpad((left(arrival_time, 2)::INT % 24)::VARCHAR, 2, '0') || substring(arrival_time, 3) AS TIME) AS arrival_time,
-    FROM stop_times;
-
-
--- Custom function for calculating the shortest distance between two time points
--- STRICTLY time points
-CREATE OR REPLACE MACRO timediff(part, start_t, end_t) AS
-CASE
-    WHEN 12 < datediff('hour', start_t, end_t) 
-        THEN -(datediff(part, end_t, TIME '23:59:59') + datediff(part, TIME '00:00:00', start_t))
-    WHEN datediff('hour', start_t, end_t) < - 12
-        THEN datediff(part, start_t, TIME '23:59:59') + datediff(part, TIME '00:00:00', end_t)
-    ELSE 
-        datediff(part, start_t, end_t)
-END;
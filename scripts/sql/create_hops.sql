@@ -11,6 +11,8 @@ CREATE OR REPLACE TABLE hops AS
                 vehicle_id,
                 current_stop_sequence, 
                 max(timestamp) AS timestamp,
+                -- Increases with the timestamp within a trip
+                max(service_seconds) AS service_seconds,
                 argmax(pos, timestamp) AS pos
             FROM positions 
             WHERE current_stop_sequence IS NOT NULL
@@ -18,6 +20,7 @@ CREATE OR REPLACE TABLE hops AS
         )
     SELECT
         a.global_trip_id,
+        a.route_id,
         a.trip_id,
         a.current_stop_sequence,
 
@@ -27,13 +30,13 @@ CREATE OR REPLACE TABLE hops AS
         ), st.stop_id) AS from_stop_id,
         st.stop_id AS to_stop_id,
 
-        COALESCE(LAG(a.timestamp) OVER (
+        a.service_seconds - COALESCE(LAG(a.service_seconds) OVER (
             PARTITION BY a.global_trip_id
             ORDER BY a.current_stop_sequence
-        ), a.timestamp) AS actual_departure,
+        ), a.service_seconds) AS actual_duration,
+        a.timestamp - to_seconds(actual_duration) AS actual_departure,
         a.timestamp AS actual_arrival,
-
-        datediff('second', actual_departure, actual_arrival)::INT AS actual_duration,
+        a.service_seconds AS actual_arrival_seconds,
 
         -- distance from target when arrival is registered
         ST_Distance(a.pos, s.stop_pos) * 111111 AS distance_from_target,
@@ -0,0 +1,25 @@
+-- Replace the string ids with their integer keys of the id dictionary, the steps
+-- join, group and partition by the keys. Ids missing from the dictionary become NULL.
+CREATE OR REPLACE TABLE trips AS
+    SELECT t.* REPLACE (r.key AS route_id, tr.key AS trip_id)
+    FROM trips t
+    LEFT JOIN id_dictionary r ON r.kind = 'route' AND r.id = t.route_id::VARCHAR
+    LEFT JOIN id_dictionary tr ON tr.kind = 'trip' AND tr.id = t.trip_id::VARCHAR;
+
+CREATE OR REPLACE TABLE stop_times AS
+    SELECT st.* REPLACE (tr.key AS trip_id, s.key AS stop_id)
+    FROM stop_times st
+    LEFT JOIN id_dictionary tr ON tr.kind = 'trip' AND tr.id = st.trip_id::VARCHAR
+    LEFT JOIN id_dictionary s ON s.kind = 'stop' AND s.id = st.stop_id::VARCHAR;
+
+CREATE OR REPLACE TABLE stops AS
+    SELECT st.* REPLACE (s.key AS stop_id)
+    FROM stops st
+    LEFT JOIN id_dictionary s ON s.kind = 'stop' AND s.id = st.stop_id::VARCHAR;
+
+CREATE OR REPLACE TABLE positions AS
+    SELECT p.* REPLACE (tr.key AS trip_id, r.key AS route_id, v.key AS vehicle_id)
+    FROM positions p
+    LEFT JOIN id_dictionary tr ON tr.kind = 'trip' AND tr.id = p.trip_id
+    LEFT JOIN id_dictionary r ON r.kind = 'route' AND r.id = p.route_id
+    LEFT JOIN id_dictionary v ON v.kind = 'vehicle' AND v.id = p.vehicle_id;
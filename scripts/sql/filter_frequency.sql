@@ -1,5 +1,5 @@
 CREATE OR REPLACE TABLE positions AS
     SELECT 
-        first(COLUMNS(p.*))
+        first(COLUMNS(p.*) ORDER BY p.timestamp)
     FROM positions p
     GROUP BY global_trip_id, datetrunc('minutes', p.timestamp);
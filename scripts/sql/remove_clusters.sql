@@ -1,19 +1,101 @@
-CREATE TEMP TABLE clusters AS
+-- A position is part of a cluster when more than 15 positions of the same trip and
+-- stop with other timestamps are "in proximity" (closer than 40 m). Instead of
+-- measuring every pair, positions are hashed into grid cells whose diagonal is
+-- just below 40 m: all positions sharing a cell are in proximity of each other and
+-- positions in proximity are at most 2 cells apart.
+CREATE TEMP TABLE cells AS
+    WITH params AS (
+        SELECT 40 / 111111 / sqrt(2) * (1 - 1e-9) AS cell_size
+    )
     SELECT
-        p1.global_trip_id,
-        p1.current_stop_sequence,
-        p1.timestamp,
-        count(1) AS count
-    FROM positions p1
-    JOIN positions p2 ON p1.global_trip_id = p2.global_trip_id 
-        AND p1.current_stop_sequence = p2.current_stop_sequence
-        AND p1.timestamp != p2.timestamp
-        AND ST_Distance(p1.pos, p2.pos) * 111111 < 40 -- What is called "in proximity"
-    GROUP BY p1.global_trip_id, p1.current_stop_sequence, p1.timestamp
-    HAVING count > 15; -- How many points are in proximity to this
+        p.*,
+        floor(ST_X(p.pos) / params.cell_size)::BIGINT AS cell_x,
+        floor(ST_Y(p.pos) / params.cell_size)::BIGINT AS cell_y,
+        count(1) OVER (PARTITION BY group_id, cell_x, cell_y, p.timestamp) AS same_timestamp_count,
+    FROM (
+        SELECT * EXCLUDE (pair_count),
+            dense_rank() OVER (ORDER BY global_trip_id, current_stop_sequence) AS group_id,
+        FROM (
+            SELECT global_trip_id, current_stop_sequence, timestamp, pos,
+                count(1) OVER (PARTITION BY global_trip_id, current_stop_sequence, timestamp)
+                    * (count(1) OVER (PARTITION BY global_trip_id, current_stop_sequence)
+                        - count(1) OVER (PARTITION BY global_trip_id, current_stop_sequence, timestamp))
+                    AS pair_count,
+            FROM positions
+            WHERE current_stop_sequence IS NOT NULL AND pos IS NOT NULL
+        )
+        -- Trips and stops with too few positions cannot have clusters
+        QUALIFY max(pair_count) OVER (PARTITION BY global_trip_id, current_stop_sequence) > 15
+    ) p, params;
+
+CREATE TEMP TABLE clusters AS
+    WITH
+        cell_counts AS (
+            SELECT group_id, cell_x, cell_y, count(1) AS count
+            FROM cells
+            GROUP BY group_id, cell_x, cell_y
+        ),
+        -- Positions in the cell and in the 5x5 block of cells around it
+        block_counts AS (
+            SELECT
+                c.group_id,
+                c.cell_x,
+                c.cell_y,
+                any_value(c.count) AS cell_count,
+                sum(n.count) AS block_count,
+            FROM (
+                SELECT c.*, c.cell_x + dx AS near_x, c.cell_y + dy AS near_y
+                FROM cell_counts c, range(-2, 3) AS offset_x(dx), range(-2, 3) AS offset_y(dy)
+            ) c
+            JOIN cell_counts n ON c.group_id = n.group_id
+                AND c.near_x = n.cell_x
+                AND c.near_y = n.cell_y
+            GROUP BY c.group_id, c.cell_x, c.cell_y
+        ),
+        -- Lower and upper bounds of the positions in proximity
+        bounds AS (
+            SELECT
+                c.group_id,
+                c.timestamp,
+                sum(b.cell_count - c.same_timestamp_count) AS min_count,
+                sum(b.block_count - c.same_timestamp_count) AS max_count,
+            FROM cells c
+            JOIN block_counts b USING (group_id, cell_x, cell_y)
+            GROUP BY c.group_id, c.timestamp
+        ),
+        -- Only the positions the bounds do not decide are measured exactly
+        undecided AS (
+            SELECT c.*, c.cell_x + dx AS near_x, c.cell_y + dy AS near_y
+            FROM cells c
+            SEMI JOIN (
+                SELECT * FROM bounds WHERE min_count <= 15 AND max_count > 15
+            ) b USING (group_id, timestamp)
+            CROSS JOIN range(-2, 3) AS offset_x(dx)
+            CROSS JOIN range(-2, 3) AS offset_y(dy)
+        ),
+        exact_counts AS (
+            SELECT c1.group_id, c1.timestamp, count(1) AS count
+            FROM undecided c1
+            JOIN cells c2 ON c1.group_id = c2.group_id
+                AND c1.near_x = c2.cell_x
+                AND c1.near_y = c2.cell_y
+                AND c1.timestamp != c2.timestamp
+                AND ST_Distance(c1.pos, c2.pos) * 111111 < 40 -- What is called "in proximity"
+            GROUP BY c1.group_id, c1.timestamp
+        ),
+        cluster_points AS (
+            SELECT group_id, timestamp, min_count AS count FROM bounds WHERE min_count > 15
+            UNION ALL
+            SELECT group_id, timestamp, count FROM exact_counts WHERE count > 15 -- How many points are in proximity to this
+        )
+    SELECT DISTINCT c.global_trip_id, c.current_stop_sequence, c.timestamp, cp.count
+    FROM cluster_points cp
+    JOIN cells c USING (group_id, timestamp);
+
+DROP TABLE cells;
 
 CREATE OR REPLACE TABLE positions AS
-    SELECT 
+    SELECT
         p.* EXCLUDE (current_stop_sequence),
         IF(
             c.count IS NOT NULL,
@@ -25,4 +107,6 @@ CREATE OR REPLACE TABLE positions AS
         AND p.global_trip_id = c.global_trip_id
         AND p.current_stop_sequence = c.current_stop_sequence
         AND p.timestamp = c.timestamp
-    ORDER BY p.global_trip_id, p.timestamp;
\ No newline at end of file
+    ORDER BY p.global_trip_id, p.timestamp;
+
+DROP TABLE clusters;
@@ -1,4 +1,7 @@
-CREATE OR REPLACE TABLE positions AS
+-- Deleting in place avoids a second copy of positions, rows are kept exactly
+-- where `global_trip_id IN (...)` holds
+DELETE FROM positions
+WHERE (global_trip_id IN (
     WITH
         stops_visited AS (
             SELECT
@@ -14,13 +17,10 @@ CREATE OR REPLACE TABLE positions AS
                 count(DISTINCT stop_sequence) AS stop_count
             FROM stop_times
             GROUP BY trip_id
-        ),
-        full_trips AS (
-            SELECT 
-                sv.global_trip_id
-            FROM stops_visited sv
-            JOIN stop_counts sc ON
-                sc.trip_id = sv.trip_id AND sc.stop_count = sv.stop_count
         )
-    SELECT p.* FROM positions p
-    WHERE p.global_trip_id IN (SELECT global_trip_id FROM full_trips);
+    SELECT 
+        sv.global_trip_id
+    FROM stops_visited sv
+    JOIN stop_counts sc ON
+        sc.trip_id = sv.trip_id AND sc.stop_count = sv.stop_count
+)) IS NOT TRUE;
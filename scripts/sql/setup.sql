@@ -0,0 +1,3 @@
+-- Executed on every connection before the steps, so any step can run on its own
+install spatial;
+load spatial;
@@ -1,6 +1,4 @@
--- Use geo columns for coordinate data 
-install spatial;
-load spatial;
+-- Use geo columns for coordinate data, saved as the POINT_2D structs readers use
 
 CREATE OR REPLACE TABLE positions AS
     SELECT *, ST_Point(latitude, longitude) AS pos FROM positions;
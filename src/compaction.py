@@ -0,0 +1,98 @@
+import logging
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SORT_BY = ("vehicle_id", "timestamp")
+
+
+def _plain_schema(schema: pa.Schema) -> pa.Schema:
+    # Dictionary-encoded columns are written as plain strings, parquet applies
+    # its own dictionary encoding per column chunk anyway
+    return pa.schema([
+        pa.field(
+            field.name,
+            field.type.value_type if pa.types.is_dictionary(field.type) else field.type,
+        )
+        for field in schema
+    ])
+
+
+def unify_parquet_schemas(paths: list[os.PathLike]) -> pa.Schema:
+    """Common schema of the parquet files, read from their footers only."""
+    schemas = [_plain_schema(pq.read_schema(path).remove_metadata()) for path in paths]
+    return pa.unify_schemas(schemas, promote_options="permissive")
+
+
+def compact_parquet_files(
+    paths: list[os.PathLike],
+    output_path: os.PathLike,
+    row_group_size: int = 128 * 1024,
+    sort_by=DEFAULT_SORT_BY,
+    compression: str = "zstd",
+) -> int:
+    """
+    Stream the row groups of several parquet files into a single file.
+
+    Source row groups are read one at a time and buffered until a full output
+    row group is collected, so memory is bounded by roughly one output row
+    group regardless of the number and size of the inputs. Every output row
+    group is sorted by `sort_by`, which is also recorded as the file's
+    sorting columns so readers can rely on it within each row group.
+
+    Args:
+        paths (list[os.PathLike]): Parquet files to compact, in order.
+        output_path (os.PathLike): Path of the compacted parquet file.
+        row_group_size (int): Number of rows per output row group.
+        sort_by (tuple[str]): Columns each row group is sorted by, missing columns are ignored.
+        compression (str): Parquet compression codec of the output.
+
+    Returns:
+        int: Number of rows written.
+    """
+    schema = unify_parquet_schemas(paths)
+    sort_keys = [(name, "ascending") for name in sort_by if name in schema.names]
+    sorting_columns = pq.SortingColumn.from_ordering(schema, sort_keys) if sort_keys else None
+
+    def flush(writer: pq.ParquetWriter, table: pa.Table):
+        if sort_keys:
+            table = table.sort_by(sort_keys)
+        writer.write_table(table, row_group_size=row_group_size)
+
+    num_rows = 0
+    buffered = []
+    buffered_rows = 0
+    with pq.ParquetWriter(
+        output_path, schema, compression=compression, sorting_columns=sorting_columns
+    ) as writer:
+        for path in paths:
+            source = pq.ParquetFile(path)
+            for i in range(source.num_row_groups):
+                table = source.read_row_group(i)
+                table = pa.Table.from_arrays(
+                    [table.column(name).cast(schema.field(name).type) if name in table.column_names
+                     else pa.nulls(table.num_rows, schema.field(name).type)
+                     for name in schema.names],
+                    schema=schema,
+                )
+                buffered.append(table)
+                buffered_rows += table.num_rows
+
+                while buffered_rows >= row_group_size:
+                    pending = pa.concat_tables(buffered)
+                    flush(writer, pending.slice(0, row_group_size))
+                    num_rows += row_group_size
+                    # Copy the remainder so the flushed buffers can be released
+                    rest = pending.slice(row_group_size).combine_chunks()
+                    buffered = [rest]
+                    buffered_rows = rest.num_rows
+
+        if buffered_rows > 0:
+            flush(writer, pa.concat_tables(buffered))
+            num_rows += buffered_rows
+
+    logger.info(f"Compacted {len(paths)} parquet files into: '{output_path}' ({num_rows:,} rows)")
+    return num_rows
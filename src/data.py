@@ -1,3 +1,4 @@
+import json
 import os
 import pathlib
 import logging
@@ -7,51 +8,107 @@ import numpy as np
 import pandas as pd
 import torch
 from torch_geometric.data import HeteroData
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 
+from src.features import add_position_features, add_stop_features, delay_sql
+from src.pipeline.cache import ArrayCache, hash_key
+from src.pipeline.ids import DICTIONARY_TABLE
+from src.pipeline.manifest import fingerprint
 
 logger = logging.getLogger(__name__)
 
+# Version of the features of `DelayPredictionDataset`, increment it when they change to invalidate the cached datasets
+FEATURES_VERSION = 2
+# Tables of the processed data read by `load_data`
+DATASET_TABLES = ["stop_times", "trips", "stops", DICTIONARY_TABLE, "positions", "hops"]
+# Partitioned by service date and sorted by trip, queries filtering on those only read the matching files and row groups
+VIEW_TABLES = ["positions", "hops"]
+# Point columns of the tables, `POINT_2D` structs of (x, y) or WKB written by earlier versions of the pipeline
+POINT_COLUMNS = {"positions": "pos", "stops": "stop_pos"}
+# Table of a persistent database recording the data it was loaded from
+LOADED_DATA_TABLE = "__loaded_data"
 
-def load_data(data_dir, database: str):
-    conn = duckdb.connect(database)
-    for table_name in ["positions", "stop_times", "hops", "trips", "stops"]:
-        create_table_from_files(conn, data_dir, table_name)
-
-    conn.install_extension("spatial")
-    conn.load_extension("spatial")
-    conn.execute("""
-CREATE OR REPLACE TABLE positions AS
-    SELECT * EXCLUDE (pos),
-        ST_GeomFromWKB(pos)::POINT_2D AS pos,
-    FROM positions;
-
-CREATE OR REPLACE TABLE stops AS
-    SELECT * EXCLUDE (stop_pos),
-        ST_GeomFromWKB(stop_pos)::POINT_2D AS stop_pos,
-    FROM stops;
-    
--- Custom function for calculating the shortest distance between two time points
--- STRICTLY time points
-CREATE OR REPLACE MACRO timediff(part, start_t, end_t) AS
-CASE
-    WHEN 12 < datediff('hour', start_t, end_t) 
-        THEN -(datediff(part, end_t, TIME '23:59:59') + datediff(part, TIME '00:00:00', start_t))
-    WHEN datediff('hour', start_t, end_t) < - 12
-        THEN datediff(part, start_t, TIME '23:59:59') + datediff(part, TIME '00:00:00', end_t)
-    ELSE 
-        datediff(part, start_t, end_t)
-END;""")
 
+def data_files(data_dir) -> list[pathlib.Path]:
+    """Parquet files of the processed data read by `load_data`."""
+    data_dir = pathlib.Path(data_dir)
+    return sorted({path for table_name in DATASET_TABLES for path in data_dir.glob(f"**/*{table_name}*.parquet")})
+
+
+def load_data(data_dir, database: str, lazy: bool = False):
+    """
+    Connect to a database of the processed data of `data_dir`.
+
+    Ids are integer keys, the id dictionary resolves them to the GTFS ids.
+
+    Args:
+        data_dir: Directory of the processed data.
+        database (str): Database file, or ":memory:". A file loaded from the
+            same files before is reused as is, so later sessions start at once.
+        lazy (bool): Create views of every table instead of copying the small ones,
+            and keep the points as (x, y) structs, without the spatial extension.
+            Points written as WKB still need the extension.
+
+    Returns:
+        duckdb.DuckDBPyConnection: Connection of the database.
+    """
+    conn = duckdb.connect(database)
+    spatial = not lazy or "BLOB" in _point_types(conn, data_dir).values()
+    if spatial:
+        conn.install_extension("spatial")
+        conn.load_extension("spatial")
+        # The extension reads the WKB of GeoParquet files as GEOMETRY, so the types change once it is loaded
+        point_types = _point_types(conn, data_dir)
+
+    persistent = database != ":memory:"
+    if persistent:
+        data_key = hash_key(
+            str(pathlib.Path(data_dir).absolute()),
+            str(lazy),
+            json.dumps(fingerprint(data_files(data_dir), pathlib.Path(data_dir)), sort_keys=True),
+        )
+        if _loaded_data_key(conn) == data_key:
+            logger.info(f"Reusing the data loaded into: {database}")
+            return conn
+
+    for table_name in DATASET_TABLES:
+        columns = "*"
+        if spatial and table_name in POINT_COLUMNS:
+            column = POINT_COLUMNS[table_name]
+            # GEOMETRY and (x, y) structs cast as they are, WKB without GeoParquet metadata stays BLOB
+            point = f"ST_GeomFromWKB({column})" if point_types[table_name] == "BLOB" else column
+            columns = f"* REPLACE ({point}::POINT_2D AS {column})"
+        create_table_from_files(conn, data_dir, table_name, view=lazy or table_name in VIEW_TABLES, columns=columns)
+
+    if persistent:
+        conn.execute(f"CREATE OR REPLACE TABLE {LOADED_DATA_TABLE} AS SELECT $key AS key", parameters={"key": data_key})
     return conn
 
 
+def _point_types(conn: duckdb.DuckDBPyConnection, data_dir) -> dict[str, str]:
+    """Types of the point columns of the parquet files, e.g. `BLOB` of WKB."""
+    return {
+        table_name: conn.execute(
+            f"DESCRIBE SELECT {column} FROM {parquet_source(data_dir, table_name)[0]}"
+        ).fetchone()[1]
+        for table_name, column in POINT_COLUMNS.items()
+    }
+
+
+def _loaded_data_key(conn: duckdb.DuckDBPyConnection) -> str | None:
+    try:
+        return conn.execute(f"SELECT key FROM {LOADED_DATA_TABLE}").fetchone()[0]
+    except duckdb.CatalogException:
+        return None
+
+
 def run_sql_file(conn: duckdb.DuckDBPyConnection, file_path: os.PathLike):
     with open(file_path) as f:
         conn.execute(f.read())
 
 
-def create_table_from_files(conn: duckdb.DuckDBPyConnection, data_dir, table_name: str):
+def parquet_source(data_dir, table_name: str) -> tuple[str, int]:
+    """`read_parquet` of the parquet files of `data_dir` with `table_name` in their name, and their number."""
     data_dir = pathlib.Path(data_dir)
     pattern = f"**/*{table_name}*.parquet"
 
@@ -64,107 +121,203 @@ def create_table_from_files(conn: duckdb.DuckDBPyConnection, data_dir, table_nam
             f"No parquet files found for table '{table_name}' in directory {data_dir} with pattern {pattern}"
         )
 
+    # Views cannot have parameters
     pattern = data_dir.absolute() / pattern
-    conn.execute(
-        f"CREATE TABLE {table_name} AS SELECT * FROM read_parquet($pattern)",
-        parameters={"pattern": str(pattern)},
+    return "read_parquet('{}')".format(str(pattern).replace("'", "''")), num_files
+
+
+def create_table_from_files(
+    conn: duckdb.DuckDBPyConnection, data_dir, table_name: str, view: bool = False, columns: str = "*"
+):
+    """
+    Create a table of the parquet files of `data_dir` with `table_name` in their name.
+
+    Hive partitions of the files (e.g. `service_date=2025-10-01/`) become
+    columns. A view reads the files on every query instead, filters on the
+    partitions and sorted columns then skip the files and row groups that
+    cannot match. Existing tables or views of the name are replaced.
+    """
+    source, num_files = parquet_source(data_dir, table_name)
+    existing = conn.execute(
+        "SELECT table_type FROM information_schema.tables WHERE table_name = $name AND table_schema = current_schema()",
+        parameters={"name": table_name},
+    ).fetchone()
+    if existing is not None:
+        conn.execute(f"DROP {'VIEW' if existing[0] == 'VIEW' else 'TABLE'} {table_name}")
+    conn.execute(f"CREATE {'VIEW' if view else 'TABLE'} {table_name} AS SELECT {columns} FROM {source}")
+    logger.info(
+        f"Created {'view' if view else 'table'} '{table_name}' with {num_files} parquet files matching: {source}"
     )
-    logger.info(f"Created table '{table_name}' with {num_files} parquet files matching pattern: {pattern}")
 
 
-def time_to_sin_cos(time_obj):
-    seconds = time_obj.hour * 3600 + time_obj.minute * 60 + time_obj.second
-    angle = 2 * np.pi * seconds / 86400  # 86400 seconds in a day
-    return np.sin(angle), np.cos(angle)
+# Times are seconds since the start of the trip's service day, the delay is their difference
+STOPS_SQL = f"""
+    SELECT
+        h.global_trip_id, s.stop_id, s.stop_lat, s.stop_lon,
+        h.actual_arrival_seconds, st.arrival_seconds AS scheduled_arrival_seconds,
+        {delay_sql("h.actual_arrival_seconds", "st.arrival_seconds")} AS delay,
+        h.current_stop_sequence
+    FROM hops h
+    JOIN stops s ON h.to_stop_id = s.stop_id
+    JOIN stop_times st ON h.trip_id = st.trip_id AND h.to_stop_id = st.stop_id
+"""
+STOPS_ORDER = "global_trip_id, current_stop_sequence"
+POSITIONS_SQL = """
+    SELECT p.global_trip_id, p.latitude, p.longitude, p.bearing, p.speed, p.timestamp, p.service_seconds
+    FROM positions p
+        JOIN hops h ON p.global_trip_id = h.global_trip_id AND p.current_stop_sequence = h.current_stop_sequence
+    WHERE p.service_seconds < h.actual_arrival_seconds
+"""
+POSITIONS_ORDER = "global_trip_id, timestamp"
+
+
+def get_stop_id_mapping(conn: duckdb.DuckDBPyConnection, min_count: int = 30) -> dict:
+    """Embedding ids of the stops with more than `min_count` arrivals, from 1 by decreasing count, 0 is the rest."""
+    stop_ids = conn.execute(
+        f"SELECT stop_id FROM ({STOPS_SQL}) GROUP BY stop_id HAVING count(1) > $min_count "
+        "ORDER BY count(1) DESC, stop_id",
+        parameters={"min_count": min_count},
+    ).fetchall()
+    return {stop_id: i + 1 for i, (stop_id,) in enumerate(stop_ids)}
+
+
+def to_shared_columns(df: pd.DataFrame) -> tuple[dict[str, torch.Tensor], dict[str, np.dtype]]:
+    """
+    The columns of a DataFrame as tensors in shared memory, with their dtypes.
+
+    Forked or spawned DataLoader workers map the same memory instead of
+    copying it, and reading numeric arrays does not write to their pages,
+    unlike the reference counts of Python objects. Dates and durations are
+    stored as their int64 values.
+    """
+    columns, dtypes = {}, {}
+    for name in df.columns:
+        array = df[name].to_numpy()
+        if array.dtype == object:
+            raise TypeError(f"Column '{name}' has Python objects, encode it as integers first")
+        dtypes[name] = array.dtype
+        if array.dtype.kind in "mM":
+            array = array.view(np.int64)
+        columns[name] = torch.from_numpy(np.array(array)).share_memory_()
+    return columns, dtypes
+
+
+def from_shared_columns(columns: dict[str, torch.Tensor], dtypes: dict[str, np.dtype]) -> pd.DataFrame:
+    return pd.DataFrame({name: column.numpy().view(dtypes[name]) for name, column in columns.items()})
 
 
 class DelayPredictionDataset(Dataset):
+    """
+    Samples of every position of a trip, with the stops of the trip.
+
+    The stops and positions are kept as columns in shared memory, see
+    `to_shared_columns`, so the memory of DataLoader workers does not grow
+    with the samples they read. `stops_df` and `pos_df` are copies of them
+    as DataFrames.
+    """
+
     def __init__(self, conn: duckdb.DuckDBPyConnection):
-        self.stops_df = conn.execute("""
-            SELECT 
-                h.global_trip_id, s.stop_id, s.stop_lat, s.stop_lon, 
-                h.actual_arrival, st.arrival_time AS scheduled_arrival,
-                h.current_stop_sequence
-            FROM hops h
-            JOIN stops s ON h.to_stop_id = s.stop_id
-            JOIN stop_times st ON h.trip_id = st.trip_id AND h.to_stop_id = st.stop_id
-            ORDER BY h.global_trip_id, h.current_stop_sequence
-        """).fetchdf()
-        self.stops_df["actual_arrival"] = self.stops_df["actual_arrival"]
-        self.stops_df.set_index(["global_trip_id", "current_stop_sequence"], inplace=True)
-
-        stop_id_counts = self.stops_df["stop_id"].value_counts()
-        self.stop_id_mapping = {
-            stop_id: i + 1
-            for i, stop_id in enumerate(
-                stop_id_counts[
-                    stop_id_counts > 30
-                ].index  # pyright: ignore[reportAttributeAccessIssue]
-            )
+        # The orders name the output columns, the joined tables of the queries share some of them
+        stops_df = conn.execute(f"SELECT * FROM ({STOPS_SQL}) ORDER BY {STOPS_ORDER}").fetchdf()
+        self.stop_id_mapping = get_stop_id_mapping(conn)
+        add_stop_features(stops_df, list(self.stop_id_mapping))
+
+        pos_df = conn.execute(f"SELECT * FROM ({POSITIONS_SQL}) ORDER BY {POSITIONS_ORDER}").fetchdf()
+        add_position_features(pos_df)
+
+        # Stops are sorted by trip, the stops of a position are a range of them
+        stop_trips = stops_df["global_trip_id"].to_numpy()
+        position_trips = pos_df["global_trip_id"].to_numpy()
+        pos_df["stops_start"] = np.searchsorted(stop_trips, position_trips, side="left")
+        pos_df["stops_end"] = np.searchsorted(stop_trips, position_trips, side="right")
+
+        self.stops, self.stop_dtypes = to_shared_columns(stops_df)
+        self.positions, self.position_dtypes = to_shared_columns(pos_df)
+
+    def to_arrays(self) -> tuple[dict[str, np.ndarray], dict]:
+        """The columns of the dataset as arrays, and the metadata `from_arrays` needs."""
+        arrays = {f"stops.{name}": column.numpy() for name, column in self.stops.items()}
+        arrays.update({f"positions.{name}": column.numpy() for name, column in self.positions.items()})
+        metadata = {
+            "stop_dtypes": {name: dtype.str for name, dtype in self.stop_dtypes.items()},
+            "position_dtypes": {name: dtype.str for name, dtype in self.position_dtypes.items()},
+            # Stops with an embedding id, by the id
+            "stop_ids": list(self.stop_id_mapping),
         }
-        self.stops_df["stop_id_int"] = self.stops_df["stop_id"].map(
-            lambda x: self.stop_id_mapping.get(x, 0)
+        return arrays, metadata
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], metadata: dict) -> "DelayPredictionDataset":
+        """A dataset of the arrays written by `to_arrays`."""
+        dataset = cls.__new__(cls)
+        dataset.stop_id_mapping = {stop_id: i + 1 for i, stop_id in enumerate(metadata["stop_ids"])}
+        for table, dtypes in [("stops", metadata["stop_dtypes"]), ("positions", metadata["position_dtypes"])]:
+            setattr(dataset, table, {
+                name: torch.from_numpy(arrays[f"{table}.{name}"]).share_memory_() for name in dtypes
+            })
+        dataset.stop_dtypes = {name: np.dtype(dtype) for name, dtype in metadata["stop_dtypes"].items()}
+        dataset.position_dtypes = {name: np.dtype(dtype) for name, dtype in metadata["position_dtypes"].items()}
+        return dataset
+
+    @property
+    def stops_df(self) -> pd.DataFrame:
+        return from_shared_columns(self.stops, self.stop_dtypes).set_index(
+            ["global_trip_id", "current_stop_sequence"]
         )
 
-        self.stops_df["actual_arrival_sin"], self.stops_df["actual_arrival_cos"] = zip(
-            *self.stops_df["actual_arrival"].dt.time.apply(time_to_sin_cos)
-        )
-        self.stops_df["scheduled_arrival_sin"], self.stops_df["scheduled_arrival_cos"] = zip(
-            *self.stops_df["scheduled_arrival"].apply(time_to_sin_cos)
-        )
-
-        self.stops_df["delay"] = (
-            pd.to_timedelta(self.stops_df["actual_arrival"].dt.time.astype("string"))
-            - pd.to_timedelta(self.stops_df["scheduled_arrival"].astype("string"))  # pyright: ignore[reportCallIssue, reportArgumentType]
-        ).dt.total_seconds()
-
-        self.pos_df = conn.execute("""
-            SELECT p.global_trip_id, p.latitude, p.longitude, p.bearing, p.speed, p.timestamp
-            FROM positions p
-                JOIN hops h ON p.global_trip_id = h.global_trip_id AND p.current_stop_sequence = h.current_stop_sequence
-            WHERE p.timestamp < h.actual_arrival
-            ORDER BY p.global_trip_id, p.timestamp
-        """).fetchdf()
-        self.pos_df["timestamp_sin"], self.pos_df["timestamp_cos"] = zip(
-            *self.pos_df["timestamp"].dt.time.apply(time_to_sin_cos)
-        )
+    @property
+    def pos_df(self) -> pd.DataFrame:
+        return from_shared_columns(self.positions, self.position_dtypes).drop(columns=["stops_start", "stops_end"])
 
     def __len__(self):
-        return len(self.pos_df)
+        return len(self.positions["global_trip_id"])
 
     def __getitem__(self, index: int):
-        position_row = self.pos_df.iloc[index]
-        stops_slice = self.stops_df.loc[(position_row["global_trip_id"], slice(None))]
-        return self.build_graph(position_row, stops_slice)
-
-    def build_graph(self, position: pd.Series, stops_df: pd.DataFrame):
+        position = {name: column[index].item() for name, column in self.positions.items()}
+        start, end = position["stops_start"], position["stops_end"]
+        stops = {name: column[start:end].numpy() for name, column in self.stops.items()}
+        return self.build_graph(position, stops)
+
+    @staticmethod
+    def build_graph(position, stops_df):
+        """
+        The graph of a position and the stops of its trip.
+
+        Args:
+            position: Row of the position, e.g. a `pd.Series` or dict.
+            stops_df: Columns of the trip's stops, e.g. a `pd.DataFrame` or dict of arrays.
+        """
         data = HeteroData()
 
-        is_past = stops_df["actual_arrival"].values <= position["timestamp"]
+        is_past = np.asarray(stops_df["actual_arrival_seconds"]) <= position["service_seconds"]
         is_future = ~is_past
 
         past_indices = np.flatnonzero(is_past)
         future_indices = np.flatnonzero(is_future)
-        num_stops = len(stops_df)
+        num_stops = len(is_past)
 
         # Stop features
-        x_stop = stops_df[[
-            "scheduled_arrival_sin", 
-            "scheduled_arrival_cos", 
-            "delay",
-            "delay", # MASK flag
-        ]].to_numpy(dtype=np.float32)
+        x_stop = np.stack([
+            np.asarray(stops_df[column], dtype=np.float32) for column in [
+                "scheduled_arrival_sin",
+                "scheduled_arrival_cos",
+                "delay",
+                "delay", # MASK flag
+            ]
+        ], axis=1)
         x_stop[is_future, -2] = 0.0 # Remove delay for future stops
         x_stop[:, -1] = is_past.astype(np.float32) # MASK flag
 
         data["stop"].x = torch.from_numpy(x_stop)
 
         # Static Inputs for Embeddings (Physical ID and GPS)
-        data["stop"].physical_id = torch.tensor(stops_df["stop_id_int"].astype(int).values, dtype=torch.long)
-        data["stop"].pos = torch.tensor(stops_df[["stop_lat", "stop_lon"]].values, dtype=torch.float)
+        data["stop"].physical_id = torch.tensor(np.asarray(stops_df["stop_id_int"]), dtype=torch.long)
+        data["stop"].pos = torch.tensor(
+            np.stack([np.asarray(stops_df["stop_lat"]), np.asarray(stops_df["stop_lon"])], axis=1), dtype=torch.float
+        )
 
         # Ground Truth (Target) for ALL nodes
-        data["stop"].y = torch.tensor(stops_df["delay"].values, dtype=torch.float)
+        data["stop"].y = torch.tensor(np.asarray(stops_df["delay"]), dtype=torch.float)
 
         # Bus features
         data["bus"].x = torch.tensor([[position["speed"], position["bearing"]]], dtype=torch.float)
@@ -196,6 +349,185 @@ class DelayPredictionDataset(Dataset):
         return data
 
 
+def dataset_cache_key(data_dir) -> str:
+    """Cache key of the dataset of `data_dir`: its files' fingerprints, the queries and the features' version."""
+    return hash_key(
+        str(FEATURES_VERSION),
+        STOPS_SQL,
+        POSITIONS_SQL,
+        duckdb.__version__,
+        json.dumps(fingerprint(data_files(data_dir), pathlib.Path(data_dir)), sort_keys=True),
+    )
+
+
+def load_dataset(data_dir, cache_dir=None, max_cache_bytes: int | None = None) -> DelayPredictionDataset:
+    """
+    The `DelayPredictionDataset` of the processed data, read from the cache if it was built before.
+
+    Args:
+        data_dir: Directory of the processed data.
+        cache_dir (os.PathLike, optional): Directory of the cached datasets, disabled if None.
+        max_cache_bytes (int, optional): Evict the least recently used datasets above this size.
+
+    Returns:
+        DelayPredictionDataset: The dataset, its columns in shared memory.
+    """
+    if cache_dir is None:
+        with load_data(data_dir, ":memory:", lazy=True) as conn:
+            return DelayPredictionDataset(conn)
+
+    cache = ArrayCache(cache_dir)
+    key = dataset_cache_key(data_dir)
+    if cache.contains(key):
+        dataset = DelayPredictionDataset.from_arrays(*cache.load(key))
+        logger.info(f"Loaded {len(dataset):,} samples from the cache: {key[:12]}")
+    else:
+        with load_data(data_dir, ":memory:", lazy=True) as conn:
+            dataset = DelayPredictionDataset(conn)
+        cache.save(key, "DelayPredictionDataset", *dataset.to_arrays())
+    if max_cache_bytes is not None:
+        cache.evict(max_bytes=max_cache_bytes)
+    return dataset
+
+
+class StreamingDelayPredictionDataset(IterableDataset):
+    """
+    The samples of `DelayPredictionDataset` streamed from the processed data.
+
+    Trips are split into chunks of consecutive `global_trip_id`s, the tables
+    are sorted by it, so the query of a chunk only reads its row groups.
+    Chunks are dealt round-robin to the distributed ranks, and within a rank
+    to its DataLoader workers, each reading them with its own connection,
+    positions as Arrow record batches. Samples are shuffled within a buffer,
+    so memory is bounded by the chunk and buffer sizes, not the size of the
+    data.
+
+    Every rank reads the same number of samples in an epoch, the ones of its
+    last chunks beyond the smallest rank's are dropped, so ranks run the same
+    number of steps.
+
+    Args:
+        data_dir: Directory of the processed data, read by `load_data`.
+        trips_per_chunk (int): Trips read by one query.
+        shuffle_buffer (int): Samples shuffled together, 0 keeps the order of the trips.
+        seed (int): Seed of the shuffling, combined with the epoch set by `set_epoch`.
+        batch_rows (int): Position rows of an Arrow record batch.
+    """
+
+    def __init__(
+        self,
+        data_dir,
+        trips_per_chunk: int = 1000,
+        shuffle_buffer: int = 1000,
+        seed: int = 0,
+        batch_rows: int = 65_536,
+    ):
+        self.data_dir = data_dir
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.batch_rows = batch_rows
+        self.epoch = 0
+        with load_data(data_dir, ":memory:", lazy=True) as conn:
+            # Only the first and last trip of every chunk are kept
+            self.chunks = conn.execute(
+                """
+                SELECT min(global_trip_id), max(global_trip_id)
+                FROM (
+                    SELECT global_trip_id, (row_number() OVER (ORDER BY global_trip_id) - 1) // $trips AS chunk
+                    FROM (SELECT DISTINCT global_trip_id FROM hops)
+                )
+                GROUP BY chunk
+                ORDER BY chunk
+                """,
+                parameters={"trips": trips_per_chunk},
+            ).fetchall()
+            trip_samples = conn.execute(
+                f"SELECT global_trip_id, count(1) AS samples FROM ({POSITIONS_SQL}) GROUP BY global_trip_id"
+            ).fetchnumpy()
+            self.stop_id_mapping = get_stop_id_mapping(conn)
+        # Samples of every chunk, what evens out the ranks
+        firsts = np.array([first for first, _ in self.chunks], dtype=np.int64)
+        self.chunk_samples = np.bincount(
+            np.searchsorted(firsts, trip_samples["global_trip_id"], side="right") - 1,
+            weights=trip_samples["samples"],
+            minlength=len(self.chunks),
+        ).astype(np.int64)
+        logger.info(f"Streaming {len(self.chunks):,} chunks of up to {trips_per_chunk:,} trips from: {data_dir}")
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _shard(self) -> tuple[int, int, int, int]:
+        """Rank and world size of the process, id and number of the DataLoader workers of the rank."""
+        rank, world_size = 0, 1
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+        worker_info = get_worker_info()
+        if worker_info is None:
+            return rank, world_size, 0, 1
+        return rank, world_size, worker_info.id, worker_info.num_workers
+
+    def _read_chunk(self, conn: duckdb.DuckDBPyConnection, first: int, last: int, limit: int):
+        """The first `limit` samples of the trips from `first` to `last`, in the order of the trips."""
+        parameters = {"first": first, "last": last}
+        stops_df = conn.execute(
+            f"SELECT * FROM ({STOPS_SQL}) WHERE global_trip_id BETWEEN $first AND $last ORDER BY {STOPS_ORDER}",
+            parameters=parameters,
+        ).fetchdf()
+        add_stop_features(stops_df, list(self.stop_id_mapping))
+        # Columns of the stops as `__getitem__` slices them, the stops of a trip are a range of them
+        stops = {name: stops_df[name].to_numpy() for name in stops_df.columns}
+        del stops_df
+
+        reader = conn.execute(
+            f"SELECT * FROM ({POSITIONS_SQL}) WHERE global_trip_id BETWEEN $first AND $last "
+            f"ORDER BY {POSITIONS_ORDER} LIMIT $limit",
+            parameters=parameters | {"limit": limit},
+        ).fetch_record_batch(self.batch_rows)
+        for record_batch in reader:
+            pos_df = record_batch.to_pandas()
+            add_position_features(pos_df)
+            positions = {name: pos_df[name].to_numpy() for name in pos_df.columns}
+            starts = np.searchsorted(stops["global_trip_id"], positions["global_trip_id"], side="left")
+            ends = np.searchsorted(stops["global_trip_id"], positions["global_trip_id"], side="right")
+            for i in range(len(pos_df)):
+                position = {name: column[i] for name, column in positions.items()}
+                trip_stops = {name: column[starts[i]:ends[i]] for name, column in stops.items()}
+                yield DelayPredictionDataset.build_graph(position, trip_stops)
+
+    def __iter__(self):
+        rank, world_size, worker, num_workers = self._shard()
+        # Every rank and worker shuffles the chunks the same way before taking its own
+        order = np.arange(len(self.chunks))
+        if self.shuffle_buffer > 0:
+            order = np.random.default_rng([self.seed, self.epoch]).permutation(order)
+        samples_per_rank = min(self.chunk_samples[order[r::world_size]].sum() for r in range(world_size))
+        rank_chunks = order[rank::world_size]
+        counts = self.chunk_samples[rank_chunks]
+        limits = np.clip(samples_per_rank - (np.cumsum(counts) - counts), 0, counts)
+        rng = np.random.default_rng([self.seed, self.epoch, rank, worker])
+
+        buffer = []
+        # Every worker has its own connection, of views without copies of the data
+        with load_data(self.data_dir, ":memory:", lazy=True) as conn:
+            for i in range(worker, len(rank_chunks), num_workers):
+                if limits[i] == 0:
+                    continue
+                first, last = self.chunks[rank_chunks[i]]
+                for sample in self._read_chunk(conn, first, last, int(limits[i])):
+                    if len(buffer) < self.shuffle_buffer:
+                        buffer.append(sample)
+                        continue
+                    if self.shuffle_buffer == 0:
+                        yield sample
+                        continue
+                    j = rng.integers(len(buffer))
+                    buffer[j], sample = sample, buffer[j]
+                    yield sample
+        rng.shuffle(buffer)
+        yield from buffer
+
+
 if __name__ == "__main__":
     with load_data("data/processed/", ":memory:") as conn:
         dataset = DelayPredictionDataset(conn)
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# Times are seconds since the start of the trip's service day, they may exceed a day for trips after midnight
+DAY_SECONDS = 86400
+
+
+def seconds_to_sin_cos(seconds) -> tuple[np.ndarray, np.ndarray]:
+    """Encode seconds since the start of a (service) day as a point of the daily cycle, as float32."""
+    angle = 2 * np.pi * (np.asarray(seconds, dtype=np.float64) % DAY_SECONDS) / DAY_SECONDS
+    return np.sin(angle).astype(np.float32), np.cos(angle).astype(np.float32)
+
+
+def sin_cos_sql(column: str) -> tuple[str, str]:
+    """SQL expressions of `seconds_to_sin_cos` of the seconds in `column`."""
+    angle = f"(2 * pi() * ({column} % {DAY_SECONDS}) / {DAY_SECONDS})"
+    return f"sin({angle})::FLOAT", f"cos({angle})::FLOAT"
+
+
+def delay_seconds(actual_seconds, scheduled_seconds) -> np.ndarray:
+    """
+    Seconds the actual time is after the scheduled one, in [-12h, 12h).
+
+    Service day seconds give their difference, clock times on the two sides
+    of midnight, e.g. 23:59 and 00:01, wrap around to the closest delay.
+    """
+    difference = np.asarray(actual_seconds, dtype=np.int64) - np.asarray(scheduled_seconds, dtype=np.int64)
+    return (difference + DAY_SECONDS // 2) % DAY_SECONDS - DAY_SECONDS // 2
+
+
+def delay_sql(actual_column: str, scheduled_column: str) -> str:
+    """SQL expression of `delay_seconds` of two columns of seconds."""
+    # `%` keeps the sign of the dividend in SQL
+    difference = f"({actual_column} - {scheduled_column} + {DAY_SECONDS // 2})"
+    return f"(({difference} % {DAY_SECONDS} + {DAY_SECONDS}) % {DAY_SECONDS} - {DAY_SECONDS // 2})"
+
+
+def embedding_indices(values, vocabulary) -> np.ndarray:
+    """
+    Embedding index of every value: its position in `vocabulary` plus one, 0 if it is not in it.
+
+    Args:
+        values: Values to look up, e.g. stop ids.
+        vocabulary: Distinct values with an embedding, in the order of their indices.
+    """
+    values = np.asarray(values)
+    vocabulary = np.asarray(vocabulary, dtype=values.dtype)
+    if len(vocabulary) == 0:
+        return np.zeros(len(values), dtype=np.int64)
+    order = np.argsort(vocabulary, kind="stable")
+    positions = np.minimum(np.searchsorted(vocabulary[order], values), len(vocabulary) - 1)
+    found = vocabulary[order][positions] == values
+    return np.where(found, order[positions] + 1, 0).astype(np.int64)
+
+
+def add_stop_features(stops_df: pd.DataFrame, stop_ids: list):
+    """
+    Add the stop features computed from the columns of the stops query.
+
+    Args:
+        stops_df (pd.DataFrame): Stops with `stop_id` and the actual and scheduled arrival seconds.
+        stop_ids (list): Stops with an embedding, in the order of their indices.
+    """
+    stops_df["stop_id_int"] = embedding_indices(stops_df["stop_id"].to_numpy(), stop_ids)
+    stops_df["actual_arrival_sin"], stops_df["actual_arrival_cos"] = seconds_to_sin_cos(
+        stops_df["actual_arrival_seconds"].to_numpy()
+    )
+    stops_df["scheduled_arrival_sin"], stops_df["scheduled_arrival_cos"] = seconds_to_sin_cos(
+        stops_df["scheduled_arrival_seconds"].to_numpy()
+    )
+
+
+def add_position_features(pos_df: pd.DataFrame):
+    """Add the position features computed from the columns of the positions query."""
+    pos_df["timestamp_sin"], pos_df["timestamp_cos"] = seconds_to_sin_cos(pos_df["service_seconds"].to_numpy())
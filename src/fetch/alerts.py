@@ -1,4 +1,5 @@
 import pandas as pd
+from google.transit import gtfs_realtime_pb2
 
 from .transit_feed import fetch_trainsit_feed
 
@@ -29,13 +30,7 @@ def parse_alert_entity(entity):
     }
 
 
-def fetch_alerts(api_key=None, timeout=10):
-    feed = fetch_trainsit_feed(
-        feed_type="alerts", api_key=api_key, timeout=timeout
-    )
-    if feed is None:
-        return pd.DataFrame()
-
+def parse_alerts(feed: gtfs_realtime_pb2.FeedMessage) -> pd.DataFrame:
     df = pd.DataFrame([
         parse_alert_entity(entity)
         for entity in feed.entity
@@ -71,6 +66,15 @@ def fetch_alerts(api_key=None, timeout=10):
     return df
 
 
+def fetch_alerts(api_key=None, timeout=10):
+    feed = fetch_trainsit_feed(
+        feed_type="alerts", api_key=api_key, timeout=timeout
+    )
+    if feed is None:
+        return pd.DataFrame()
+    return parse_alerts(feed)
+
+
 if __name__ == "__main__":
     df = fetch_alerts()
     print(df.info(verbose=True))
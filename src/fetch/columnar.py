@@ -0,0 +1,77 @@
+import numpy as np
+import pyarrow as pa
+
+
+class NumericColumn:
+    """Preallocated fixed-width column buffer.
+
+    Slots start out as a null sentinel (NaN for floats, the minimum value for
+    signed integers), so decoders only have to write ``values[i]`` for fields
+    that are present and the null mask is derived in one vectorized pass.
+    """
+
+    def __init__(self, capacity: int, dtype):
+        dtype = np.dtype(dtype)
+        if dtype.kind == "f":
+            self.null = np.nan
+        elif dtype.kind == "i":
+            self.null = np.iinfo(dtype).min
+        else:
+            raise TypeError(f"Unsupported column dtype: {dtype}")
+        self.values = np.full(capacity, self.null, dtype=dtype)
+
+    def to_arrow(self, length: int, type: pa.DataType | None = None) -> pa.Array:
+        values = self.values[:length]
+        mask = np.isnan(values) if values.dtype.kind == "f" else values == self.null
+        return pa.array(values, mask=mask, type=type)
+
+
+class StringColumn:
+    """String column buffer converted to a plain Arrow string array.
+
+    For columns whose values are unique per row (e.g. entity ids), where a
+    dictionary would be as long as the column. Missing fields stay ``None``.
+    """
+
+    def __init__(self, capacity: int):
+        self.values: list = [None] * capacity
+
+    def to_arrow(self, length: int) -> pa.StringArray:
+        return pa.array(self.values[:length], type=pa.string())
+
+
+class DictionaryColumn:
+    """String column buffer that is dictionary-encoded when converted to Arrow.
+
+    Decoders store the raw ``str`` in ``values[i]``, missing fields stay ``None``.
+    """
+
+    def __init__(self, capacity: int):
+        self.values: list = [None] * capacity
+
+    def to_arrow(self, length: int) -> pa.DictionaryArray:
+        return pa.array(self.values[:length], type=pa.string()).dictionary_encode()
+
+
+class EnumColumn:
+    """Column buffer for a protobuf enum, converted to a dictionary of its names.
+
+    Decoders store the raw enum number in ``values[i]``, every name of the enum
+    ends up in the dictionary so the encoding is stable across feeds.
+
+    Args:
+        capacity (int): Number of rows to preallocate.
+        enum_type: Protobuf enum wrapper (e.g. ``VehiclePosition.VehicleStopStatus``).
+    """
+
+    def __init__(self, capacity: int, enum_type):
+        items = sorted(enum_type.items(), key=lambda item: item[1])
+        self.names = [name for name, _ in items]
+        self.numbers = np.array([number for _, number in items], dtype=np.int32)
+        self.values = np.full(capacity, -1, dtype=np.int32)
+
+    def to_arrow(self, length: int) -> pa.DictionaryArray:
+        values = self.values[:length]
+        codes = np.searchsorted(self.numbers, values).astype(np.int32)
+        indices = pa.array(codes, mask=values < 0)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(self.names, type=pa.string()))
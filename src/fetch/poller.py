@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from google.transit import gtfs_realtime_pb2
+
+from .transit_feed import NOT_MODIFIED, ConditionalFeedFetcher
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FeedJob:
+    """
+    A feed polled by `FeedPoller`.
+
+    Args:
+        fetcher (ConditionalFeedFetcher): Fetcher of the feed, keeps its conditional request state.
+        handle (Callable): Called with every new `FeedMessage`, runs on the CPU executor.
+        interval (float): Seconds between two polls.
+        jitter (float): Maximum random delay in seconds added to every poll.
+    """
+    fetcher: ConditionalFeedFetcher
+    handle: Callable[[gtfs_realtime_pb2.FeedMessage], None]
+    interval: float
+    jitter: float = 0.0
+
+    @property
+    def name(self) -> str:
+        return self.fetcher.feed_type
+
+
+class FeedPoller:
+    """
+    Polls several GTFS-realtime feeds concurrently from one asyncio loop.
+
+    Downloads run on an I/O executor with one thread per feed, so a slow
+    response of one feed does not delay the others, and they reuse the pooled
+    keep-alive connections of the module's `requests` session. Parsing and the
+    jobs' handlers run on a CPU executor, by default one thread per feed as
+    well. The number of threads and sockets therefore grows with the number of
+    feeds but not with the poll frequency. A feed is never polled again before
+    its previous handler finished, missed ticks are skipped.
+
+    Args:
+        jobs (list[FeedJob]): Feeds to poll.
+        cpu_workers (int, optional): Threads used for parsing and handling feeds,
+            one per feed if None.
+    """
+
+    def __init__(self, jobs: list[FeedJob], cpu_workers: int | None = None):
+        self.jobs = jobs
+        self.tasks = []
+        num_workers = max(len(jobs), 1)
+        self._io_executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="feed-io")
+        self._cpu_executor = ThreadPoolExecutor(
+            max_workers=cpu_workers if cpu_workers is not None else num_workers, thread_name_prefix="feed-cpu"
+        )
+        self._maintenance_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maintenance")
+        self._stopped = None
+
+    def every(self, interval: float, func: Callable[[], None]):
+        """Run `func` every `interval` seconds on a dedicated maintenance thread."""
+        self.tasks.append((interval, func))
+
+    def stop(self):
+        """Ask the poll loops to finish, safe to call from signal handlers of the loop."""
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def run_in_cpu_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._cpu_executor, func, *args)
+
+    async def _sleep(self, delay: float) -> bool:
+        """Sleep unless stopped in the meantime, returns whether polling should go on."""
+        try:
+            await asyncio.wait_for(self._stopped.wait(), timeout=max(delay, 0.0))
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def _poll(self, job: FeedJob):
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while not self._stopped.is_set():
+            try:
+                content = await loop.run_in_executor(self._io_executor, job.fetcher.fetch_content)
+                if content is NOT_MODIFIED:
+                    logger.info(f"Feed '{job.name}' not modified ({job.fetcher.stats})")
+                elif content is not None:
+                    feed = await self.run_in_cpu_executor(job.fetcher.parse, content)
+                    if feed is not None:
+                        await self.run_in_cpu_executor(job.handle, feed)
+            except Exception:
+                logger.error(f"Error while polling feed '{job.name}':", exc_info=True)
+
+            next_time += job.interval
+            now = loop.time()
+            if next_time < now:
+                skipped = int((now - next_time) // job.interval) + 1
+                logger.warning(f"Feed '{job.name}' is behind schedule, skipping {skipped} poll(s)")
+                next_time += skipped * job.interval
+            if not await self._sleep(next_time - now + random.uniform(0, job.jitter)):
+                break
+
+    async def _repeat(self, interval: float, func: Callable[[], None]):
+        loop = asyncio.get_running_loop()
+        while await self._sleep(interval):
+            try:
+                await loop.run_in_executor(self._maintenance_executor, func)
+            except Exception:
+                logger.error(f"Error while running periodic task '{func}':", exc_info=True)
+
+    async def run(self):
+        """Poll every job until `stop` is called."""
+        self._stopped = asyncio.Event()
+        logger.info(f"Polling feeds: {[job.name for job in self.jobs]}")
+        try:
+            await asyncio.gather(
+                *(self._poll(job) for job in self.jobs),
+                *(self._repeat(interval, func) for interval, func in self.tasks),
+            )
+        finally:
+            for executor in [self._io_executor, self._cpu_executor, self._maintenance_executor]:
+                executor.shutdown(wait=True)
+            logger.info("Feed poller stopped")
@@ -1,5 +1,7 @@
 import logging
 import os
+import time
+from dataclasses import dataclass
 from typing import Literal
 
 import requests
@@ -10,6 +12,9 @@ from google.transit import gtfs_realtime_pb2
 
 FEED_TYPES = Literal["vehicle_pos", "trip_updates", "alerts"]
 
+# Returned by `ConditionalFeedFetcher.fetch` when the feed did not change
+NOT_MODIFIED = object()
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -45,6 +50,16 @@ def get_url(feed_type: FEED_TYPES):
     return urls[feed_type]
 
 
+def get_api_key(api_key=None) -> str:
+    if api_key is None:
+        api_key = os.getenv("BKK_API_KEY")
+    if not api_key:
+        raise ValueError(
+            "API key must be provided via parameter or BKK_API_KEY environment variable."
+        )
+    return api_key
+
+
 def fetch_trainsit_feed(feed_type: FEED_TYPES, api_key=None, timeout=10):
     """
     Fetch and parse a GTFS-realtime feed from the specified URL.
@@ -57,13 +72,7 @@ def fetch_trainsit_feed(feed_type: FEED_TYPES, api_key=None, timeout=10):
     Returns:
         gtfs_realtime_pb2.FeedMessage: Parsed GTFS-realtime feed message.
     """
-    if api_key is None:
-        api_key = os.getenv("BKK_API_KEY")
-    if not api_key:
-        raise ValueError(
-            "API key must be provided via parameter or BKK_API_KEY environment variable."
-        )
-
+    api_key = get_api_key(api_key)
     url = get_url(feed_type)
     try:
         s = get_session()
@@ -81,3 +90,190 @@ def fetch_trainsit_feed(feed_type: FEED_TYPES, api_key=None, timeout=10):
         logger.error(f"Error fetching data: {req_err}")
     except Exception as e:
         logger.error(f"Error parsing data: {e}")
+
+
+def _decode_varint(data: bytes, pos: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def peek_feed_header(content: bytes) -> gtfs_realtime_pb2.FeedHeader | None:
+    """
+    Parse only the `FeedHeader` of a serialized `FeedMessage`.
+
+    Top-level fields are skipped on the wire format until the header (field 1)
+    is found, so none of the entities are decoded.
+    """
+    pos = 0
+    while pos < len(content):
+        key, pos = _decode_varint(content, pos)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            _, pos = _decode_varint(content, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 2:
+            length, pos = _decode_varint(content, pos)
+            if field_number == 1:
+                header = gtfs_realtime_pb2.FeedHeader()
+                header.ParseFromString(content[pos:pos + length])
+                return header
+            pos += length
+        elif wire_type == 5:
+            pos += 4
+        else:
+            return None
+    return None
+
+
+@dataclass
+class FeedStats:
+    requests: int = 0
+    not_modified: int = 0
+    unchanged: int = 0
+    errors: int = 0
+    bytes_received: int = 0
+    parse_seconds: float = 0.0
+
+    @property
+    def skip_rate(self) -> float:
+        if self.requests == 0:
+            return 0.0
+        return (self.not_modified + self.unchanged) / self.requests
+
+    def __str__(self):
+        return (
+            f"{self.requests} requests, {self.skip_rate:.1%} skipped "
+            f"({self.not_modified} not modified, {self.unchanged} unchanged), {self.errors} errors, "
+            f"{self.bytes_received / 1024 ** 2:.2f} MB received, {self.parse_seconds:.2f}s parsing"
+        )
+
+
+class ConditionalFeedFetcher:
+    """
+    Stateful fetcher of one GTFS-realtime feed that skips unchanged snapshots.
+
+    The `ETag` / `Last-Modified` values of the last parsed response are sent back as
+    conditional request headers, and a full response whose `FeedHeader.timestamp`
+    equals the last parsed one is dropped before any entity is decoded. Both
+    cases return `NOT_MODIFIED`, counters are kept in `stats`.
+
+    Args:
+        feed_type (FEED_TYPES): Type of GTFS-realtime feed to fetch.
+        api_key (str, optional): API key for authentication. If None, uses BKK_API_KEY from environment.
+        timeout (int, optional): Timeout for the HTTP requests in seconds.
+        url (str, optional): Overrides the feed's URL, e.g. to point at a local server.
+            The API key is then optional, it is only sent if given or set in the environment.
+    """
+
+    def __init__(self, feed_type: FEED_TYPES, api_key=None, timeout=10, url=None):
+        self.feed_type = feed_type
+        self.api_key = api_key
+        self.timeout = timeout
+        self.url = url if url is not None else get_url(feed_type)
+        self._key_required = url is None
+        self.stats = FeedStats()
+
+        self._etag = None
+        self._last_modified = None
+        self._header_timestamp = None
+        self._pending = None
+
+    def fetch_content(self):
+        """
+        Download the feed without decoding its entities.
+
+        Returns:
+            bytes | None | NOT_MODIFIED: The serialized feed, None on errors or
+                `NOT_MODIFIED` if the feed did not change.
+        """
+        headers = {}
+        if self._etag is not None:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified is not None:
+            headers["If-Modified-Since"] = self._last_modified
+
+        self.stats.requests += 1
+        try:
+            response = get_session().get(
+                self.url,
+                params=self._params(),
+                headers=headers,
+                timeout=self.timeout,
+                allow_redirects=False,
+            )
+            if response.status_code == 304:
+                self.stats.not_modified += 1
+                return NOT_MODIFIED
+            response.raise_for_status()
+
+            content = response.content
+            self.stats.bytes_received += len(content)
+
+            header = peek_feed_header(content)
+            header_timestamp = header.timestamp if header is not None and header.HasField("timestamp") else None
+            if header_timestamp is not None and header_timestamp == self._header_timestamp:
+                self.stats.unchanged += 1
+                return NOT_MODIFIED
+            # Kept once the content parses, a snapshot failing to parse is fetched again
+            self._pending = (response.headers.get("ETag"), response.headers.get("Last-Modified"), header_timestamp)
+            return content
+        except requests.exceptions.HTTPError as http_err:
+            logger.error(f"HTTP error occurred: {http_err}")
+        except requests.exceptions.RequestException as req_err:
+            logger.error(f"Error fetching data: {req_err}")
+        except ValueError as key_err:
+            # Missing API key
+            logger.error(f"Error fetching data: {key_err}")
+        except Exception as e:
+            logger.error(f"Error reading feed header: {e}")
+        self.stats.errors += 1
+        return None
+
+    def _params(self) -> dict:
+        """Query parameters of the requests, a missing key raises `ValueError` for the feed's own URL."""
+        if self._key_required:
+            return {"key": get_api_key(self.api_key)}
+        api_key = self.api_key or os.getenv("BKK_API_KEY")
+        return {"key": api_key} if api_key else {}
+
+    def parse(self, content: bytes):
+        """
+        Parse content returned by `fetch_content`, its snapshot only counts as
+        seen once it parsed.
+
+        Returns:
+            gtfs_realtime_pb2.FeedMessage | None: The parsed feed, None on errors.
+        """
+        start_time = time.perf_counter()
+        try:
+            feed = gtfs_realtime_pb2.FeedMessage()
+            feed.ParseFromString(content)
+            if self._pending is not None:
+                self._etag, self._last_modified, self._header_timestamp = self._pending
+                self._pending = None
+            return feed
+        except Exception as e:
+            logger.error(f"Error parsing data: {e}")
+            self.stats.errors += 1
+            return None
+        finally:
+            self.stats.parse_seconds += time.perf_counter() - start_time
+
+    def fetch(self):
+        """
+        Returns:
+            gtfs_realtime_pb2.FeedMessage | None | NOT_MODIFIED: The parsed feed,
+                None on errors or `NOT_MODIFIED` if the feed did not change.
+        """
+        content = self.fetch_content()
+        if content is None or content is NOT_MODIFIED:
+            return content
+        return self.parse(content)
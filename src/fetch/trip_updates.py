@@ -0,0 +1,159 @@
+import numpy as np
+import pyarrow as pa
+from google.transit import gtfs_realtime_pb2
+
+from .columnar import DictionaryColumn, EnumColumn, NumericColumn
+from .transit_feed import fetch_trainsit_feed
+
+TRIP_UPDATES_SCHEMA = pa.schema([
+    # Trip level fields, repeated for every stop of the trip
+    ("id", pa.dictionary(pa.int32(), pa.string())),
+    ("trip_id", pa.dictionary(pa.int32(), pa.string())),
+    ("route_id", pa.dictionary(pa.int32(), pa.string())),
+    ("start_date", pa.dictionary(pa.int32(), pa.string())),
+    ("trip_schedule_relationship", pa.dictionary(pa.int32(), pa.string())),
+    ("vehicle_id", pa.dictionary(pa.int32(), pa.string())),
+    ("timestamp", pa.timestamp("s", tz="UTC")),
+    ("delay", pa.int32()),
+    # Stop level fields
+    ("stop_sequence", pa.uint16()),
+    ("stop_id", pa.dictionary(pa.int32(), pa.string())),
+    ("arrival_delay", pa.int32()),
+    ("arrival_time", pa.timestamp("s", tz="UTC")),
+    ("departure_delay", pa.int32()),
+    ("departure_time", pa.timestamp("s", tz="UTC")),
+    ("schedule_relationship", pa.dictionary(pa.int32(), pa.string())),
+])
+
+
+def decode_trip_updates(feed: gtfs_realtime_pb2.FeedMessage) -> pa.Table:
+    """
+    Decode the trip update entities of a feed into one flat table.
+
+    Every `stop_time_update` becomes a row, trip updates without any stop
+    update keep a single row with null stop fields. Trip level fields are
+    decoded once per entity and repeated for their stops with a vectorized
+    `take` on the row to entity index.
+
+    Args:
+        feed (gtfs_realtime_pb2.FeedMessage): Parsed TripUpdates feed.
+
+    Returns:
+        pa.Table: Table following `TRIP_UPDATES_SCHEMA`, missing fields are nulls.
+    """
+    num_entities = len(feed.entity)
+    capacity = sum(
+        max(len(entity.trip_update.stop_time_update), 1) for entity in feed.entity
+    )
+    trip_columns = {
+        "id": DictionaryColumn(num_entities),
+        "trip_id": DictionaryColumn(num_entities),
+        "route_id": DictionaryColumn(num_entities),
+        "start_date": DictionaryColumn(num_entities),
+        "trip_schedule_relationship": EnumColumn(num_entities, gtfs_realtime_pb2.TripDescriptor.ScheduleRelationship),
+        "vehicle_id": DictionaryColumn(num_entities),
+        "timestamp": NumericColumn(num_entities, np.int64),
+        "delay": NumericColumn(num_entities, np.int64),
+    }
+    stop_columns = {
+        "stop_sequence": NumericColumn(capacity, np.int64),
+        "stop_id": DictionaryColumn(capacity),
+        "arrival_delay": NumericColumn(capacity, np.int64),
+        "arrival_time": NumericColumn(capacity, np.int64),
+        "departure_delay": NumericColumn(capacity, np.int64),
+        "departure_time": NumericColumn(capacity, np.int64),
+        "schedule_relationship": EnumColumn(capacity, gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.ScheduleRelationship),
+    }
+    parents = np.zeros(capacity, dtype=np.int64)
+    # Bind the buffers to locals, attribute lookups would dominate the loop otherwise
+    (
+        ids, trip_ids, route_ids, start_dates, trip_relationships, vehicle_ids, timestamps, delays,
+    ) = (column.values for column in trip_columns.values())
+    (
+        stop_sequences, stop_ids, arrival_delays, arrival_times,
+        departure_delays, departure_times, stop_relationships,
+    ) = (column.values for column in stop_columns.values())
+
+    i = 0
+    j = 0
+    for entity in feed.entity:
+        if not entity.HasField("trip_update"):
+            continue
+        trip_update = entity.trip_update
+        trip = trip_update.trip
+
+        ids[j] = entity.id
+        if trip.HasField("trip_id"):
+            trip_ids[j] = trip.trip_id
+        if trip.HasField("route_id"):
+            route_ids[j] = trip.route_id
+        if trip.HasField("start_date"):
+            start_dates[j] = trip.start_date
+        if trip.HasField("schedule_relationship"):
+            trip_relationships[j] = trip.schedule_relationship
+        if trip_update.vehicle.HasField("id"):
+            vehicle_ids[j] = trip_update.vehicle.id
+        if trip_update.HasField("timestamp"):
+            timestamps[j] = trip_update.timestamp
+        if trip_update.HasField("delay"):
+            delays[j] = trip_update.delay
+
+        stop_time_updates = trip_update.stop_time_update
+        if len(stop_time_updates) == 0:
+            parents[i] = j
+            i += 1
+        for update in stop_time_updates:
+            parents[i] = j
+            if update.HasField("stop_sequence"):
+                stop_sequences[i] = update.stop_sequence
+            if update.HasField("stop_id"):
+                stop_ids[i] = update.stop_id
+            if update.HasField("arrival"):
+                arrival = update.arrival
+                if arrival.HasField("delay"):
+                    arrival_delays[i] = arrival.delay
+                if arrival.HasField("time"):
+                    arrival_times[i] = arrival.time
+            if update.HasField("departure"):
+                departure = update.departure
+                if departure.HasField("delay"):
+                    departure_delays[i] = departure.delay
+                if departure.HasField("time"):
+                    departure_times[i] = departure.time
+            if update.HasField("schedule_relationship"):
+                stop_relationships[i] = update.schedule_relationship
+            i += 1
+        j += 1
+
+    parents = pa.array(parents[:i])
+    arrays = []
+    for field in TRIP_UPDATES_SCHEMA:
+        if field.name in trip_columns:
+            column, length = trip_columns[field.name], j
+        else:
+            column, length = stop_columns[field.name], i
+
+        if isinstance(column, NumericColumn):
+            # Safe casts raise on overflow instead of wrapping around
+            array = column.to_arrow(length).cast(field.type)
+        else:
+            array = column.to_arrow(length)
+        if field.name in trip_columns:
+            array = array.take(parents)
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=TRIP_UPDATES_SCHEMA)
+
+
+def fetch_trip_updates_table(api_key=None, timeout=10) -> pa.Table:
+    feed = fetch_trainsit_feed(
+        feed_type="trip_updates", api_key=api_key, timeout=timeout
+    )
+    if feed is None:
+        return TRIP_UPDATES_SCHEMA.empty_table()
+    return decode_trip_updates(feed)
+
+
+if __name__ == "__main__":
+    table = fetch_trip_updates_table()
+    print(table.schema)
+    print(table.slice(0, 10).to_pandas())
@@ -1,7 +1,29 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from google.transit import gtfs_realtime_pb2
 
+from .columnar import DictionaryColumn, EnumColumn, NumericColumn, StringColumn
 from .transit_feed import fetch_trainsit_feed
 
+VEHICLE_POSITIONS_SCHEMA = pa.schema([
+    # Unique per row, a dictionary would only add its indices
+    ("id", pa.string()),
+    ("trip_id", pa.dictionary(pa.int32(), pa.string())),
+    ("route_id", pa.dictionary(pa.int32(), pa.string())),
+    ("vehicle_id", pa.dictionary(pa.int32(), pa.string())),
+    ("vehicle_label", pa.dictionary(pa.int32(), pa.string())),
+    ("vehicle_license_plate", pa.dictionary(pa.int32(), pa.string())),
+    ("latitude", pa.float32()),
+    ("longitude", pa.float32()),
+    ("bearing", pa.float32()),
+    ("speed", pa.float32()),
+    ("timestamp", pa.timestamp("s", tz="UTC")),
+    ("current_stop_sequence", pa.uint8()),
+    ("current_status", pa.dictionary(pa.int32(), pa.string())),
+    ("stop_id", pa.dictionary(pa.int32(), pa.string())),
+])
+
 
 def parse_vehicle_entity(entity):
     vehicle = entity.vehicle
@@ -23,13 +45,7 @@ def parse_vehicle_entity(entity):
     }
 
 
-def fetch_vehicle_positions(api_key=None, timeout=10):
-    feed = fetch_trainsit_feed(
-        feed_type="vehicle_pos", api_key=api_key, timeout=timeout
-    )
-    if feed is None:
-        return pd.DataFrame()
-
+def parse_vehicle_positions(feed: gtfs_realtime_pb2.FeedMessage) -> pd.DataFrame:
     df = pd.DataFrame([
         parse_vehicle_entity(entity)
         for entity in feed.entity
@@ -47,10 +63,116 @@ def fetch_vehicle_positions(api_key=None, timeout=10):
         "vehicle_label", "vehicle_license_plate", "stop_id"
     ]
     df[string_columns] = df[string_columns].astype("string")
-            
+
     return df
 
 
+def decode_vehicle_positions(feed: gtfs_realtime_pb2.FeedMessage) -> pa.Table:
+    """
+    Decode the vehicle entities of a feed straight into typed column buffers.
+
+    Unlike `parse_vehicle_positions` no intermediate dict is created per
+    entity: each present field is written into a preallocated buffer, null
+    masks and the dictionary encoding of the repeated string ids are computed in bulk
+    by NumPy / Arrow afterwards.
+
+    Args:
+        feed (gtfs_realtime_pb2.FeedMessage): Parsed VehiclePositions feed.
+
+    Returns:
+        pa.Table: Table following `VEHICLE_POSITIONS_SCHEMA`, missing fields are nulls.
+    """
+    capacity = len(feed.entity)
+    columns = {
+        "id": StringColumn(capacity),
+        "trip_id": DictionaryColumn(capacity),
+        "route_id": DictionaryColumn(capacity),
+        "vehicle_id": DictionaryColumn(capacity),
+        "vehicle_label": DictionaryColumn(capacity),
+        "vehicle_license_plate": DictionaryColumn(capacity),
+        "latitude": NumericColumn(capacity, np.float32),
+        "longitude": NumericColumn(capacity, np.float32),
+        "bearing": NumericColumn(capacity, np.float32),
+        "speed": NumericColumn(capacity, np.float32),
+        "timestamp": NumericColumn(capacity, np.int64),
+        "current_stop_sequence": NumericColumn(capacity, np.int64),
+        "current_status": EnumColumn(capacity, gtfs_realtime_pb2.VehiclePosition.VehicleStopStatus),
+        "stop_id": DictionaryColumn(capacity),
+    }
+    # Bind the buffers to locals, attribute lookups would dominate the loop otherwise
+    (
+        ids, trip_ids, route_ids, vehicle_ids, vehicle_labels, license_plates,
+        latitudes, longitudes, bearings, speeds,
+        timestamps, stop_sequences, statuses, stop_ids,
+    ) = (column.values for column in columns.values())
+
+    i = 0
+    for entity in feed.entity:
+        if not entity.HasField("vehicle"):
+            continue
+        vehicle = entity.vehicle
+        trip = vehicle.trip
+        descriptor = vehicle.vehicle
+        position = vehicle.position
+
+        ids[i] = entity.id
+        if trip.HasField("trip_id"):
+            trip_ids[i] = trip.trip_id
+        if trip.HasField("route_id"):
+            route_ids[i] = trip.route_id
+        if descriptor.HasField("id"):
+            vehicle_ids[i] = descriptor.id
+        if descriptor.HasField("label"):
+            vehicle_labels[i] = descriptor.label
+        if descriptor.HasField("license_plate"):
+            license_plates[i] = descriptor.license_plate
+        if position.HasField("latitude"):
+            latitudes[i] = position.latitude
+        if position.HasField("longitude"):
+            longitudes[i] = position.longitude
+        if position.HasField("bearing"):
+            bearings[i] = position.bearing
+        if position.HasField("speed"):
+            speeds[i] = position.speed
+        if vehicle.HasField("timestamp"):
+            timestamps[i] = vehicle.timestamp
+        if vehicle.HasField("current_stop_sequence"):
+            stop_sequences[i] = vehicle.current_stop_sequence
+        if vehicle.HasField("current_status"):
+            statuses[i] = vehicle.current_status
+        if vehicle.HasField("stop_id"):
+            stop_ids[i] = vehicle.stop_id
+        i += 1
+
+    arrays = []
+    for field in VEHICLE_POSITIONS_SCHEMA:
+        column = columns[field.name]
+        if isinstance(column, NumericColumn):
+            # Safe casts raise on overflow, like the UInt8 cast of the pandas path
+            arrays.append(column.to_arrow(i).cast(field.type))
+        else:
+            arrays.append(column.to_arrow(i))
+    return pa.Table.from_arrays(arrays, schema=VEHICLE_POSITIONS_SCHEMA)
+
+
+def fetch_vehicle_positions(api_key=None, timeout=10):
+    feed = fetch_trainsit_feed(
+        feed_type="vehicle_pos", api_key=api_key, timeout=timeout
+    )
+    if feed is None:
+        return pd.DataFrame()
+    return parse_vehicle_positions(feed)
+
+
+def fetch_vehicle_positions_table(api_key=None, timeout=10) -> pa.Table:
+    feed = fetch_trainsit_feed(
+        feed_type="vehicle_pos", api_key=api_key, timeout=timeout
+    )
+    if feed is None:
+        return VEHICLE_POSITIONS_SCHEMA.empty_table()
+    return decode_vehicle_positions(feed)
+
+
 if __name__ == "__main__":
     df = fetch_vehicle_positions()
     print(df.info(verbose=True))
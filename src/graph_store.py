@@ -0,0 +1,368 @@
+import argparse
+import json
+import logging
+import pathlib
+
+import numpy as np
+import torch
+import torch_geometric
+from torch.utils.data import Dataset, Sampler
+from torch_geometric.data import Batch, HeteroData
+
+from src.data import DelayPredictionDataset, load_dataset
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 2
+# Arrays of a store, saved as `<name>.npy` and memory-mapped when loaded
+STOP_ARRAYS = ["stop_features", "stop_physical_id", "stop_pos"]
+POSITION_ARRAYS = ["position_trip", "bus_features", "past_stops"]
+# Stop rows compared with the times of the positions at once while compiling
+COMPILE_CHUNK_ROWS = 2 ** 22
+
+
+def _ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """The concatenated ranges `starts[i]:starts[i] + lengths[i]`."""
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum(), dtype=np.int64) + np.repeat(starts - offsets, lengths)
+
+
+def compile_graph_store(dataset: DelayPredictionDataset, output_dir: pathlib.Path):
+    """
+    Write the arrays `GraphStoreDataset` builds the graphs of a dataset from.
+
+    Stops are stored contiguously per trip, in the order of `stops_df`, with
+    `trip_offsets` pointing at the first stop of every trip. The past stops
+    of every position, the ones arrived at by its time, are stored as their
+    indices within the trip in `past_stops`, the ones of a position start at
+    its `past_offsets`. Arrivals may decrease along a trip, e.g. when a
+    vehicle reports an earlier stop sequence again, so they are not always
+    a prefix of the trip's stops.
+
+    Args:
+        dataset (DelayPredictionDataset): Dataset whose samples are compiled.
+        output_dir (pathlib.Path): Directory of the store, its arrays are replaced.
+    """
+    stops_df, pos_df = dataset.stops_df, dataset.pos_df
+    trip_ids = stops_df.index.get_level_values("global_trip_id").to_numpy()
+    trip_starts = np.flatnonzero(np.r_[True, trip_ids[1:] != trip_ids[:-1]])
+    trip_offsets = np.r_[trip_starts, len(trip_ids)].astype(np.int64)
+    trips = trip_ids[trip_starts]
+
+    position_trip = np.searchsorted(trips, pos_df["global_trip_id"].to_numpy())
+    if not np.array_equal(trips[np.minimum(position_trip, len(trips) - 1)], pos_df["global_trip_id"].to_numpy()):
+        raise ValueError("Every position must belong to a trip with stops")
+
+    # Past masks of chunks of positions, bounded by the stop rows they compare
+    arrivals = stops_df["actual_arrival_seconds"].to_numpy(np.int64)
+    service_seconds = pos_df["service_seconds"].to_numpy(np.int64)
+    starts = trip_offsets[position_trip]
+    num_stops = trip_offsets[position_trip + 1] - starts
+    cumulative_stops = np.r_[0, np.cumsum(num_stops)]
+    past_counts, past_stops = [], []
+    chunk_start = 0
+    while chunk_start < len(pos_df):
+        # At least one position, however many stops its trip has
+        chunk_end = max(
+            np.searchsorted(cumulative_stops, cumulative_stops[chunk_start] + COMPILE_CHUNK_ROWS, side="right") - 1,
+            chunk_start + 1,
+        )
+        chunk = slice(chunk_start, chunk_end)
+        sample = np.repeat(np.arange(chunk_end - chunk_start), num_stops[chunk])
+        rows = _ranges(starts[chunk], num_stops[chunk])
+        is_past = arrivals[rows] <= service_seconds[chunk][sample]
+        past_counts.append(np.bincount(sample[is_past], minlength=chunk_end - chunk_start))
+        past_stops.append((rows - starts[chunk][sample])[is_past])
+        chunk_start = chunk_end
+    past_offsets = np.r_[0, np.cumsum(np.concatenate(past_counts or [np.zeros(0, np.int64)]))]
+
+    arrays = {
+        "trip_offsets": trip_offsets,
+        "stop_features": stops_df[["scheduled_arrival_sin", "scheduled_arrival_cos", "delay"]].to_numpy(np.float32),
+        "stop_physical_id": stops_df["stop_id_int"].to_numpy(np.int64),
+        "stop_pos": stops_df[["stop_lat", "stop_lon"]].to_numpy(np.float32),
+        "position_trip": position_trip.astype(np.int32),
+        "bus_features": pos_df[["speed", "bearing"]].to_numpy(np.float32),
+        "past_offsets": past_offsets.astype(np.int64),
+        "past_stops": np.concatenate(past_stops or [np.zeros(0, np.int64)]).astype(np.int32),
+    }
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(output_dir / f"{name}.npy", np.ascontiguousarray(array))
+    meta = {
+        "version": STORE_VERSION,
+        "num_trips": len(trips),
+        "num_stops": len(stops_df),
+        "num_positions": len(pos_df),
+        "max_stops": int(np.diff(trip_offsets).max(initial=0)),
+    }
+    with open(output_dir / "meta.json", "w") as f:
+        json.dump(meta, f, indent=2)
+    logger.info(
+        f"Compiled {meta['num_positions']:,} samples of {meta['num_trips']:,} trips "
+        f"({sum(array.nbytes for array in arrays.values()) / 1024 ** 2:.1f} MB) to: {output_dir}"
+    )
+
+
+class GraphStoreDataset(Dataset):
+    """
+    The samples of `DelayPredictionDataset` read from a compiled graph store.
+
+    Graphs are built by slicing the memory-mapped arrays, the edges are
+    slices of index tensors prepared for the longest trip.
+
+    Args:
+        store_dir (pathlib.Path): Directory written by `compile_graph_store`.
+    """
+
+    def __init__(self, store_dir: pathlib.Path):
+        store_dir = pathlib.Path(store_dir)
+        with open(store_dir / "meta.json") as f:
+            self.meta = json.load(f)
+        if self.meta["version"] != STORE_VERSION:
+            raise ValueError(
+                f"Graph store version {self.meta['version']} is not supported, recompile it: {store_dir}"
+            )
+        self.trip_offsets = np.load(store_dir / "trip_offsets.npy")
+        self.past_offsets = np.load(store_dir / "past_offsets.npy")
+        for name in STOP_ARRAYS + POSITION_ARRAYS:
+            setattr(self, name, np.load(store_dir / f"{name}.npy", mmap_mode="r"))
+
+        max_stops = max(self.meta["max_stops"], 1)
+        self.stop_range = torch.arange(max_stops, dtype=torch.long)
+        self.zeros = torch.zeros(max_stops, dtype=torch.long)
+        self.next_edges = torch.stack([self.stop_range[:-1], self.stop_range[1:]], dim=0)
+        self._layout_checked = False
+
+    def __len__(self):
+        return self.meta["num_positions"]
+
+    def __getitem__(self, index: int):
+        trip = self.position_trip[index]
+        start, end = self.trip_offsets[trip], self.trip_offsets[trip + 1]
+        num_stops = end - start
+        is_past = np.zeros(num_stops, dtype=bool)
+        is_past[self.past_stops[self.past_offsets[index]:self.past_offsets[index + 1]]] = True
+        past = torch.from_numpy(np.flatnonzero(is_past))
+        future = torch.from_numpy(np.flatnonzero(~is_past))
+
+        data = HeteroData()
+        x_stop = np.empty((num_stops, 4), dtype=np.float32)
+        x_stop[:, :3] = self.stop_features[start:end]
+        x_stop[~is_past, 2] = 0.0  # Remove delay for future stops
+        x_stop[:, 3] = is_past  # MASK flag
+        data["stop"].x = torch.from_numpy(x_stop)
+        data["stop"].physical_id = torch.from_numpy(np.array(self.stop_physical_id[start:end]))
+        data["stop"].pos = torch.from_numpy(np.array(self.stop_pos[start:end]))
+        data["stop"].y = torch.from_numpy(np.array(self.stop_features[start:end, 2]))
+
+        data["bus"].x = torch.from_numpy(np.array(self.bus_features[index:index + 1]))
+
+        data["stop", "next", "stop"].edge_index = self.next_edges[:, :max(num_stops - 1, 0)]
+        data["stop", "history", "bus"].edge_index = torch.stack([past, self.zeros[:len(past)]], dim=0)
+        data["bus", "predict", "stop"].edge_index = torch.stack([self.zeros[:len(future)], future], dim=0)
+        return data
+
+    def get_batch(self, indices) -> Batch:
+        """
+        The samples of `indices` as one batch, equal to `Batch.from_data_list`.
+
+        Every sample gets its own copy of its trip's stops, the past masks
+        and edges of all samples are computed at once from the node offsets.
+        Positions of the same trip read the same stop rows, so batches of
+        `TripBatchSampler` read few distinct rows. The slice and increment
+        dicts are private to `torch_geometric`, the first batch is checked
+        against `Batch.from_data_list`, see `check_batch_layout`.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        num_graphs = len(indices)
+        trips = self.position_trip[indices]
+        starts = self.trip_offsets[trips]
+        num_stops = self.trip_offsets[trips + 1] - starts
+        past_starts = self.past_offsets[indices]
+        num_past = self.past_offsets[indices + 1] - past_starts
+        stop_ptr = np.r_[0, np.cumsum(num_stops)]
+
+        sample = np.repeat(np.arange(num_graphs), num_stops)
+        local = np.arange(stop_ptr[-1]) - stop_ptr[sample]
+        rows = starts[sample] + local
+        is_past = np.zeros(len(rows), dtype=bool)
+        is_past[np.repeat(stop_ptr[:-1], num_past) + self.past_stops[_ranges(past_starts, num_past)]] = True
+
+        batch = Batch(_base_cls=HeteroData)
+        stop_features = self.stop_features[rows]
+        x_stop = np.empty((len(rows), 4), dtype=np.float32)
+        x_stop[:, :3] = stop_features
+        x_stop[~is_past, 2] = 0.0  # Remove delay for future stops
+        x_stop[:, 3] = is_past  # MASK flag
+        batch["stop"].x = torch.from_numpy(x_stop)
+        batch["stop"].physical_id = torch.from_numpy(self.stop_physical_id[rows])
+        batch["stop"].pos = torch.from_numpy(self.stop_pos[rows])
+        batch["stop"].y = torch.from_numpy(np.ascontiguousarray(stop_features[:, 2]))
+        batch["stop"].batch = torch.from_numpy(sample)
+        batch["stop"].ptr = torch.from_numpy(stop_ptr)
+        batch["bus"].x = torch.from_numpy(self.bus_features[indices])
+        batch["bus"].batch = torch.arange(num_graphs)
+        batch["bus"].ptr = torch.arange(num_graphs + 1)
+
+        next_src = np.flatnonzero(local < num_stops[sample] - 1)
+        past = np.flatnonzero(is_past)
+        future = np.flatnonzero(~is_past)
+        batch["stop", "next", "stop"].edge_index = torch.from_numpy(np.stack([next_src, next_src + 1]))
+        batch["stop", "history", "bus"].edge_index = torch.from_numpy(np.stack([past, sample[past]]))
+        batch["bus", "predict", "stop"].edge_index = torch.from_numpy(np.stack([sample[future], future]))
+
+        # Slices and increments of the samples, what `Batch.to_data_list` and `get_example` read
+        stop_ptr, graphs = torch.from_numpy(stop_ptr), torch.arange(num_graphs)
+        stop_slices = {name: stop_ptr for name in ["x", "physical_id", "pos", "y"]}
+        zeros = torch.zeros(num_graphs, dtype=torch.long)
+        batch._num_graphs = num_graphs
+        batch._slice_dict = {
+            "stop": stop_slices,
+            "bus": {"x": torch.arange(num_graphs + 1)},
+            ("stop", "next", "stop"): {
+                "edge_index": torch.from_numpy(np.r_[0, np.cumsum(np.maximum(num_stops - 1, 0))])
+            },
+            ("stop", "history", "bus"): {"edge_index": torch.from_numpy(np.r_[0, np.cumsum(num_past)])},
+            ("bus", "predict", "stop"): {"edge_index": torch.from_numpy(np.r_[0, np.cumsum(num_stops - num_past)])},
+        }
+        batch._inc_dict = {
+            "stop": {name: zeros for name in stop_slices},
+            "bus": {"x": zeros},
+            ("stop", "next", "stop"): {"edge_index": torch.stack([stop_ptr[:-1], stop_ptr[:-1]], dim=1)[:, :, None]},
+            ("stop", "history", "bus"): {"edge_index": torch.stack([stop_ptr[:-1], graphs], dim=1)[:, :, None]},
+            ("bus", "predict", "stop"): {"edge_index": torch.stack([graphs, stop_ptr[:-1]], dim=1)[:, :, None]},
+        }
+        if not self._layout_checked and num_graphs > 0:
+            check_batch_layout(Batch.from_data_list([self[index] for index in indices]), batch)
+            self._layout_checked = True
+        return batch
+
+
+def check_batch_layout(expected: Batch, actual: Batch):
+    """
+    Raise `RuntimeError` unless two batches have the same tensors, slice and increment dicts.
+
+    `GraphStoreDataset.get_batch` fills the private dicts `torch_geometric`
+    collates into, a version collating differently fails here instead of
+    splitting the batches wrongly.
+    """
+    def differences(expected, actual, path):
+        if isinstance(expected, dict) and isinstance(actual, dict):
+            if expected.keys() != actual.keys():
+                yield f"{path}: keys {sorted(map(str, expected))} != {sorted(map(str, actual))}"
+                return
+            for key in expected:
+                yield from differences(expected[key], actual[key], f"{path}[{key!r}]")
+        elif isinstance(expected, torch.Tensor) and isinstance(actual, torch.Tensor):
+            if expected.dtype != actual.dtype or expected.shape != actual.shape:
+                yield f"{path}: {expected.dtype} {list(expected.shape)} != {actual.dtype} {list(actual.shape)}"
+            elif not torch.equal(expected, actual):
+                yield f"{path}: values differ"
+        elif expected != actual:
+            yield f"{path}: {expected!r} != {actual!r}"
+
+    found = list(differences(expected.num_graphs, actual.num_graphs, "num_graphs"))
+    for key in expected.node_types + expected.edge_types:
+        found.extend(differences(dict(expected[key].items()), dict(actual[key].items()), str(key)))
+    found.extend(differences(expected._slice_dict, actual._slice_dict, "_slice_dict"))
+    found.extend(differences(expected._inc_dict, actual._inc_dict, "_inc_dict"))
+    if found:
+        raise RuntimeError(
+            f"The batches differ from Batch.from_data_list of torch_geometric {torch_geometric.__version__}, "
+            f"update GraphStoreDataset.get_batch: {'; '.join(found[:5])}"
+        )
+
+
+class TripBatchDataset(GraphStoreDataset):
+    """
+    A graph store whose `DataLoader` batches are built at once by `get_batch`.
+
+    Use it with a batch sampler, e.g. `TripBatchSampler`, and
+    `collate_trip_batch`, the batches come pre-collated.
+    """
+
+    def __getitems__(self, indices) -> Batch:
+        return self.get_batch(indices)
+
+
+def collate_trip_batch(batch: Batch) -> Batch:
+    """Collate function of `TripBatchDataset`, its batches are already collated."""
+    return batch
+
+
+class TripBatchSampler(Sampler):
+    """
+    Batches of the positions of a graph store, grouped by their trips.
+
+    Trips are shuffled and their positions are batched in order, so a batch
+    holds the consecutive positions of a few trips, which share their stops.
+
+    Args:
+        dataset (GraphStoreDataset): Dataset whose positions are batched.
+        batch_size (int): Positions per batch.
+        shuffle (bool): Shuffle the order of the trips every epoch.
+        drop_last (bool): Drop the last batch if it is smaller than `batch_size`.
+        seed (int): Seed of the shuffling, combined with the epoch set by `set_epoch`.
+    """
+
+    def __init__(
+        self,
+        dataset: GraphStoreDataset,
+        batch_size: int,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        seed: int = 0,
+    ):
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        # Positions are stored by trip, every run of the same trip is one group
+        position_trip = np.asarray(dataset.position_trip)
+        boundaries = np.flatnonzero(position_trip[1:] != position_trip[:-1]) + 1
+        self.group_starts = np.r_[0, boundaries]
+        self.group_ends = np.r_[boundaries, len(position_trip)]
+        self.num_positions = len(position_trip)
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self):
+        order = np.arange(len(self.group_starts))
+        if self.shuffle:
+            order = np.random.default_rng([self.seed, self.epoch]).permutation(order)
+        lengths = self.group_ends[order] - self.group_starts[order]
+        # Position indices of the groups in their shuffled order
+        indices = np.arange(self.num_positions) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        indices += np.repeat(self.group_starts[order], lengths)
+        for i in range(len(self)):
+            yield indices[i * self.batch_size:(i + 1) * self.batch_size].tolist()
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_positions // self.batch_size
+        return -(-self.num_positions // self.batch_size)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compile the samples of the processed data into a graph store")
+    parser.add_argument("--data-dir", type=str, default="data/processed/", help="Directory of the processed data")
+    parser.add_argument("--output-dir", "-o", type=str, required=True, help="Directory of the graph store")
+    parser.add_argument(
+        "--cache-dir", type=str, default=None,
+        help="Directory of the dataset cache, the dataset is only built from the processed data if it changed"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+    args = parse_args()
+    dataset = load_dataset(args.data_dir, args.cache_dir)
+    compile_graph_store(dataset, pathlib.Path(args.output_dir))
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+
+import duckdb
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def hash_key(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class EntryCache:
+    """
+    Content-addressed store of entries of named items, e.g. tables or arrays.
+
+    Every entry is a directory named after its key holding one file per item
+    and a `meta.json`, which is written last and marks the entry as
+    complete. Entries are written to a temporary directory first, which
+    replaces the entry at once. Keys are computed by the caller, so the
+    cache itself never needs to compare contents. Subclasses write and read
+    the items, see `_write_item` and `_read_item`.
+
+    Args:
+        cache_dir (os.PathLike): Directory of the entries, created if missing.
+    """
+
+    META_FILE = "meta.json"
+    # Suffix of the items' files, and the key of their names in the metadata
+    ITEM_SUFFIX = ""
+    ITEMS_KEY = "items"
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.cache_dir / key
+
+    def _item_path(self, entry_dir: Path, item: str) -> Path:
+        return entry_dir / f"{item}{self.ITEM_SUFFIX}"
+
+    def _write_item(self, path: Path, item: str, value):
+        raise NotImplementedError
+
+    def _read_item(self, path: Path, item: str, target):
+        raise NotImplementedError
+
+    def contains(self, key: str, items=()) -> bool:
+        entry_dir = self._entry_dir(key)
+        if not (entry_dir / self.META_FILE).exists():
+            return False
+        return all(self._item_path(entry_dir, item).exists() for item in items)
+
+    def _save(self, key: str, name: str, items: dict, **meta) -> int:
+        """Write the items of an entry and its metadata, returns the bytes of the items."""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = self.cache_dir / f".{key}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir()
+        num_bytes = 0
+        for item, value in items.items():
+            file_path = self._item_path(tmp_dir, item)
+            self._write_item(file_path, item, value)
+            num_bytes += file_path.stat().st_size
+
+        with open(tmp_dir / self.META_FILE, "w") as f:
+            json.dump({
+                "step": name,
+                self.ITEMS_KEY: list(items),
+                **meta,
+                "num_bytes": num_bytes,
+                "created_at": time.time(),
+            }, f, indent=2)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        return num_bytes
+
+    def _meta(self, key: str) -> dict:
+        with open(self._entry_dir(key) / self.META_FILE) as f:
+            return json.load(f)
+
+    def _load(self, key: str, items, target=None) -> dict:
+        """Read the items of an entry and mark it as used."""
+        entry_dir = self._entry_dir(key)
+        values = {item: self._read_item(self._item_path(entry_dir, item), item, target) for item in items}
+        # The modification time of the marker doubles as the last access time for eviction
+        os.utime(entry_dir / self.META_FILE)
+        return values
+
+    def entries(self) -> list[tuple[Path, dict, float]]:
+        """Complete entries with their metadata and last access time, least recently used first."""
+        result = []
+        for meta_path in self.cache_dir.glob(f"*/{self.META_FILE}"):
+            with open(meta_path) as f:
+                result.append((meta_path.parent, json.load(f), meta_path.stat().st_mtime))
+        return sorted(result, key=lambda entry: entry[2])
+
+    def evict(self, max_bytes: int | None = None, max_age: float | None = None) -> int:
+        """
+        Remove entries unused for more than `max_age` seconds, then the least
+        recently used ones until the cache fits into `max_bytes`.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        entries = self.entries()
+        now = time.time()
+        total_bytes = sum(meta["num_bytes"] for _, meta, _ in entries)
+        removed = 0
+        for entry_dir, meta, last_used in entries:
+            expired = max_age is not None and now - last_used > max_age
+            oversized = max_bytes is not None and total_bytes > max_bytes
+            if not expired and not oversized:
+                continue
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= meta["num_bytes"]
+            removed += 1
+            logger.info(f"Evicted cache entry of '{meta['step']}': {entry_dir.name[:12]}")
+        return removed
+
+
+class StepCache(EntryCache):
+    """
+    Content-addressed store of the tables written by pipeline steps, one
+    parquet file per table, see `EntryCache`.
+    """
+
+    ITEM_SUFFIX = ".parquet"
+    ITEMS_KEY = "tables"
+
+    def _write_item(self, path: Path, item: str, conn: duckdb.DuckDBPyConnection):
+        conn.execute(f"COPY {item} TO '{path}' (FORMAT PARQUET, COMPRESSION zstd)")
+
+    def _read_item(self, path: Path, item: str, conn: duckdb.DuckDBPyConnection):
+        conn.execute(
+            f"CREATE OR REPLACE TABLE {item} AS SELECT * FROM read_parquet($path)", parameters={"path": str(path)}
+        )
+
+    def save(self, conn: duckdb.DuckDBPyConnection, key: str, step_name: str, tables):
+        num_bytes = self._save(key, step_name, {table: conn for table in tables})
+        logger.info(f"Cached {list(tables)} of step '{step_name}' ({num_bytes / 1024 ** 2:.1f} MB): {key[:12]}")
+
+    def load(self, conn: duckdb.DuckDBPyConnection, key: str, table: str):
+        self._load(key, [table], conn)
+
+
+class ArrayCache(EntryCache):
+    """
+    Content-addressed store of named NumPy arrays, e.g. the columns of a
+    dataset, one `.npy` file per array. The `meta.json` also keeps the
+    caller's metadata, see `EntryCache`.
+    """
+
+    ITEM_SUFFIX = ".npy"
+    ITEMS_KEY = "arrays"
+
+    def _write_item(self, path: Path, item: str, array: np.ndarray):
+        np.save(path, array)
+
+    def _read_item(self, path: Path, item: str, target) -> np.ndarray:
+        return np.load(path)
+
+    def save(self, key: str, name: str, arrays: dict[str, np.ndarray], metadata: dict):
+        num_bytes = self._save(key, name, arrays, metadata=metadata)
+        logger.info(f"Cached {len(arrays)} arrays of '{name}' ({num_bytes / 1024 ** 2:.1f} MB): {key[:12]}")
+
+    def load(self, key: str) -> tuple[dict[str, np.ndarray], dict]:
+        """The arrays of an entry and the metadata they were saved with."""
+        meta = self._meta(key)
+        return self._load(key, meta[self.ITEMS_KEY]), meta["metadata"]
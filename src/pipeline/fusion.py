@@ -0,0 +1,165 @@
+import logging
+import re
+from typing import Callable
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+IDENTIFIER = re.compile(r'\w+|"[^"]*"')
+# Keywords following the FROM clause of a query
+FROM_CLAUSE_END = {
+    "WHERE", "GROUP", "HAVING", "QUALIFY", "WINDOW", "ORDER", "LIMIT", "OFFSET", "UNION", "EXCEPT", "INTERSECT",
+    "RETURNING",
+}
+
+
+def _parse_create_table_as(query: str) -> tuple[str, bool, int] | None:
+    """Table name, whether it is temporary and the offset of the query of a `CREATE TABLE ... AS`."""
+    words = []
+    for start, token_type in duckdb.tokenize(query):
+        if token_type not in (duckdb.token_type.keyword, duckdb.token_type.identifier):
+            return None
+        word = IDENTIFIER.match(query, start).group()
+        if word.upper() == "AS" and len(words) >= 2 and words[-2].upper() == "TABLE":
+            select_start = start + len(word)
+            break
+        words.append(word)
+    else:
+        return None
+
+    *prefix, table = words
+    prefix = [word.upper() for word in prefix]
+    if prefix[:1] != ["CREATE"] or prefix[-1:] != ["TABLE"]:
+        return None
+    modifiers = prefix[1:-1]
+    if modifiers[:2] == ["OR", "REPLACE"]:
+        modifiers = modifiers[2:]
+    if modifiers not in ([], ["TEMP"], ["TEMPORARY"]):
+        return None
+    return table.strip('"').lower(), bool(modifiers), select_start
+
+
+def _table_references(query: str):
+    """
+    Offsets and matches of the identifiers naming tables: the ones following
+    `FROM` or `JOIN`, or a comma of the `FROM` clause at its nesting level.
+    Columns, aliases and function names sharing the name of a table are not
+    references.
+    """
+    tokens = duckdb.tokenize(query)
+    # Nesting levels of the parentheses currently in a FROM clause
+    from_levels = set()
+    level = 0
+    previous = None
+    for i, (start, token_type) in enumerate(tokens):
+        end = tokens[i + 1][0] if i + 1 < len(tokens) else len(query)
+        text = query[start:end].strip()
+        if token_type == duckdb.token_type.identifier:
+            if previous in ("FROM", "JOIN") or (previous == "," and level in from_levels):
+                yield start, IDENTIFIER.match(query, start)
+        elif token_type == duckdb.token_type.keyword:
+            text = text.upper()
+            if text == "FROM":
+                from_levels.add(level)
+            elif text in FROM_CLAUSE_END:
+                from_levels.discard(level)
+        elif token_type == duckdb.token_type.operator:
+            for char in text:
+                if char == "(":
+                    level += 1
+                elif char == ")":
+                    from_levels.discard(level)
+                    level -= 1
+        if token_type == duckdb.token_type.operator:
+            previous = text[-1:]
+        elif token_type != duckdb.token_type.comment:
+            previous = text
+
+
+class FusedExecutor:
+    """
+    Executes SQL scripts, deferring the rewrites of tables as a chain of views.
+
+    `CREATE OR REPLACE TABLE t AS <query>` of a fusable table becomes a
+    temporary view of the query, and later statements reading `t` read
+    that view instead, so consecutive rewrites run as one query when the
+    table is finally materialized. Tables are materialized by
+    `materialize`, and before any statement other than a `CREATE TABLE AS`
+    (e.g. `DELETE`, `ALTER` or `DROP`), as those may modify what the views
+    read. `materialized` lists the tables materialized so far.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection the statements are executed on.
+        tables (Iterable[str]): Names of the tables whose rewrites may be deferred.
+        on_execute (Callable, optional): Called after every executed statement, e.g. to
+            collect its profile.
+    """
+
+    def __init__(self, conn: duckdb.DuckDBPyConnection, tables, on_execute: Callable[[], None] | None = None):
+        self.conn = conn
+        self.on_execute = on_execute
+        self.tables = {table.lower() for table in tables}
+        self.views = {}
+        self.materialized = []
+        self._chain = []
+
+    @property
+    def deferred(self) -> list[str]:
+        """Tables whose latest version is a view."""
+        return list(self.views)
+
+    def _rename(self, query: str) -> str:
+        """Replace the table references to deferred tables with their latest view."""
+        if not self.views:
+            return query
+        parts, end = [], 0
+        for start, match in _table_references(query):
+            name = match.group().strip('"').lower()
+            if name not in self.views:
+                continue
+            parts.append(query[end:start] + self.views[name])
+            end = match.end()
+        parts.append(query[end:])
+        return "".join(parts)
+
+    def _execute(self, query: str):
+        self.conn.execute(query)
+        if self.on_execute is not None:
+            self.on_execute()
+
+    def execute(self, sql: str):
+        for statement in duckdb.extract_statements(sql):
+            query = statement.query
+            create = _parse_create_table_as(query)
+            if create is None:
+                self.materialize()
+                self._execute(query)
+                continue
+
+            table, temporary, select_start = create
+            if temporary or table not in self.tables:
+                self._execute(self._rename(query))
+                continue
+
+            view = f"{table}__fused_{len(self._chain)}"
+            self._execute(f"CREATE TEMP VIEW {view} AS {self._rename(query[select_start:])}")
+            self.views[table] = view
+            self._chain.append(view)
+
+    def materialize(self):
+        """Turn the deferred tables into tables, each view chain is executed as one query."""
+        if not self.views:
+            return
+        # Every table is computed before any is replaced, views may read the previous versions
+        for table, view in self.views.items():
+            self._execute(f"CREATE OR REPLACE TABLE {table}__materialized AS SELECT * FROM {view}")
+        for view in reversed(self._chain):
+            self._execute(f"DROP VIEW {view}")
+        for table in self.views:
+            self._execute(f"DROP TABLE IF EXISTS {table}")
+            self._execute(f"ALTER TABLE {table}__materialized RENAME TO {table}")
+        logger.info(f"Materialized {list(self.views)} fusing {len(self._chain)} rewrites")
+        self.materialized.extend(self.views)
+        self.views = {}
+        self._chain = []
@@ -0,0 +1,117 @@
+import logging
+import os
+from pathlib import Path
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+DICTIONARY_TABLE = "id_dictionary"
+# Kinds of ids with the input table and column they are collected from
+ID_SOURCES = {
+    "route": ("trips", "route_id"),
+    "trip": ("trips", "trip_id"),
+    "stop": ("stops", "stop_id"),
+    "vehicle": ("positions", "vehicle_id"),
+}
+# `global_trip_id` packs the date of the trip's scheduled start (days since the
+# epoch) and the keys of its trip and vehicle into a positive BIGINT, so it
+# sorts by date first and the date is known without a lookup
+TRIP_BITS = 24
+VEHICLE_BITS = 23
+DATE_SHIFT = TRIP_BITS + VEHICLE_BITS
+KEY_BITS = {"route": 31, "trip": TRIP_BITS, "stop": 31, "vehicle": VEHICLE_BITS}
+
+
+def update_id_dictionary(path: Path, files: dict[str, list[Path]]) -> int:
+    """
+    Add the ids of the input files missing from the id dictionary at `path`.
+
+    The dictionary maps the string ids of every kind of `ID_SOURCES` to
+    integer keys, starting from 1. Keys are only ever appended, so the keys
+    of earlier runs, shards and date partitions stay valid, and the file is
+    only rewritten when ids were added.
+
+    Args:
+        path (Path): Parquet file of the dictionary, created if missing.
+        files (dict[str, list[Path]]): Parquet files of the input tables, e.g. "trips".
+
+    Returns:
+        int: Number of ids added.
+    """
+    with duckdb.connect(":memory:") as conn:
+        if path.exists():
+            load_id_dictionary(conn, path)
+        else:
+            conn.execute(f"CREATE TABLE {DICTIONARY_TABLE} (kind VARCHAR, id VARCHAR, key INTEGER)")
+        num_ids = conn.table(DICTIONARY_TABLE).count("1").fetchone()[0]
+
+        for kind, (table_name, column) in ID_SOURCES.items():
+            if not files.get(table_name):
+                continue
+            conn.execute(
+                f"""
+                INSERT INTO {DICTIONARY_TABLE}
+                SELECT
+                    $kind,
+                    id,
+                    (SELECT coalesce(max(key), 0) FROM {DICTIONARY_TABLE} WHERE kind = $kind)
+                        + row_number() OVER (ORDER BY id),
+                FROM (
+                    SELECT DISTINCT {column}::VARCHAR AS id FROM read_parquet($files) WHERE id IS NOT NULL
+                    EXCEPT
+                    SELECT id FROM {DICTIONARY_TABLE} WHERE kind = $kind
+                )
+                """,
+                parameters={"kind": kind, "files": [str(file_path) for file_path in files[table_name]]},
+            )
+            max_key = conn.execute(
+                f"SELECT coalesce(max(key), 0) FROM {DICTIONARY_TABLE} WHERE kind = $kind", parameters={"kind": kind}
+            ).fetchone()[0]
+            if max_key >= 2 ** KEY_BITS[kind]:
+                raise ValueError(f"{max_key:,} {kind} ids do not fit into the {KEY_BITS[kind]} bits of their keys")
+
+        added = conn.table(DICTIONARY_TABLE).count("1").fetchone()[0] - num_ids
+        if added > 0:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_name(f".{path.name}.tmp")
+            conn.execute(f"COPY (SELECT * FROM {DICTIONARY_TABLE} ORDER BY kind, key) TO '{tmp_path}' (FORMAT PARQUET)")
+            os.replace(tmp_path, path)
+    logger.info(f"Added {added:,} ids to the id dictionary: {path}")
+    return added
+
+
+def load_id_dictionary(conn: duckdb.DuckDBPyConnection, path: Path):
+    conn.execute(
+        f"CREATE TABLE {DICTIONARY_TABLE} AS SELECT * FROM read_parquet($path)", parameters={"path": str(path)}
+    )
+
+
+def service_date_sql(column: str = "global_trip_id") -> str:
+    """SQL expression of the date packed into a `global_trip_id`."""
+    return f"(DATE '1970-01-01' + ({column} >> {DATE_SHIFT})::INT)"
+
+
+def trip_key_sql(column: str = "global_trip_id") -> str:
+    """SQL expression of the trip key packed into a `global_trip_id`."""
+    return f"(({column} >> {VEHICLE_BITS}) & {2 ** TRIP_BITS - 1})::INT"
+
+
+def trip_key(global_trip_id: int) -> int:
+    """The trip key packed into a `global_trip_id`, as `trip_key_sql`."""
+    return (int(global_trip_id) >> VEHICLE_BITS) & (2 ** TRIP_BITS - 1)
+
+
+def vehicle_key_sql(column: str = "global_trip_id") -> str:
+    """SQL expression of the vehicle key packed into a `global_trip_id`."""
+    return f"({column} & {2 ** VEHICLE_BITS - 1})::INT"
+
+
+def resolve_sql(kind: str, column: str) -> str:
+    """SQL expression of the string id of the key in `column`, read from the id dictionary."""
+    return f"(SELECT id FROM {DICTIONARY_TABLE} WHERE kind = '{kind}' AND key = {column})"
+
+
+def key_sql(kind: str, value: str) -> str:
+    """SQL expression of the key of the string id `value`, read from the id dictionary."""
+    return f"(SELECT key FROM {DICTIONARY_TABLE} WHERE kind = '{kind}' AND id = {value})"
@@ -0,0 +1,88 @@
+import json
+import logging
+import os
+import re
+from datetime import date, datetime
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def partition_date(path: Path) -> date | None:
+    """Date of the partition a file belongs to, taken from the last `YYYY-MM-DD` in its path."""
+    matches = DATE_PATTERN.findall(path.as_posix())
+    if not matches:
+        return None
+    return date.fromisoformat(matches[-1])
+
+
+def list_partitions(data_dir, table_name: str) -> dict[date, list[Path]]:
+    """
+    Group the parquet files of a table by the date partition they belong to.
+
+    Args:
+        data_dir (os.PathLike): Directory searched with the same pattern as `create_table_from_files`.
+        table_name (str): Name of the table, e.g. "positions".
+
+    Returns:
+        dict[date, list[Path]]: Sorted file paths per partition date.
+    """
+    data_dir = Path(data_dir)
+    partitions = {}
+    for path in sorted(data_dir.glob(f"**/*{table_name}*.parquet")):
+        day = partition_date(path.relative_to(data_dir))
+        if day is None:
+            raise ValueError(f"Cannot determine the date partition of: {path}")
+        partitions.setdefault(day, []).append(path)
+    return partitions
+
+
+def fingerprint(paths: list[Path], root: Path) -> dict[str, list[int]]:
+    """Size and modification time of every file, keyed by its path relative to `root`."""
+    result = {}
+    for path in paths:
+        stat = path.stat()
+        result[path.relative_to(root).as_posix()] = [stat.st_size, stat.st_mtime_ns]
+    return result
+
+
+class PartitionManifest:
+    """
+    Records which input files every output date partition was built from.
+
+    A partition is up to date as long as the fingerprints of its inputs did
+    not change, so re-running the pipeline only rebuilds partitions with new,
+    grown or removed input files. The manifest is stored as JSON and replaced
+    atomically on every save.
+
+    Args:
+        path (os.PathLike): Location of the manifest file, created on the first save.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.partitions = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.partitions = json.load(f).get("partitions", {})
+
+    def is_current(self, day: date, inputs: dict[str, list[int]]) -> bool:
+        entry = self.partitions.get(day.isoformat())
+        return entry is not None and entry["inputs"] == inputs
+
+    def record(self, day: date, inputs: dict[str, list[int]], num_rows: dict[str, int]):
+        self.partitions[day.isoformat()] = {
+            "inputs": inputs,
+            "num_rows": num_rows,
+            "processed_at": datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"partitions": dict(sorted(self.partitions.items()))}, f, indent=2)
+        os.replace(tmp_path, self.path)
+        logger.debug(f"Saved manifest with {len(self.partitions)} partitions to: {self.path}")
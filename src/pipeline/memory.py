@@ -0,0 +1,31 @@
+import resource
+import sys
+
+
+def reset_peak_rss():
+    """Reset the peak resident set size of the process, only supported on Linux."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss() -> int:
+    """
+    Peak resident set size of the process in bytes since the last `reset_peak_rss`.
+
+    Falls back to the peak of the whole process lifetime where the peak
+    cannot be reset.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
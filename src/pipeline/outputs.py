@@ -0,0 +1,138 @@
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+
+import duckdb
+
+from src.pipeline.ids import service_date_sql
+
+logger = logging.getLogger(__name__)
+
+# Partition keys that are not columns of the tables, derived from them instead
+PARTITION_EXPRESSIONS = {
+    # `global_trip_id` packs the date of the trip's scheduled start
+    "service_date": service_date_sql("global_trip_id"),
+}
+# Directory value of NULL partition keys, read back as NULL by DuckDB's hive partitioning
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+@dataclass(frozen=True)
+class TableOutput:
+    """
+    How a table is written: its hive partitions, row order and parquet settings.
+
+    Partitioned tables are written to `<table>/<key>=<value>/.../<table>.parquet`,
+    partition keys are either columns or names of `PARTITION_EXPRESSIONS`.
+    Sorting by the keys readers filter on lets them skip row groups using the
+    parquet statistics.
+    """
+    partition_by: tuple[str, ...] = ()
+    order_by: tuple[str, ...] = ()
+    compression_level: int = 3
+    row_group_size: int = 122_880
+
+
+def copy_to_parquet(
+    conn: duckdb.DuckDBPyConnection,
+    query: str,
+    file_path: Path,
+    compression_level: int = 3,
+    row_group_size: int | None = None,
+):
+    """Write the result of a query to a parquet file, replacing it atomically."""
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = file_path.with_name(f".{file_path.name}.tmp")
+    options = f"FORMAT PARQUET, COMPRESSION zstd, COMPRESSION_LEVEL {compression_level}"
+    if row_group_size is not None:
+        options += f", ROW_GROUP_SIZE {row_group_size}"
+    conn.execute(f"COPY ({query}) TO '{tmp_path}' ({options})")
+    os.replace(tmp_path, file_path)
+
+
+def _partition_dir(keys: tuple[str, ...], values: tuple) -> Path:
+    return Path(*(f"{key}={NULL_PARTITION if value is None else value}" for key, value in zip(keys, values)))
+
+
+def write_table(
+    conn: duckdb.DuckDBPyConnection,
+    query: str,
+    output_dir: Path,
+    table_name: str,
+    output: TableOutput,
+    replace: bool = True,
+) -> int:
+    """
+    Write the result of a query as the table `table_name` of `output_dir`.
+
+    Partitions are written one by one from a copy sorted by the partition
+    keys, so every file keeps the order of `output.order_by`. Directories of
+    the first partition key are replaced as a whole, e.g. every route of a
+    service date.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection the query runs on.
+        query (str): Query of the rows to write.
+        output_dir (Path): Directory of the tables.
+        table_name (str): Name of the table, its file or directory name.
+        output (TableOutput): How the table is written.
+        replace (bool): Also remove the partitions that are not in the result, otherwise
+            they are kept, e.g. to write a few days of a table incrementally.
+
+    Returns:
+        int: Number of rows written.
+    """
+    order_by = f" ORDER BY {', '.join(output.order_by)}" if output.order_by else ""
+    if not output.partition_by:
+        copy_to_parquet(
+            conn, f"SELECT * FROM ({query}){order_by}", output_dir / f"{table_name}.parquet",
+            output.compression_level, output.row_group_size,
+        )
+        return conn.execute(f"SELECT count(1) FROM ({query})").fetchone()[0]
+
+    keys = output.partition_by
+    key_columns = [f"__partition_{i}" for i in range(len(keys))]
+    conn.execute(
+        "CREATE OR REPLACE TEMP TABLE __output AS SELECT *, "
+        + ", ".join(f"{PARTITION_EXPRESSIONS.get(key, key)} AS {column}" for key, column in zip(keys, key_columns))
+        + f" FROM ({query}) ORDER BY {', '.join(key_columns + list(output.order_by))}"
+    )
+    partitions = conn.execute(
+        f"SELECT {', '.join(key_columns)}, count(1) FROM __output GROUP BY ALL ORDER BY ALL"
+    ).fetchall()
+
+    table_dir = output_dir / table_name
+    condition = " AND ".join(f"{column} IS NOT DISTINCT FROM ${column}" for column in key_columns)
+    options = (
+        f"FORMAT PARQUET, COMPRESSION zstd, COMPRESSION_LEVEL {output.compression_level}, "
+        f"ROW_GROUP_SIZE {output.row_group_size}"
+    )
+    tmp_dirs = {}
+    num_rows = 0
+    for *values, count in partitions:
+        top_dir = _partition_dir(keys[:1], values[:1])
+        if top_dir not in tmp_dirs:
+            tmp_dirs[top_dir] = table_dir / f".{top_dir}.tmp"
+            shutil.rmtree(tmp_dirs[top_dir], ignore_errors=True)
+        file_path = tmp_dirs[top_dir] / _partition_dir(keys[1:], values[1:]) / f"{table_name}.parquet"
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        # The copy is sorted by the keys, so the filter only reads the row groups of the partition
+        conn.execute(
+            f"COPY (SELECT * EXCLUDE ({', '.join(key_columns)}) FROM __output WHERE {condition}) "
+            f"TO '{file_path}' ({options})",
+            parameters=dict(zip(key_columns, values)),
+        )
+        num_rows += count
+    conn.execute("DROP TABLE __output")
+
+    if replace and table_dir.exists():
+        for path in table_dir.iterdir():
+            if path not in tmp_dirs.values():
+                shutil.rmtree(path) if path.is_dir() else path.unlink()
+    for top_dir, tmp_dir in tmp_dirs.items():
+        shutil.rmtree(table_dir / top_dir, ignore_errors=True)
+        os.replace(tmp_dir, table_dir / top_dir)
+    logger.info(f"Wrote {num_rows:,} rows of '{table_name}' in {len(partitions)} partitions to: {table_dir}")
+    return num_rows
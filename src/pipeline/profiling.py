@@ -0,0 +1,159 @@
+import json
+import logging
+import time
+from pathlib import Path
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+PROFILING_METRICS = [
+    "LATENCY",
+    "OPERATOR_TYPE",
+    "OPERATOR_TIMING",
+    "OPERATOR_CARDINALITY",
+    "SYSTEM_PEAK_BUFFER_MEMORY",
+    "SYSTEM_PEAK_TEMP_DIR_SIZE",
+]
+
+
+class StepProfiler:
+    """
+    Collects DuckDB's `EXPLAIN ANALYZE` metrics of the statements of a step.
+
+    DuckDB only keeps the profile of the last query, so `collect` has to be
+    called right after every statement of interest. Operators are summed
+    up by their type over the statements since `start`.
+
+    Args:
+        conn (duckdb.DuckDBPyConnection): Connection whose queries are profiled.
+    """
+
+    def __init__(self, conn: duckdb.DuckDBPyConnection):
+        self.conn = conn
+        conn.execute("PRAGMA enable_profiling = 'no_output'")
+        conn.execute(
+            "SET custom_profiling_settings = $settings",
+            parameters={"settings": json.dumps({metric: "true" for metric in PROFILING_METRICS})},
+        )
+        self.start()
+
+    def start(self):
+        self.statements = 0
+        self.latency = 0.0
+        self.peak_buffer_memory = 0
+        self.peak_temp_dir_size = 0
+        self.operators = {}
+
+    def collect(self):
+        profile = json.loads(self.conn.get_profiling_information(format="json"))
+        self.statements += 1
+        self.latency += profile.get("latency", 0.0)
+        self.peak_buffer_memory = max(self.peak_buffer_memory, profile.get("system_peak_buffer_memory", 0))
+        self.peak_temp_dir_size = max(self.peak_temp_dir_size, profile.get("system_peak_temp_dir_size", 0))
+
+        nodes = list(profile.get("children", []))
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get("children", []))
+            operator = self.operators.setdefault(node["operator_type"], {"count": 0, "seconds": 0.0, "rows": 0})
+            operator["count"] += 1
+            operator["seconds"] += node.get("operator_timing", 0.0)
+            operator["rows"] += node.get("operator_cardinality", 0)
+
+    def result(self) -> dict:
+        """Metrics collected since `start`, operators sorted by their time."""
+        return {
+            "statements": self.statements,
+            "latency": self.latency,
+            "peak_buffer_memory": self.peak_buffer_memory,
+            "peak_temp_dir_size": self.peak_temp_dir_size,
+            "operators": dict(sorted(self.operators.items(), key=lambda item: -item[1]["seconds"])),
+        }
+
+    def close(self):
+        self.conn.execute("PRAGMA disable_profiling")
+
+
+def make_report(steps: list[dict], **metadata) -> dict:
+    """Report of a run from the step statistics returned by the pipeline."""
+    return {
+        "created_at": time.time(),
+        "duckdb_version": duckdb.__version__,
+        **metadata,
+        "total_seconds": sum(step["seconds"] for step in steps),
+        "steps": steps,
+    }
+
+
+def write_report(report: dict, path: Path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Saved the profiling report to: {path.absolute()}")
+
+
+def read_report(path: Path) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _format_count(count: int | None) -> str:
+    return "-" if count is None else f"{count:,}"
+
+
+def format_report(report: dict, top_operators: int = 3) -> str:
+    """Readable summary of a report, one line per step with its slowest operators."""
+    lines = [f"{'step':<26}{'seconds':>9}{'RSS MB':>9}{'buffer MB':>11}{'spill MB':>10}  rows (in -> out)"]
+    for step in report["steps"]:
+        profile = step.get("profile", {})
+        rows = ", ".join(
+            f"{table} {_format_count(counts['in'])} -> {_format_count(counts['out'])}"
+            for table, counts in step["rows"].items()
+        )
+        lines.append(
+            f"{step['step']:<26}{step['seconds']:>9.3f}{step['peak_rss'] / 1024 ** 2:>9.1f}"
+            f"{profile.get('peak_buffer_memory', 0) / 1024 ** 2:>11.1f}"
+            f"{profile.get('peak_temp_dir_size', 0) / 1024 ** 2:>10.1f}  {rows}"
+        )
+        operators = list(profile.get("operators", {}).items())[:top_operators]
+        if operators:
+            lines.append(" " * 28 + ", ".join(
+                f"{name} {operator['seconds']:.3f}s ({operator['rows']:,} rows)" for name, operator in operators
+            ))
+    lines.append(f"{'total':<26}{report['total_seconds']:>9.3f}")
+    return "\n".join(lines)
+
+
+def compare_reports(baseline: dict, report: dict, threshold: float = 0.1) -> str:
+    """
+    Readable comparison of the step timings and row counts of two reports.
+
+    Steps are matched by their position and name, a step is flagged as a
+    regression when it got slower by more than `threshold` relatively or
+    when the rows it outputs changed.
+    """
+    lines = [f"{'step':<26}{'baseline':>10}{'current':>10}{'change':>9}"]
+    baseline_steps = {(i, step["step"]): step for i, step in enumerate(baseline["steps"])}
+    for i, step in enumerate(report["steps"]):
+        before = baseline_steps.get((i, step["step"]))
+        if before is None:
+            lines.append(f"{step['step']:<26}{'-':>10}{step['seconds']:>10.3f}  new step")
+            continue
+
+        change = step["seconds"] / before["seconds"] - 1 if before["seconds"] > 0 else 0.0
+        flags = []
+        if change > threshold:
+            flags.append("SLOWER")
+        for table, counts in step["rows"].items():
+            previous = before["rows"].get(table, {}).get("out")
+            if counts["out"] is not None and previous is not None and counts["out"] != previous:
+                flags.append(f"{table} rows {previous:,} -> {counts['out']:,}")
+        lines.append(
+            f"{step['step']:<26}{before['seconds']:>10.3f}{step['seconds']:>10.3f}{change:>+9.1%}"
+            + (f"  {', '.join(flags)}" if flags else "")
+        )
+    change = report["total_seconds"] / baseline["total_seconds"] - 1 if baseline["total_seconds"] > 0 else 0.0
+    lines.append(f"{'total':<26}{baseline['total_seconds']:>10.3f}{report['total_seconds']:>10.3f}{change:>+9.1%}")
+    return "\n".join(lines)
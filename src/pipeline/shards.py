@@ -0,0 +1,105 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, Iterable, Iterator
+
+import duckdb
+
+logger = logging.getLogger(__name__)
+
+
+def balance_routes(positions_files: list, trips_files: list, num_shards: int) -> list[list[str]]:
+    """
+    Split the routes into shards with a similar number of positions.
+
+    Positions are attributed to routes through the `trips` table, so every
+    trip, and therefore every `global_trip_id`, belongs to exactly one shard.
+    Routes are assigned greedily, largest first, to the least loaded shard.
+
+    Returns:
+        list[list[str]]: Route ids of each shard, empty shards are dropped.
+    """
+    with duckdb.connect(":memory:") as conn:
+        counts = conn.execute(
+            """
+            SELECT t.route_id, count(1) AS count
+            FROM read_parquet($positions) p
+            JOIN (SELECT DISTINCT trip_id, route_id FROM read_parquet($trips)) t ON p.trip_id = t.trip_id
+            GROUP BY t.route_id
+            ORDER BY count DESC, t.route_id
+            """,
+            parameters={
+                "positions": [str(path) for path in positions_files],
+                "trips": [str(path) for path in trips_files],
+            },
+        ).fetchall()
+
+    shards = [[] for _ in range(num_shards)]
+    loads = [0] * num_shards
+    for route_id, count in counts:
+        i = loads.index(min(loads))
+        shards[i].append(route_id)
+        loads[i] += count
+    logger.info(f"Split {len(counts)} routes into shards of {[load for load in loads if load > 0]} positions")
+    return [sorted(routes) for routes in shards if routes]
+
+
+def worker_config(
+    workers: int,
+    threads: int | None = None,
+    memory_limit: str | None = None,
+    temp_directory: str | None = None,
+) -> dict:
+    """
+    DuckDB settings that split the machine between `workers` processes.
+
+    Args:
+        workers (int): Number of processes running a connection concurrently.
+        threads (int, optional): Threads per connection, defaults to an equal share of the cores.
+        memory_limit (str, optional): Memory limit per connection (e.g. "4GB"), defaults to an
+            equal share of 80% of the physical memory, DuckDB's own default for one connection.
+        temp_directory (str, optional): Directory operators spill to beyond the memory limit,
+            DuckDB's default is used if None.
+    """
+    if threads is None:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    if memory_limit is None:
+        total_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+        memory_limit = f"{int(total_bytes * 0.8 / workers) // 1024 ** 2}MB"
+    config = {"threads": threads, "memory_limit": memory_limit}
+    if temp_directory is not None:
+        config["temp_directory"] = temp_directory
+    return config
+
+
+def _init_worker(level: int):
+    logging.basicConfig(
+        level=level,
+        format="%(asctime)s | %(levelname)s | %(processName)s | %(name)s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+    )
+
+
+def run_tasks(tasks: Iterable[Callable], workers: int) -> Iterator:
+    """
+    Run picklable callables in a pool of `workers` processes, yielding their results in order.
+
+    With a single worker the tasks run in the current process. Workers are
+    spawned rather than forked, so they never inherit DuckDB's threads.
+    """
+    tasks = list(tasks)
+    if workers <= 1:
+        for task in tasks:
+            yield task()
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(logging.getLogger().getEffectiveLevel(),),
+    ) as executor:
+        futures = [executor.submit(task) for task in tasks]
+        for future in futures:
+            yield future.result()
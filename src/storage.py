@@ -0,0 +1,237 @@
+import logging
+import os
+import queue
+import random
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# One long-lived client per connection string, so the underlying HTTP
+# connection pool is shared by every container and every upload
+_service_clients = {}
+_service_clients_lock = threading.Lock()
+
+
+def get_blob_service_client(connection: str):
+    from azure.storage.blob import BlobServiceClient
+
+    with _service_clients_lock:
+        if connection not in _service_clients:
+            _service_clients[connection] = BlobServiceClient.from_connection_string(connection)
+        return _service_clients[connection]
+
+
+class AzureBlobStore:
+    """Blob container on Azure Blob Storage (or an Azurite emulator)."""
+
+    def __init__(self, connection: str, container_name: str):
+        self.name = container_name
+        self.container_client = get_blob_service_client(connection).get_container_client(container_name)
+        self._container_checked = False
+        self._lock = threading.Lock()
+
+    def _ensure_container(self):
+        with self._lock:
+            if self._container_checked:
+                return
+            if not self.container_client.exists():
+                self.container_client.create_container()
+                logger.info(f"Created container: '{self.name}'")
+            self._container_checked = True
+
+    def upload(self, blob_name: str, data: bytes):
+        self._ensure_container()
+        self.container_client.upload_blob(blob_name, data, overwrite=True)
+
+    def download(self, blob_name: str) -> bytes:
+        return self.container_client.download_blob(blob_name).readall()
+
+    def download_to_file(self, blob_name: str, file_path: os.PathLike):
+        with open(file_path, "wb") as f:
+            self.container_client.download_blob(blob_name).readinto(f)
+
+    def upload_file(self, blob_name: str, file_path: os.PathLike):
+        self._ensure_container()
+        with open(file_path, "rb") as f:
+            self.container_client.upload_blob(blob_name, f, overwrite=True)
+
+    def list_names(self) -> list[str]:
+        return list(self.container_client.list_blob_names())
+
+    def delete(self, blob_name: str):
+        self.container_client.delete_blob(blob_name)
+
+
+class LocalBlobStore:
+    """Filesystem stand-in for a blob container, blob names are relative paths."""
+
+    def __init__(self, root: os.PathLike, name: str | None = None):
+        self.root = Path(root)
+        self.name = name if name is not None else self.root.name
+
+    def upload(self, blob_name: str, data: bytes):
+        file_path = self.root / blob_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = file_path.with_name(f".{file_path.name}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, file_path)
+
+    def download(self, blob_name: str) -> bytes:
+        return (self.root / blob_name).read_bytes()
+
+    def download_to_file(self, blob_name: str, file_path: os.PathLike):
+        shutil.copyfile(self.root / blob_name, file_path)
+
+    def upload_file(self, blob_name: str, file_path: os.PathLike):
+        target_path = self.root / blob_name
+        target_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target_path.with_name(f".{target_path.name}.tmp")
+        shutil.copyfile(file_path, tmp_path)
+        os.replace(tmp_path, target_path)
+
+    def list_names(self) -> list[str]:
+        if not self.root.exists():
+            return []
+        return sorted(
+            path.relative_to(self.root).as_posix()
+            for path in self.root.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+
+    def delete(self, blob_name: str):
+        (self.root / blob_name).unlink()
+
+
+class UploadQueue:
+    """
+    Bounded in-process upload queue served by its own worker threads.
+
+    `submit` blocks for at most `put_timeout` seconds when the queue is full
+    (backpressure on the fetch loop), after which the payload is spilled to
+    `spill_dir`. Uploads failing more than `max_retries` times are spilled as
+    well. Spilled payloads are re-queued by idle workers once there is room,
+    those left by earlier processes too when `get_store` resolves their stores.
+
+    Args:
+        spill_dir (os.PathLike): Directory where payloads are written when they cannot be queued.
+        get_store (Callable[[str], object] | None): Store of a store name, used to
+            restore the payloads spilled before the queue was created.
+        max_size (int): Maximum number of payloads waiting for upload.
+        num_workers (int): Number of upload worker threads.
+        max_retries (int): Upload attempts before a payload is spilled.
+        backoff (float): Base delay in seconds for the jittered exponential backoff.
+        put_timeout (float): Seconds `submit` waits for room in the queue.
+    """
+
+    def __init__(
+        self,
+        spill_dir: os.PathLike,
+        get_store: Callable[[str], object] | None = None,
+        max_size: int = 32,
+        num_workers: int = 2,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        put_timeout: float = 5.0,
+    ):
+        self.spill_dir = Path(spill_dir)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.put_timeout = put_timeout
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stores = {}
+        if get_store is not None and self.spill_dir.exists():
+            for store_dir in sorted(self.spill_dir.iterdir()):
+                if store_dir.is_dir() and LocalBlobStore(store_dir).list_names():
+                    logger.info(f"Found spilled uploads of '{store_dir.name}' in: {store_dir}")
+                    self._stores[store_dir.name] = get_store(store_dir.name)
+        self._spill_lock = threading.Lock()
+        self._closing = threading.Event()
+        self._stopped = threading.Event()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"upload-worker-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._restore_spilled()
+
+    def submit(self, store, blob_name: str, data: bytes) -> bool:
+        """Queue `data` for upload, returns False if it had to be spilled to disk."""
+        self._stores[store.name] = store
+        try:
+            self._queue.put((store, blob_name, data), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            logger.warning(f"Upload queue is full, spilling '{store.name}/{blob_name}' to disk")
+            self._spill(store, blob_name, data)
+            return False
+
+    def num_spilled(self) -> int:
+        """Number of payloads waiting in the spill directory."""
+        return sum(len(LocalBlobStore(self.spill_dir / store_name).list_names()) for store_name in list(self._stores))
+
+    def close(self, timeout: float | None = None):
+        """Wait for queued uploads to finish and stop the workers, spilled payloads stay on disk."""
+        # Payloads re-queued after the join would be lost with the workers
+        self._closing.set()
+        with self._spill_lock:
+            pass
+        self._queue.join()
+        self._stopped.set()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _work(self):
+        while not self._stopped.is_set():
+            try:
+                store, blob_name, data = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                self._restore_spilled()
+                continue
+            try:
+                self._upload(store, blob_name, data)
+            finally:
+                self._queue.task_done()
+
+    def _upload(self, store, blob_name: str, data: bytes):
+        for attempt in range(self.max_retries):
+            try:
+                store.upload(blob_name, data)
+                logger.info(f"Uploaded to '{store.name}': '{blob_name}' ({len(data):,} bytes)")
+                return
+            except Exception as e:
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                logger.warning(
+                    f"Upload of '{store.name}/{blob_name}' failed "
+                    f"(attempt {attempt + 1} / {self.max_retries}), retrying in {delay:.1f}s: {e}"
+                )
+                time.sleep(delay)
+        logger.error(f"Giving up on uploading '{store.name}/{blob_name}', spilling to disk")
+        self._spill(store, blob_name, data)
+
+    def _spill(self, store, blob_name: str, data: bytes):
+        LocalBlobStore(self.spill_dir / store.name).upload(blob_name, data)
+
+    def _restore_spilled(self):
+        # Only one idle worker scans the spill directory at a time
+        if self._closing.is_set() or not self._spill_lock.acquire(blocking=False):
+            return
+        try:
+            for store_name, store in list(self._stores.items()):
+                spilled = LocalBlobStore(self.spill_dir / store_name)
+                for blob_name in spilled.list_names():
+                    data = spilled.download(blob_name)
+                    spilled.delete(blob_name)
+                    try:
+                        self._queue.put_nowait((store, blob_name, data))
+                    except queue.Full:
+                        spilled.upload(blob_name, data)
+                        return
+                    logger.info(f"Re-queued spilled upload: '{store_name}/{blob_name}'")
+        finally:
+            self._spill_lock.release()
@@ -1,40 +1,119 @@
+import weakref
+from functools import lru_cache
+
+import pandas as pd
 import plotly.express as px
 from duckdb import DuckDBPyConnection
 
+from src.pipeline.ids import key_sql, resolve_sql, service_date_sql, trip_key
+
+# Positions with the string ids of their trip and vehicle instead of their keys, filters
+# appended to it still apply to the keys
+RESOLVED_POSITIONS = f"""
+SELECT * REPLACE (
+    {resolve_sql("trip", "trip_id")} AS trip_id,
+    {resolve_sql("vehicle", "vehicle_id")} AS vehicle_id,
+)
+FROM positions"""
+# Temporary table of the stops of every trip with their hover labels, sorted by trip
+TRIP_STOPS_TABLE = "trip_stop_labels"
+
+_lookups = weakref.WeakKeyDictionary()
+
+
+class TripLookup:
+    """
+    Cached lookups of the positions and stops the plots show.
+
+    The stops of every trip are labelled once, into a temporary table sorted
+    by trip, so the zone maps of its row groups skip the other trips.
+    Positions are partitioned by service date and sorted by trip, a trip's
+    lookup only reads the row groups of its day holding it. The results of
+    the last `cache_size` lookups of every kind are kept, treat them as
+    read-only. Only a weak reference of the connection is kept, keep it open
+    while the lookup is used.
+
+    Args:
+        conn (DuckDBPyConnection): Connection of `load_data`.
+        cache_size (int): Lookups kept of every kind.
+    """
+
+    def __init__(self, conn: DuckDBPyConnection, cache_size: int = 128):
+        # The lookups of `get_lookup` would keep their connections alive otherwise
+        self.conn = weakref.proxy(conn)
+        # Seconds since the start of the service day, trips past midnight stay above 24:00
+        conn.execute(f"""
+CREATE OR REPLACE TEMP TABLE {TRIP_STOPS_TABLE} AS
+SELECT
+    st.trip_id,
+    s.stop_id,
+    {resolve_sql("stop", "s.stop_id")} || '<br>' || s.stop_name AS label,
+    s.stop_lat,
+    s.stop_lon,
+    list(
+        format('{{:02d}}:{{:02d}}', st.arrival_seconds // 3600, st.arrival_seconds // 60 % 60)
+        ORDER BY st.arrival_seconds
+    ) AS times,
+FROM stop_times st
+    JOIN stops s ON s.stop_id = st.stop_id
+GROUP BY st.trip_id, s.stop_id, s.stop_name, s.stop_lat, s.stop_lon
+ORDER BY st.trip_id""")
+        self.trip_positions = lru_cache(maxsize=cache_size)(self._trip_positions)
+        self.vehicle_positions = lru_cache(maxsize=cache_size)(self._vehicle_positions)
+        self.trip_stops = lru_cache(maxsize=cache_size)(self._trip_stops)
+
+    def _trip_positions(self, global_trip_id: int) -> pd.DataFrame:
+        # The service date packed into the trip's id prunes the partitions of other days
+        return self.conn.sql(
+            f"""{RESOLVED_POSITIONS}
+WHERE service_date = {service_date_sql("$global_trip_id::BIGINT")} AND global_trip_id = $global_trip_id
+ORDER BY timestamp ASC""",
+            params={"global_trip_id": global_trip_id},
+        ).to_df()
+
+    def _vehicle_positions(self, vehicle_id: str, from_t: str, to_t: str) -> pd.DataFrame:
+        # Trips may start the day before or after their positions' timestamps
+        return self.conn.sql(
+            f"""{RESOLVED_POSITIONS}
+WHERE service_date BETWEEN $from::DATE - 1 AND $to::DATE + 1
+    AND vehicle_id = {key_sql("vehicle", "$vehicle_id")} AND timestamp BETWEEN $from AND $to
+ORDER BY timestamp""",
+            params={"vehicle_id": vehicle_id, "from": from_t, "to": to_t},
+        ).to_df()
 
-def plot_trip(conn: DuckDBPyConnection, global_trip_id: str):
-    positions_query = """
-SELECT * FROM positions 
-WHERE global_trip_id = $global_trip_id 
-ORDER BY timestamp ASC"""
-    positions = conn.sql(
-        positions_query, params={"global_trip_id": global_trip_id}
-    ).to_df()
+    def _trip_stops(self, trip_keys: tuple[int, ...]) -> pd.DataFrame:
+        """The stops of the trips, labelled with their arrival times of all of them."""
+        # The range of the keys is what the zone maps can prune on
+        return self.conn.sql(
+            f"""
+SELECT
+    label || '<br>' || array_to_string(flatten(list(times ORDER BY trip_id)), ', ') AS text,
+    stop_lat,
+    stop_lon,
+FROM {TRIP_STOPS_TABLE}
+WHERE trip_id BETWEEN $first AND $last AND list_contains($trips, trip_id)
+GROUP BY stop_id, label, stop_lat, stop_lon""",
+            params={"trips": list(trip_keys), "first": min(trip_keys), "last": max(trip_keys)},
+        ).to_df()
+
+
+def get_lookup(conn: DuckDBPyConnection) -> TripLookup:
+    """The `TripLookup` of a connection, created on its first use and kept as long as the connection."""
+    if conn not in _lookups:
+        _lookups[conn] = TripLookup(conn)
+    return _lookups[conn]
+
+
+def plot_trip(conn: DuckDBPyConnection, global_trip_id: int):
+    lookup = get_lookup(conn)
+    positions = lookup.trip_positions(global_trip_id)
 
     assert (
         len(positions) > 0
     ), f"No positions found for the specified global_trip_id: {global_trip_id}"
     assert positions["trip_id"].nunique() == 1
-    trip_id: str = positions.at[0, "trip_id"]
-
-    stops_query = """
-SELECT 
-    s.stop_id, 
-    s.stop_name, 
-    s.stop_lat, 
-    s.stop_lon, 
-    array_agg(st.arrival_time) AS time
-FROM stops s 
-    JOIN stop_times st ON s.stop_id = st.stop_id AND $trip_id = st.trip_id 
-GROUP BY s.stop_id, s.stop_name, s.stop_lat, s.stop_lon"""
-    stops = conn.sql(stops_query, params={"trip_id": trip_id}).to_df()
-    stops["text"] = (
-        stops["stop_id"].astype(str)
-        + "<br>"
-        + stops["stop_name"].astype(str)
-        + "<br>"
-        + stops["time"].apply(lambda x: ", ".join([t.strftime("%H:%M") for t in x]))
-    )
+
+    stops = lookup.trip_stops((trip_key(global_trip_id),))
 
     fig = px.line_map(
         positions,
@@ -60,41 +139,15 @@ GROUP BY s.stop_id, s.stop_name, s.stop_lat, s.stop_lon"""
 
 
 def plot_positions(conn: DuckDBPyConnection, vehicle_id: str, from_t: str, to_t: str):
-    positions_query = """
-SELECT * FROM positions 
-WHERE vehicle_id = $vehicle_id AND timestamp BETWEEN $from AND $to 
-ORDER BY timestamp"""
-    positions = conn.sql(
-        positions_query,
-        params={"vehicle_id": vehicle_id, "from": from_t, "to": to_t},
-    ).to_df()
+    lookup = get_lookup(conn)
+    positions = lookup.vehicle_positions(vehicle_id, from_t, to_t)
 
     assert (
         len(positions) > 0
     ), f"No positions found for the specified vehicle_id: {vehicle_id}"
 
-    stops_query = """
-SELECT 
-    s.stop_id,
-    s.stop_name, 
-    s.stop_lat, 
-    s.stop_lon, 
-    array_agg(st.arrival_time) AS time
-FROM stops s 
-JOIN stop_times st ON s.stop_id = st.stop_id 
-WHERE list_contains($stops, s.stop_id) AND list_contains($trips, st.trip_id)
-GROUP BY s.stop_id, s.stop_name, s.stop_lat, s.stop_lon"""
-    stops = conn.sql(
-        stops_query,
-        params={"stops": positions["stop_id"].unique(), "trips": positions["trip_id"].unique()},
-    ).to_df()
-    stops["text"] = (
-        stops["stop_id"].astype(str)
-        + "<br>"
-        + stops["stop_name"].astype(str)
-        + "<br>"
-        + stops["time"].apply(lambda x: ", ".join([t.strftime("%H:%M") for t in x]))
-    )
+    # Positions no longer have a stop id, the stops of their trips are shown
+    stops = lookup.trip_stops(tuple(sorted({trip_key(trip) for trip in positions["global_trip_id"].unique()})))
 
     fig = px.line_map(
         positions, lat="latitude", lon="longitude", zoom=12, map_style="outdoors", color="trip_id",
@@ -102,8 +155,8 @@ GROUP BY s.stop_id, s.stop_name, s.stop_lat, s.stop_lon"""
     )
     fig.update_traces(mode="markers+lines", marker={"size": 10}, line={"width": 3})
     fig.add_scattermap(
-        lon=stops["stop_lon"], lat=stops["stop_lat"], 
-        mode="markers", marker={"size": 12}, 
+        lon=stops["stop_lon"], lat=stops["stop_lat"],
+        mode="markers", marker={"size": 12},
         text=stops["text"]
     )
     fig.update_layout(margin=dict(l=0, r=0, t=0, b=0), showlegend=False)